@@ -1,5 +1,6 @@
 import csv
 import argparse
+import asyncio
 import logging
 import os
 from near_dedup.deduplicator.deduplicator import DocumentDeduplicator
@@ -9,6 +10,16 @@ from near_dedup.baselines.baselines import (
     find_jaccard_duplicates,
 )
 from near_dedup.lsh.lsh import LSH, LSHImproved
+from near_dedup.lsh.forest import LSHForest
+from near_dedup.lsh.simhash import SimHashIndex
+from near_dedup.service.service import DedupService
+from near_dedup.signatures.signatures import SignatureStore
+from near_dedup.cache.cache import SignatureCache
+from near_dedup.checkpoint.checkpoint import CheckpointManager, index_documents
+from near_dedup.pipeline.pipeline import IngestPipeline, read_documents
+from near_dedup.sweep.sweep import ParameterSweep, load_clusters
+from near_dedup.window.window import SlidingWindowDeduplicator
+from near_dedup.output.output import OUTPUT_EXTENSIONS, OUTPUT_FORMATS, open_writer
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +37,17 @@ dataset_size_mapping = {
 }
 
 
+def parse_size(value):
+    """
+    Parse a byte size such as '512M', '2G' or '1048576'.
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
 def load_documents(file_path):
     """
     Load documents from a TSV file, where each line is treated as a separate document.
@@ -44,25 +66,88 @@ def load_documents(file_path):
     return documents
 
 
-def save_results(clusters, output_file):
+def save_results(
+    clusters, output_file, output_format="text", num_documents=None, similarity=None
+):
     """
-    Save the deduplication clusters to an output file in the specified format.
+    Stream the deduplication clusters to an output file in the specified format.
     """
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, "w") as file:
-        for cluster in clusters:
-            sorted_cluster = sorted(cluster)  # Sort for consistent output
-            file.write(" ".join(map(str, sorted_cluster)) + "\n")
+    with open_writer(output_format, output_file, num_documents, similarity) as writer:
+        writer.write_all(clusters)
     logging.info(f"Results saved to {output_file}.")
 
 
-def generate_output_filename(input_file, algorithm):
+def save_sweep_report(reports, output_file):
+    """
+    Save one CSV row of parameters, quality, runtime and memory per sweep configuration.
+    """
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    fields = list(dict.fromkeys(key for report in reports for key in report))
+    with open(output_file, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(reports)
+    logging.info(f"Sweep report saved to {output_file}.")
+
+
+def run_pipeline(lsh, args):
+    """
+    Stream the input file through the read/hash/index pipeline into an LSH index.
+    """
+    pipeline = IngestPipeline(lsh, workers=args.workers, batch_size=args.batch_size)
+    pipeline.run(read_documents(args.input_file))
+    return pipeline.stages["index"].items
+
+
+def signature_similarity(lsh, output_format):
     """
-    Generate the output filename based on the input file and algorithm.
+    Keep the signatures an LSH index computes for the 'csv' similarity column.
+
+    The signatures are stored as documents are indexed, so writing the column signs
+    nothing again. Returns the similarity callback, or None for the other formats.
+    """
+    if output_format != "csv":
+        return None
+    signatures = SignatureStore(lsh.num_hashes)
+    lsh.set_signature_store(signatures)
+    return signatures.similarity
+
+
+def apply_stop_shingle_filter(lsh, documents, max_df):
+    """
+    Count shingle document frequencies and drop shingles above the cutoff before MinHash.
+    """
+    if max_df is None:
+        return
+    cutoff = int(max_df * len(documents)) if max_df < 1 else int(max_df)
+    lsh.set_stop_shingle_filter(lsh.document_frequency_sketch(documents), cutoff)
+    logging.info(f"Dropping shingles found in more than {cutoff} documents.")
+
+
+def checkpoint_params(args, num_documents):
+    """
+    Collect the parameters a checkpoint must match to be resumed.
+    """
+    return {
+        "input_file": os.path.abspath(args.input_file),
+        "num_documents": num_documents,
+        "num_bands": args.num_bands,
+        "rows_per_band": args.rows_per_band,
+        "num_hashes": args.num_hashes,
+        "shingle_size": args.shingle_size,
+        "minhash": args.minhash,
+        "max_df": args.max_df,
+    }
+
+
+def generate_output_filename(input_file, algorithm, output_format="text"):
+    """
+    Generate the output filename based on the input file, algorithm and output format.
     """
     dataset_name = os.path.basename(input_file)
     dataset_size = dataset_size_mapping.get(dataset_name, "unknown")
-    output_file = f"results/{dataset_size}-{algorithm}.txt"
+    extension = OUTPUT_EXTENSIONS[output_format]
+    output_file = f"results/{dataset_size}-{algorithm}.{extension}"
     return output_file
 
 
@@ -82,9 +167,14 @@ def main():
             "lsh",
             "improved_lsh",
             "union_find_lsh",
+            "simhash",
+            "lsh_forest",
+            "serve",
+            "sweep",
+            "window",
         ],
         required=True,
-        help="Mode of operation: 'dedup' for collection deduplication, 'search' for nearest neighbors, 'baseline' to run baselines, 'lsh' for base LSH, 'improved_lsh' for optimized LSH, 'union_find_lsh' for Union-Find enhanced LSH.",
+        help="Mode of operation: 'dedup' for collection deduplication, 'search' for nearest neighbors, 'baseline' to run baselines, 'lsh' for base LSH, 'improved_lsh' for optimized LSH, 'union_find_lsh' for Union-Find enhanced LSH, 'simhash' for SimHash with Hamming-distance matching, 'lsh_forest' for LSH Forest with a query-time threshold, 'serve' to run the local dedup/query service, 'sweep' to evaluate many LSH (bands, rows, probes) settings from one set of signatures, 'window' to find duplicates only among the most recent documents of a stream.",
     )
 
     # Input file containing documents
@@ -148,15 +238,248 @@ def main():
         default=1,
         help="Number of additional probes for multi-probe LSH (default: 1)",
     )
+    parser.add_argument(
+        "--minhash",
+        type=str,
+        choices=["classic", "oph"],
+        default="classic",
+        help="MinHash method: 'classic' or 'oph' for one-permutation hashing (default: classic)",
+    )
+
+    parser.add_argument(
+        "--signature_bits",
+        type=int,
+        choices=[1, 2, 3, 4, 5, 6, 7, 8, 32],
+        help="Store dedup signatures as 32-bit truncated or b-bit (1-8) values (default: full width)",
+    )
+
+    parser.add_argument(
+        "--max_bucket_size",
+        type=int,
+        help="Largest number of documents per LSH bucket (default: unlimited)",
+    )
+    parser.add_argument(
+        "--heavy_bucket_policy",
+        type=str,
+        choices=["cap", "sample", "split"],
+        default="cap",
+        help="How to handle full LSH buckets: 'cap', 'sample' or 'split' (default: cap)",
+    )
+
+    parser.add_argument(
+        "--max_df",
+        type=float,
+        help="Drop shingles found in more than this many documents (or this fraction, if below 1) before MinHash.",
+    )
+
+    parser.add_argument(
+        "--keep_all_features",
+        action="store_true",
+        help="Keep every distinct document's features in 'lsh'/'improved_lsh' mode, so exact duplicates are never re-signed however far apart (memory grows with the distinct documents; default: the last 128).",
+    )
+
+    parser.add_argument(
+        "--memory_budget",
+        type=parse_size,
+        help="Cluster 'lsh' mode out of core, spilling band records to disk within this many bytes (e.g. 512M).",
+    )
+    parser.add_argument(
+        "--two_pass",
+        action="store_true",
+        help="Index 'lsh' mode in two passes, keeping only band buckets shared by at least two documents",
+    )
+    parser.add_argument(
+        "--bloom_filter_type",
+        type=str,
+        choices=["standard", "blocked"],
+        default="standard",
+        help="Bloom filter for 'dedup' mode exact duplicates: 'standard' or cache-line 'blocked' (default: standard)",
+    )
+    parser.add_argument(
+        "--estimate_capacity",
+        action="store_true",
+        help="Size the 'dedup' mode Bloom filter and signature storage from a HyperLogLog estimate of the distinct documents",
+    )
+    parser.add_argument(
+        "--capacity_sample_size",
+        type=int,
+        help="Base --estimate_capacity on a random sample of this many documents (default: all)",
+    )
+    parser.add_argument(
+        "--max_memory",
+        type=parse_size,
+        help="Fit 'dedup' mode into this many bytes (e.g. 2G), narrowing signatures and spilling band tables as needed; fails fast if impossible.",
+    )
+    parser.add_argument(
+        "--spill_dir",
+        type=str,
+        help="Directory for out-of-core run files (default: a temporary directory).",
+    )
+
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        help="Checkpoint 'lsh' mode signatures to this directory so an interrupted run can be resumed.",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        type=int,
+        default=10000,
+        help="Number of documents between checkpoints (default: 10000)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last consistent checkpoint in --checkpoint_dir.",
+    )
+
+    parser.add_argument(
+        "--signature_cache",
+        type=str,
+        help="SQLite file caching minhash signatures across runs, so re-runs only hash new content.",
+    )
+    parser.add_argument(
+        "--signature_cache_size",
+        type=parse_size,
+        default=1024**3,
+        help="Largest size of the signature cache before least recently used entries are evicted (default: 1G)",
+    )
+
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="Cluster output: 'text' lines of document IDs, 'npy' doc_id -> cluster_id array, or 'csv' (doc_id, cluster_id, similarity) rows (default: text)",
+    )
+
+    # Pipeline configuration arguments
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Stream 'lsh'/'improved_lsh' input through overlapping read, parallel hash and index stages.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of hashing processes for --pipeline (default: CPU count)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=256,
+        help="Documents per pipeline batch (default: 256)",
+    )
+
+    # Sweep configuration arguments
+    parser.add_argument(
+        "--sweep_bands",
+        type=int,
+        nargs="+",
+        default=[5, 10, 20],
+        help="Numbers of bands to sweep (default: 5 10 20)",
+    )
+    parser.add_argument(
+        "--sweep_rows",
+        type=int,
+        nargs="+",
+        default=[2, 5],
+        help="Rows per band to sweep (default: 2 5)",
+    )
+    parser.add_argument(
+        "--sweep_probes",
+        type=int,
+        nargs="+",
+        default=[0, 1],
+        help="Numbers of multi-probe probes to sweep (default: 0 1)",
+    )
+    parser.add_argument(
+        "--baseline_file",
+        type=str,
+        help="Reference clusters for sweep precision/recall (default: the dataset's baseline results, if present).",
+    )
+
+    # Sliding-window configuration arguments
+    parser.add_argument(
+        "--window_generations",
+        type=int,
+        default=4,
+        help="Number of generations in the 'window' mode ring (default: 4)",
+    )
+    parser.add_argument(
+        "--generation_size",
+        type=int,
+        default=10000,
+        help="Documents per 'window' mode generation; the oldest generation expires as a new one starts (default: 10000)",
+    )
+
+    # SimHash configuration arguments
+    parser.add_argument(
+        "--max_distance",
+        type=int,
+        default=3,
+        help="Maximum Hamming distance between SimHash fingerprints (default: 3)",
+    )
+
+    # Service configuration arguments
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Service host (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Service TCP port (default: 8765)"
+    )
+    parser.add_argument(
+        "--socket_path",
+        type=str,
+        help="Serve on this Unix socket path instead of TCP.",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=64,
+        help="Maximum requests per micro-batch (default: 64)",
+    )
+    parser.add_argument(
+        "--max_batch_delay",
+        type=float,
+        default=0.005,
+        help="Maximum seconds a request waits for its micro-batch to fill (default: 0.005)",
+    )
+    parser.add_argument(
+        "--max_queue_size",
+        type=int,
+        default=1024,
+        help="Maximum queued requests before new ones are rejected (default: 1024)",
+    )
 
     # Parse arguments
     args = parser.parse_args()
+    if args.pipeline:
+        if args.mode not in ("lsh", "improved_lsh"):
+            parser.error("--pipeline only applies to 'lsh' and 'improved_lsh' modes.")
+        if args.checkpoint_dir or args.max_df or args.signature_cache:
+            parser.error(
+                "--pipeline cannot be combined with --checkpoint_dir, --max_df or --signature_cache."
+            )
+    if args.two_pass:
+        if args.mode != "lsh":
+            parser.error("--two_pass only applies to 'lsh' mode.")
+        if args.pipeline or args.checkpoint_dir:
+            parser.error("--two_pass cannot be combined with --pipeline or --checkpoint_dir.")
 
-    # Load documents from the input file
-    documents = load_documents(args.input_file)
+    # Load documents from the input file (the pipeline streams them instead)
+    documents = None if args.pipeline else load_documents(args.input_file)
 
     # Generate output filename based on mode and dataset size
-    output_file = generate_output_filename(args.input_file, args.mode)
+    output_file = generate_output_filename(
+        args.input_file, args.mode, args.output_format
+    )
+
+    signature_cache = None
+    if args.signature_cache is not None:
+        signature_cache = SignatureCache(
+            args.signature_cache, max_bytes=args.signature_cache_size
+        )
 
     # Deduplication Mode
     if args.mode == "dedup":
@@ -164,25 +487,34 @@ def main():
         deduplicator = DocumentDeduplicator(
             bloom_filter_params=(1000, 0.01),
             lsh_params=(args.num_bands, args.rows_per_band, args.num_hashes),
+            signature_bits=args.signature_bits,
+            signature_cache=signature_cache,
+            max_memory=args.max_memory,
+            bloom_filter_type=args.bloom_filter_type,
+            estimate_capacity=args.estimate_capacity,
+            capacity_sample_size=args.capacity_sample_size,
         )
-        exact_duplicates, clusters = deduplicator.deduplicate_collection(documents)
+        try:
+            exact_duplicates, clusters = deduplicator.deduplicate_collection(documents)
+        except MemoryError as error:
+            parser.error(str(error))
         cluster_ids = [[doc_id for doc_id in cluster] for cluster in clusters]
-        save_results(cluster_ids, output_file)
+        save_results(cluster_ids, output_file, args.output_format, len(documents))
 
     # Baseline Mode
     elif args.mode == "baseline":
         logging.info("Starting baseline deduplication.")
         if args.baseline == "md5":
             duplicates = find_exact_duplicates(documents)
-            save_results(duplicates, output_file)
+            save_results(duplicates, output_file, args.output_format, len(documents))
         elif args.baseline == "ngram":
             duplicates = find_ngram_duplicates(
                 documents, n=args.n, threshold=args.threshold
             )
-            save_results(duplicates, output_file)
+            save_results(duplicates, output_file, args.output_format, len(documents))
         elif args.baseline == "jaccard":
             duplicates = find_jaccard_duplicates(documents, threshold=args.threshold)
-            save_results(duplicates, output_file)
+            save_results(duplicates, output_file, args.output_format, len(documents))
 
     # Improved LSH Mode
     elif args.mode == "improved_lsh":
@@ -193,12 +525,31 @@ def main():
             num_hashes=args.num_hashes,
             shingle_size=args.shingle_size,
             probes=args.probes,
+            minhash_method=args.minhash,
+            max_bucket_size=args.max_bucket_size,
+            heavy_bucket_policy=args.heavy_bucket_policy,
         )
-        for idx, doc in enumerate(documents):
-            improved_lsh.add_document(idx, doc)
+        similarity = signature_similarity(improved_lsh, args.output_format)
+        if args.keep_all_features:
+            improved_lsh.features.max_entries = None
+        if args.pipeline:
+            num_documents = run_pipeline(improved_lsh, args)
+        else:
+            apply_stop_shingle_filter(improved_lsh, documents, args.max_df)
+            improved_lsh.set_signature_cache(signature_cache)
+            for idx, doc in enumerate(documents):
+                improved_lsh.add_document(idx, doc)
+            num_documents = len(documents)
+        if improved_lsh.max_bucket_size is not None:
+            logging.info(f"Heavy bucket stats: {improved_lsh.bucket_stats}")
         clusters = improved_lsh.cluster_candidates()
-        formatted_clusters = [cluster for cluster in clusters.values()]
-        save_results(formatted_clusters, output_file)
+        save_results(
+            clusters.values(),
+            output_file,
+            args.output_format,
+            num_documents,
+            similarity,
+        )
 
     # Union-Find LSH Mode
     elif args.mode == "lsh":
@@ -208,11 +559,167 @@ def main():
             rows_per_band=args.rows_per_band,
             num_hashes=args.num_hashes,
             shingle_size=args.shingle_size,
+            minhash_method=args.minhash,
+            max_bucket_size=args.max_bucket_size,
+            heavy_bucket_policy=args.heavy_bucket_policy,
+            memory_budget=args.memory_budget,
+            spill_dir=args.spill_dir,
         )
-        for idx, doc in enumerate(documents):
-            union_find_lsh.add_document(idx, doc)
+        similarity = signature_similarity(union_find_lsh, args.output_format)
+        if args.keep_all_features:
+            union_find_lsh.features.max_entries = None
+        if args.pipeline:
+            num_documents = run_pipeline(union_find_lsh, args)
+        else:
+            apply_stop_shingle_filter(union_find_lsh, documents, args.max_df)
+            union_find_lsh.set_signature_cache(signature_cache)
+            if args.checkpoint_dir is not None:
+                manager = CheckpointManager(
+                    args.checkpoint_dir, checkpoint_params(args, len(documents))
+                )
+                if args.resume:
+                    manager.load()
+                else:
+                    manager.reset()
+                index_documents(
+                    union_find_lsh, documents, manager, args.checkpoint_every
+                )
+            elif args.two_pass:
+                union_find_lsh.add_documents_two_pass(
+                    list(range(len(documents))), documents
+                )
+            else:
+                for idx, doc in enumerate(documents):
+                    union_find_lsh.add_document(idx, doc)
+            num_documents = len(documents)
+        if union_find_lsh.max_bucket_size is not None:
+            logging.info(f"Heavy bucket stats: {union_find_lsh.bucket_stats}")
         clusters = union_find_lsh.cluster_candidates()
-        save_results(clusters.values(), output_file)
+        if union_find_lsh.external is not None:
+            union_find_lsh.external.close()
+        save_results(
+            clusters.values(),
+            output_file,
+            args.output_format,
+            num_documents,
+            similarity,
+        )
+
+    # SimHash Mode
+    elif args.mode == "simhash":
+        logging.info("Starting SimHash deduplication.")
+        simhash_index = SimHashIndex(
+            max_distance=args.max_distance, shingle_size=args.shingle_size
+        )
+        for idx, doc in enumerate(documents):
+            simhash_index.add_document(idx, doc)
+        clusters = simhash_index.cluster_candidates()
+        save_results(
+            clusters.values(), output_file, args.output_format, len(documents)
+        )
+
+    # LSH Forest Mode
+    elif args.mode == "lsh_forest":
+        logging.info("Starting LSH Forest deduplication.")
+        forest = LSHForest(
+            num_trees=args.num_bands,
+            max_depth=args.rows_per_band,
+            num_hashes=args.num_hashes,
+            shingle_size=args.shingle_size,
+            minhash_method=args.minhash,
+        )
+        forest.set_signature_cache(signature_cache)
+        similarity = signature_similarity(forest, args.output_format)
+        for idx, doc in enumerate(documents):
+            forest.add_document(idx, doc)
+        depth = forest.depth_for_threshold(args.threshold)
+        logging.info(f"Using prefix depth {depth} for threshold {args.threshold}.")
+        clusters = forest.cluster_candidates(depth=depth)
+        save_results(
+            clusters.values(),
+            output_file,
+            args.output_format,
+            len(documents),
+            similarity,
+        )
+
+    # Parameter Sweep Mode
+    elif args.mode == "sweep":
+        logging.info("Starting LSH parameter sweep.")
+        baseline_file = args.baseline_file or generate_output_filename(
+            args.input_file, "baseline"
+        )
+        baseline_clusters = None
+        if os.path.exists(baseline_file):
+            baseline_clusters = load_clusters(baseline_file)
+        else:
+            logging.info(f"No baseline at {baseline_file}; skipping precision/recall.")
+        sweep = ParameterSweep(
+            documents,
+            num_hashes=args.num_hashes,
+            shingle_size=args.shingle_size,
+            minhash_method=args.minhash,
+        )
+        configs = [
+            (bands, rows, probes)
+            for bands in args.sweep_bands
+            for rows in args.sweep_rows
+            for probes in args.sweep_probes
+        ]
+        save_sweep_report(
+            sweep.run(configs, baseline_clusters),
+            generate_output_filename(args.input_file, args.mode, "csv"),
+        )
+
+    # Sliding-Window Mode
+    elif args.mode == "window":
+        logging.info("Starting sliding-window deduplication.")
+        window = SlidingWindowDeduplicator(
+            lsh_params=(args.num_bands, args.rows_per_band, args.num_hashes),
+            num_generations=args.window_generations,
+            generation_size=args.generation_size,
+            threshold=args.threshold,
+        )
+        clusters = []
+        for doc in documents:
+            result = window.add(doc)
+            if result["matches"]:
+                clusters.append(
+                    sorted([result["id"]] + [m["id"] for m in result["matches"]])
+                )
+        logging.info(
+            f"Found {len(clusters)} near-duplicates within the window; {window.expired} documents expired."
+        )
+        save_results(clusters, output_file, args.output_format, len(documents))
+
+    # Service Mode
+    elif args.mode == "serve":
+        logging.info("Starting dedup service.")
+        service = DedupService(
+            lsh_params=(args.num_bands, args.rows_per_band, args.num_hashes),
+            threshold=args.threshold,
+            max_batch_size=args.max_batch_size,
+            max_batch_delay=args.max_batch_delay,
+            max_queue_size=args.max_queue_size,
+        )
+        asyncio.run(serve(service, documents, args.host, args.port, args.socket_path))
+
+    if signature_cache is not None:
+        logging.info(f"Signature cache stats: {signature_cache.stats()}")
+        signature_cache.close()
+
+
+async def serve(service, documents, host, port, socket_path):
+    """
+    Preload documents into the service and serve requests until interrupted.
+    """
+    for idx, signature in enumerate(service.sign_batch(documents)):
+        service.apply({"op": "add", "text": documents[idx], "id": idx}, signature)
+    await service.start(host=host, port=port, path=socket_path)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List
+
+import numpy as np
+
+LOW_WORD = (1 << 64) - 1
+
+
+def estimate_size(obj: Any) -> int:
+    """
+    Estimate the memory footprint of a cached value in bytes.
+
+    Parameters:
+        obj (Any): Value to measure; containers are measured recursively.
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+
+class QueryCache:
+    """
+    Bounded LRU cache for query signatures and results.
+
+    Entries are keyed by (kind, key) so signatures, which only depend on the document
+    text, survive index changes while results are dropped by `invalidate_results`.
+    The total estimated size of all entries is kept under `max_bytes` by evicting the
+    least recently used entries first.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Initialize the cache.
+
+        Parameters:
+            max_bytes (int): Upper bound on the total estimated size of cached entries.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, kind: str, key: Hashable) -> Any:
+        """
+        Look up a cached value and mark it as recently used.
+
+        Parameters:
+            kind (str): Entry kind, e.g. "signature" or "result".
+            key (Hashable): Entry key, e.g. the normalized-document fingerprint.
+
+        Returns:
+            Any: The cached value, or None on a miss.
+        """
+        entry = self.entries.get((kind, key))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((kind, key))
+        self.hits += 1
+        return entry[0]
+
+    def put(self, kind: str, key: Hashable, value: Any):
+        """
+        Cache a value, evicting least recently used entries to stay within `max_bytes`.
+
+        Parameters:
+            kind (str): Entry kind, e.g. "signature" or "result".
+            key (Hashable): Entry key, e.g. the normalized-document fingerprint.
+            value (Any): Value to cache. Values larger than `max_bytes` are not cached.
+        """
+        size = estimate_size(value)
+        self.discard(kind, key)
+        if size > self.max_bytes:
+            return
+        while self.entries and self.current_bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+        self.entries[(kind, key)] = (value, size)
+        self.current_bytes += size
+
+    def discard(self, kind: str, key: Hashable):
+        """Remove an entry if it is cached."""
+        entry = self.entries.pop((kind, key), None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def invalidate_results(self):
+        """Drop every cached result, e.g. after the index changed."""
+        for cache_key in [k for k in self.entries if k[0] == "result"]:
+            self.discard(*cache_key)
+        self.invalidations += 1
+
+    def clear(self):
+        """Drop every cached entry."""
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Report cache counters.
+
+        Returns:
+            dict: Hits, misses, hit rate, evictions, invalidations, entries and bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+        }
+
+
+def encode_values(values: List[int]) -> bytes:
+    """
+    Pack minhash values (up to 128 bits, or infinity) into bytes.
+
+    The layout is a bit mask of infinite values followed by the high and low 64-bit
+    words of every value as little-endian uint64 arrays.
+    """
+    infinite = np.array([value == float("inf") for value in values], dtype=bool)
+    finite = [0 if is_inf else int(value) for is_inf, value in zip(infinite, values)]
+    high = np.array([value >> 64 for value in finite], dtype="<u8")
+    low = np.array([value & LOW_WORD for value in finite], dtype="<u8")
+    return np.packbits(infinite).tobytes() + high.tobytes() + low.tobytes()
+
+
+def decode_values(blob: bytes, count: int) -> List[Any]:
+    """Unpack `count` minhash values packed by `encode_values`."""
+    mask_bytes = (count + 7) // 8
+    infinite = np.unpackbits(np.frombuffer(blob[:mask_bytes], dtype=np.uint8))[:count]
+    words = np.frombuffer(blob[mask_bytes:], dtype="<u8")
+    high, low = words[:count].tolist(), words[count:].tolist()
+    return [
+        float("inf") if is_inf else (hi << 64) | lo
+        for is_inf, hi, lo in zip(infinite, high, low)
+    ]
+
+
+class SignatureCache:
+    """
+    Persistent, content-addressed cache of minhash signatures in a local SQLite file.
+
+    Entries are keyed by a SHA-256 of the document text together with the parameters
+    that determine its signature (shingle size, number of hashes, MinHash method and any
+    stop-shingle filter), so a re-run over a mostly unchanged corpus only hashes new
+    content and a parameter change never returns stale signatures. The total size of
+    stored values is kept under `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024**3, commit_every: int = 1000):
+        """
+        Open (or create) the cache.
+
+        Parameters:
+            path (str): SQLite database file.
+            max_bytes (int): Upper bound on the total size of stored signatures.
+            commit_every (int): Number of writes between commits.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "key BLOB PRIMARY KEY, value BLOB NOT NULL, count INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS signatures_last_used ON signatures (last_used)"
+        )
+        row = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM signatures"
+        ).fetchone()
+        self.current_bytes, self.clock = row
+        self.pending_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def key(self, document: str, params: dict) -> bytes:
+        """Content fingerprint of a document under a set of signature parameters."""
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+        digest.update(b"\0")
+        digest.update(document.encode())
+        return digest.digest()
+
+    def get(self, key: bytes) -> Any:
+        """
+        Look up cached values and mark them as recently used.
+
+        Parameters:
+            key (bytes): Key built by `key`.
+
+        Returns:
+            List[int]: The cached values, or None on a miss.
+        """
+        row = self.connection.execute(
+            "SELECT value, count FROM signatures WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.connection.execute(
+            "UPDATE signatures SET last_used = ? WHERE key = ?", (self.clock, key)
+        )
+        self.written()
+        return decode_values(row[0], row[1])
+
+    def put(self, key: bytes, values: List[int]):
+        """
+        Store values, evicting least recently used entries to stay within `max_bytes`.
+
+        Parameters:
+            key (bytes): Key built by `key`.
+            values (List[int]): Minhash values to cache.
+        """
+        blob = encode_values(values)
+        if len(blob) > self.max_bytes:
+            return
+        old = self.connection.execute(
+            "SELECT size FROM signatures WHERE key = ?", (key,)
+        ).fetchone()
+        if old is not None:
+            self.current_bytes -= old[0]
+        self.clock += 1
+        self.connection.execute(
+            "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(values), len(blob), self.clock),
+        )
+        self.current_bytes += len(blob)
+        self.evict()
+        self.written()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in `max_bytes`."""
+        while self.current_bytes > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, size FROM signatures ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.current_bytes <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM signatures WHERE key = ?", (key,))
+                self.current_bytes -= size
+                self.evictions += 1
+
+    def fetch(
+        self, document: str, params: dict, compute: Callable[[], List[int]]
+    ) -> List[int]:
+        """
+        Return the cached values for a document, computing and storing them on a miss.
+
+        Parameters:
+            document (str): Document text.
+            params (dict): Parameters that determine the values.
+            compute (Callable[[], List[int]]): Computes the values on a miss.
+
+        Returns:
+            List[int]: Cached or freshly computed values.
+        """
+        key = self.key(document, params)
+        values = self.get(key)
+        if values is None:
+            values = compute()
+            self.put(key, values)
+        return values
+
+    def written(self):
+        """Count a write and commit once `commit_every` writes are pending."""
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        """Commit pending writes to disk."""
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def close(self):
+        """Commit pending writes and close the database."""
+        self.flush()
+        self.connection.close()
+
+    def stats(self) -> dict:
+        """
+        Report cache counters.
+
+        Returns:
+            dict: Hits, misses, hit rate, evictions and bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.current_bytes,
+        }
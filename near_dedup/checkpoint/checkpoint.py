@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+SEGMENT_PREFIX = "segment-"
+LOW_WORD = (1 << 64) - 1
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str) -> str:
+    """Compute the SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CheckpointManager:
+    """
+    Append-only checkpoints of minhash work for long-running dedup jobs.
+
+    Every checkpoint writes one segment file holding only the documents processed since
+    the previous checkpoint (their IDs, 128-bit signatures and, for multi-probe indexes,
+    runner-up values), so the cost of a
+    checkpoint is bounded by the checkpoint interval. The manifest lists the segments
+    with their document range and SHA-256 digest and is replaced atomically. On reload
+    every segment is verified; the job resumes after the last segment that passes.
+    """
+
+    def __init__(self, directory: str, params: dict):
+        """
+        Initialize the checkpoint manager.
+
+        Parameters:
+            directory (str): Local directory holding the manifest and segments.
+            params (dict): Job parameters; resuming with different parameters is refused.
+        """
+        self.directory = directory
+        self.params = params
+        self.segments: List[dict] = []
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST)
+
+    @property
+    def offset(self) -> int:
+        """Index of the first document not covered by a checkpoint."""
+        return self.segments[-1]["end"] if self.segments else 0
+
+    def write_manifest(self):
+        """Atomically replace the manifest with the current segment list."""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"params": self.params, "segments": self.segments}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def reset(self):
+        """Start a fresh job, discarding any previous checkpoints."""
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX):
+                os.remove(os.path.join(self.directory, name))
+        self.segments = []
+        self.write_manifest()
+
+    def load(self) -> int:
+        """
+        Load the manifest and keep the longest prefix of segments that pass the integrity check.
+
+        Returns:
+            int: Index of the first document to process when resuming.
+        """
+        if not os.path.exists(self.manifest_path):
+            self.segments = []
+            return 0
+        with open(self.manifest_path) as file:
+            manifest = json.load(file)
+        if manifest["params"] != self.params:
+            raise ValueError(
+                f"Checkpoint in {self.directory} was written with different parameters: {manifest['params']}"
+            )
+        valid = []
+        for segment in manifest["segments"]:
+            path = os.path.join(self.directory, segment["file"])
+            if not os.path.exists(path) or file_sha256(path) != segment["sha256"]:
+                logger.warning(
+                    f"Checkpoint segment {segment['file']} is missing or corrupt; resuming from document {segment['start']}."
+                )
+                break
+            valid.append(segment)
+        self.segments = valid
+        if len(valid) != len(manifest["segments"]):
+            self.write_manifest()
+        return self.offset
+
+    def append(
+        self,
+        doc_ids: List[int],
+        signatures: List[List[int]],
+        runner_ups: Optional[List[List[int]]] = None,
+    ):
+        """
+        Write a segment for the documents processed since the last checkpoint.
+
+        Parameters:
+            doc_ids (List[int]): Document IDs, in processing order.
+            signatures (List[List[int]]): Minhash signatures of those documents.
+            runner_ups (List[List[int]]): Runner-up values of those documents, for
+                `LSHImproved` probes; None if the index has none.
+        """
+        if not doc_ids:
+            return
+        start = self.offset
+        end = start + len(doc_ids)
+        empty = np.array(
+            [signature[0] == float("inf") for signature in signatures], dtype=bool
+        )
+        values = [
+            [0] * len(signature) if is_empty else signature
+            for is_empty, signature in zip(empty, signatures)
+        ]
+        arrays = dict(doc_ids=np.array(doc_ids, dtype=np.int64), empty=empty)
+        arrays["hi"], arrays["lo"] = split_words(values)
+        if runner_ups is not None:
+            # Rows with fewer than two distinct hashes have no (infinite) runner-up
+            missing = [[value == float("inf") for value in row] for row in runner_ups]
+            arrays["runner_up_hi"], arrays["runner_up_lo"] = split_words(
+                [
+                    [0 if value == float("inf") else value for value in row]
+                    for row in runner_ups
+                ]
+            )
+            arrays["runner_up_missing"] = np.array(missing, dtype=bool)
+        name = f"{SEGMENT_PREFIX}{len(self.segments):06d}.npz"
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as file:
+            np.savez(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        self.segments.append(
+            {"file": name, "start": start, "end": end, "sha256": file_sha256(path)}
+        )
+        self.write_manifest()
+        logger.info(f"Checkpointed documents {start}-{end - 1} to {name}.")
+
+    def replay(self) -> Iterator[Tuple[int, List[int], Optional[List[int]]]]:
+        """
+        Yield the (doc_id, signature, runner_up) triples stored in the verified segments.
+
+        Returns:
+            Iterator[Tuple[int, List[int], Optional[List[int]]]]: Checkpointed documents in
+                processing order; runner_up is None for segments written without them.
+        """
+        for segment in self.segments:
+            with np.load(os.path.join(self.directory, segment["file"])) as data:
+                doc_ids = data["doc_ids"].tolist()
+                signatures = join_words(data["hi"], data["lo"])
+                empty = data["empty"]
+                runner_ups = [None] * len(doc_ids)
+                if "runner_up_missing" in data:
+                    rows = join_words(data["runner_up_hi"], data["runner_up_lo"])
+                    missing = data["runner_up_missing"].tolist()
+                    runner_ups = [
+                        [float("inf") if miss else value for value, miss in zip(*row)]
+                        for row in zip(rows, missing)
+                    ]
+            for doc_id, signature, is_empty, runner_up in zip(
+                doc_ids, signatures, empty, runner_ups
+            ):
+                if is_empty:
+                    signature = [float("inf")] * len(signature)
+                yield doc_id, signature, runner_up
+
+
+def split_words(rows: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Split rows of 128-bit hash values into high and low uint64 words."""
+    hi = [[value >> 64 for value in row] for row in rows]
+    lo = [[value & LOW_WORD for value in row] for row in rows]
+    return np.array(hi, dtype=np.uint64), np.array(lo, dtype=np.uint64)
+
+
+def join_words(hi: np.ndarray, lo: np.ndarray) -> List[List[int]]:
+    """Rebuild rows of 128-bit hash values from their high and low uint64 words."""
+    return [
+        [(h << 64) | l for h, l in zip(row_hi, row_lo)]
+        for row_hi, row_lo in zip(hi.tolist(), lo.tolist())
+    ]
+
+
+def index_documents(
+    lsh,
+    documents: List[str],
+    manager: CheckpointManager,
+    checkpoint_every: int = 10000,
+) -> int:
+    """
+    Add documents to an LSH index, checkpointing the signatures every `checkpoint_every` documents.
+
+    Documents covered by the manager's verified segments are replayed from their stored
+    signatures (and runner-up values, so `LSHImproved` restores its probes) instead of
+    being shingled and minhashed again; the rest are processed in
+    order starting at `manager.offset`. Union-find state is not stored: it is derived from
+    the band tables when the index is clustered.
+
+    Parameters:
+        lsh: An `LSHBase` index to fill.
+        documents (List[str]): All documents of the job, indexed by position.
+        manager (CheckpointManager): Loaded (or reset) checkpoint manager.
+        checkpoint_every (int): Number of documents between checkpoints.
+
+    Returns:
+        int: Number of documents restored from checkpoints.
+    """
+    restored = 0
+    for doc_id, signature, runner_up in manager.replay():
+        if runner_up is None:
+            lsh.add_signature(doc_id, signature)
+        else:
+            lsh.add_signature(doc_id, signature, runner_up)
+        restored += 1
+    if restored:
+        logger.info(
+            f"Restored {restored} documents from checkpoints in {manager.directory}."
+        )
+    doc_ids, signatures, runner_ups = [], [], []
+    for idx in range(manager.offset, len(documents)):
+        features = lsh.add_document(idx, documents[idx])
+        doc_ids.append(idx)
+        signatures.append(features.signature)
+        runner_ups.append(features.runner_up)
+        if len(doc_ids) >= checkpoint_every:
+            manager.append(doc_ids, signatures, stored_runner_ups(runner_ups))
+            doc_ids, signatures, runner_ups = [], [], []
+    manager.append(doc_ids, signatures, stored_runner_ups(runner_ups))
+    return restored
+
+
+def stored_runner_ups(runner_ups: List[Optional[List[int]]]) -> Optional[list]:
+    """The runner-up values to checkpoint, or None for an index without them."""
+    if not runner_ups or runner_ups[0] is None:
+        return None
+    return runner_ups
@@ -1,32 +1,165 @@
 from near_dedup.baselines.baselines import compute_md5, find_exact_duplicates, find_ngram_duplicates, find_jaccard_duplicates
-from near_dedup.bloom_filter.bloom_filter import BloomFilter
+from near_dedup.bloom_filter.bloom_filter import (
+    BlockedBloomFilter,
+    BloomFilter,
+    estimate_distinct,
+)
+from near_dedup.cache.cache import QueryCache
 from near_dedup.lsh.lsh import LSH
+from near_dedup.memory.memory import plan_memory
+from near_dedup.signatures.shared import SharedIndex
+from near_dedup.signatures.signatures import SignatureStore
 from collections import defaultdict
 import hashlib
+import logging
+import math
 import re
+import tracemalloc
+
+BLOOM_FILTER_TYPES = {"standard": BloomFilter, "blocked": BlockedBloomFilter}
 
 class DocumentDeduplicator:
     """
     Class to handle deduplication and approximate nearest neighbor search on a collection of documents.
     """
 
-    def __init__(self, bloom_filter_params=(1000, 0.01), lsh_params=(10, 5, 100)):
+    def __init__(
+        self,
+        bloom_filter_params=(1000, 0.01),
+        lsh_params=(10, 5, 100),
+        signature_bits=None,
+        query_cache_bytes=None,
+        signature_cache=None,
+        max_memory=None,
+        bloom_filter_type="standard",
+        estimate_capacity=False,
+        capacity_sample_size=None,
+    ):
         """
         Initialize DocumentDeduplicator with Bloom Filter and LSH parameters.
 
         Parameters:
             bloom_filter_params (tuple): Parameters for initializing the Bloom Filter.
             lsh_params (tuple): Parameters for initializing LSH (num_bands, rows_per_band, num_hashes).
+            signature_bits (int): If set, keep signatures in a SignatureStore with 32-bit truncated
+                or b-bit (1-8) values instead of full-width Python lists.
+            query_cache_bytes (int): If set, cache query signatures and results in an LRU cache
+                bounded to this many bytes, keyed by the normalized-document fingerprint.
+            signature_cache (SignatureCache): If set, reuse collection signatures stored on disk
+                by earlier runs and store the ones computed in this run.
+            max_memory (int): If set, fit collection deduplication into this many bytes: the
+                Bloom filter is sized for the collection and signature storage, the feature
+                cache and band tables are narrowed, bounded or spilled as needed. A budget
+                that cannot be met raises MemoryError before any work is done.
+            bloom_filter_type (str): 'standard' for BloomFilter, or 'blocked' for the
+                cache-line BlockedBloomFilter, which checks documents in batches.
+            estimate_capacity (bool): If True, size the Bloom filter and signature storage
+                for each collection from a HyperLogLog estimate of its distinct documents,
+                instead of the fixed `bloom_filter_params` capacity.
+            capacity_sample_size (int): If set, base that estimate on a random sample of
+                this many documents.
         """
-        self.bloom_filter = BloomFilter(*bloom_filter_params)
+        if bloom_filter_type not in BLOOM_FILTER_TYPES:
+            raise ValueError(
+                f"bloom_filter_type must be one of {sorted(BLOOM_FILTER_TYPES)}, got {bloom_filter_type!r}."
+            )
+        self.bloom_filter_type = bloom_filter_type
+        self.bloom_filter_params = bloom_filter_params
+        self.bloom_filter = BLOOM_FILTER_TYPES[bloom_filter_type](*bloom_filter_params)
+        self.lsh_params = lsh_params
+        self.signature_cache = signature_cache
         self.lsh = LSH(*lsh_params)
+        self.lsh.set_signature_cache(signature_cache)
+        self.signature_bits = signature_bits
+        self.max_memory = max_memory
+        self.memory_report = None
+        self.estimate_capacity = estimate_capacity
+        self.capacity_sample_size = capacity_sample_size
+        self.capacity = None
+        self.query_cache = QueryCache(query_cache_bytes) if query_cache_bytes else None
         self.union_set = {}  # For Union-Find
 
+    def new_signature_store(self):
+        """Return an empty compressed signature store, or a plain dict when compression is off."""
+        if self.signature_bits is None:
+            return {}
+        if self.capacity is None:
+            return SignatureStore(self.lsh.num_hashes, bits=self.signature_bits)
+        return SignatureStore(
+            self.lsh.num_hashes, bits=self.signature_bits, capacity=self.capacity
+        )
+
+    def store_signature(self, signatures, doc_id, signature):
+        """Store a document signature in a dict or SignatureStore."""
+        if isinstance(signatures, SignatureStore):
+            signatures.add(doc_id, signature)
+        else:
+            signatures[doc_id] = signature
+
+    def size_for(self, documents):
+        """
+        Size the Bloom filter and signature storage for the distinct documents of a collection.
+
+        The distinct-count estimate is padded by three relative errors, so the filter is
+        rarely filled past its capacity, and capped at the number of documents.
+
+        Returns:
+            int: The chosen capacity.
+        """
+        estimate, error = estimate_distinct(
+            documents, sample_size=self.capacity_sample_size
+        )
+        self.capacity = max(
+            1, min(len(documents), math.ceil(estimate * (1 + 3 * error)))
+        )
+        self.bloom_filter = BLOOM_FILTER_TYPES[self.bloom_filter_type](
+            self.capacity, self.bloom_filter_params[1]
+        )
+        logging.info(
+            f"Estimated {estimate} distinct documents; sized for {self.capacity}."
+        )
+        return self.capacity
+
+    def fit_memory_budget(self, documents):
+        """
+        Plan a collection run within `max_memory` and apply the chosen settings.
+
+        Returns:
+            dict: The memory plan (see `plan_memory`).
+        """
+        plan = plan_memory(
+            self.max_memory,
+            len(documents),
+            sum(len(doc) for doc in documents),
+            self.lsh.num_hashes,
+            self.lsh.num_bands,
+            self.signature_bits,
+            self.bloom_filter_params[1],
+        )
+        settings = plan["settings"]
+        self.signature_bits = settings["signature_bits"]
+        self.bloom_filter = BLOOM_FILTER_TYPES[self.bloom_filter_type](
+            self.capacity or max(len(documents), 1), settings["false_positive_rate"]
+        )
+        self.lsh = LSH(*self.lsh_params, memory_budget=settings["spill_bytes"])
+        self.lsh.set_signature_cache(self.signature_cache)
+        self.lsh.features.max_entries = settings["feature_entries"]
+        return plan
+
     # Step 1: Remove exact duplicates using Bloom Filter and MD5 hashing
     def remove_exact_duplicates(self, documents):
         unique_docs = []
         duplicates = []
 
+        if isinstance(self.bloom_filter, BlockedBloomFilter):
+            seen = self.bloom_filter.add_batch([compute_md5(doc) for doc in documents])
+            for doc, is_duplicate in zip(documents, seen):
+                if is_duplicate:
+                    duplicates.append(doc)
+                else:
+                    unique_docs.append(doc)
+            return unique_docs, duplicates
+
         for doc in documents:
             md5_hash = compute_md5(doc)
             if self.bloom_filter.contains(md5_hash):
@@ -50,12 +183,20 @@ class DocumentDeduplicator:
 
     # Step 3: Compute minhash signatures and Step 4: Find candidate pairs with LSH
     def compute_minhash_and_candidates(self, documents):
-        doc_signatures = {}
+        doc_signatures = self.new_signature_store()
         for idx, doc in enumerate(documents):
-            self.lsh.add_document(idx, doc)  # This will handle both minhash and LSH banding
-            doc_signatures[idx] = self.lsh.minhash(self.lsh.shingle_document(doc))
+            features = self.lsh.add_document(idx, doc)  # Minhash and band once, reuse the signature
+            self.store_signature(doc_signatures, idx, features.signature)
         
-        candidate_pairs = self.lsh.find_candidates()
+        if self.lsh.external is not None:
+            # Spilled band tables are streamed; adjacent bucket members give the same clusters
+            candidate_pairs = (
+                pair
+                for bucket_docs in self.lsh.external.iter_buckets()
+                for pair in zip(bucket_docs, bucket_docs[1:])
+            )
+        else:
+            candidate_pairs = self.lsh.find_candidates()
         return doc_signatures, candidate_pairs
 
     # Step 5: Cluster documents using Union-Find with path compression and union by rank
@@ -94,7 +235,10 @@ class DocumentDeduplicator:
             for i in range(len(docs)):
                 for j in range(i + 1, len(docs)):
                     doc1, doc2 = docs[i], docs[j]
-                    jaccard_score = self.jaccard_similarity(doc_signatures[doc1], doc_signatures[doc2])
+                    if isinstance(doc_signatures, SignatureStore):
+                        jaccard_score = doc_signatures.similarity(doc1, doc2)
+                    else:
+                        jaccard_score = self.jaccard_similarity(doc_signatures[doc1], doc_signatures[doc2])
                     if jaccard_score > 0.7:  # Threshold for similarity
                         cluster.extend([doc1, doc2])
             refined_clusters.append(set(cluster))
@@ -109,6 +253,33 @@ class DocumentDeduplicator:
     # Full workflow for collection deduplication
     def deduplicate_collection(self, documents):
         """Perform full deduplication workflow on a collection of documents."""
+        if self.estimate_capacity:
+            self.size_for(documents)
+        if self.max_memory is None:
+            return self.run_collection(documents)
+        plan = self.fit_memory_budget(documents)
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            result = self.run_collection(documents)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+        self.memory_report = dict(plan, budget=self.max_memory, actual_peak=peak)
+        logging.info(
+            f"Memory budget {self.max_memory} bytes: expected peak {plan['expected']}, traced peak {peak}."
+        )
+        if peak > self.max_memory:
+            logging.warning(
+                f"Traced peak of {peak} bytes exceeded the {self.max_memory}-byte budget."
+            )
+        return result
+
+    def run_collection(self, documents):
+        """Remove exact duplicates, then cluster and verify near-duplicates."""
         # Remove exact duplicates
         unique_docs, exact_duplicates = self.remove_exact_duplicates(documents)
 
@@ -120,6 +291,8 @@ class DocumentDeduplicator:
 
         # Cluster candidate pairs
         clusters = self.cluster_documents(candidate_pairs)
+        if self.lsh.external is not None:
+            self.lsh.external.close()
 
         # Compute Jaccard similarity within clusters
         refined_clusters = self.compute_jaccard_similarity(clusters, doc_signatures)
@@ -129,30 +302,82 @@ class DocumentDeduplicator:
     # Offline (Indexing) for Nearest Neighbor Search
     def build_index(self, documents):
         """Create an index of minhash signatures for approximate nearest neighbor search."""
+        if self.estimate_capacity:
+            self.size_for(documents)
         unique_docs, _ = self.remove_exact_duplicates(documents)
         cleaned_docs = self.preprocess_documents(unique_docs)
-        index = {}
+        index = self.new_signature_store()
 
         for idx, doc in enumerate(cleaned_docs):
-            signature = self.lsh.minhash(self.lsh.shingle_document(doc))
-            index[idx] = signature
+            signature = self.lsh.document_features(doc).signature
+            self.store_signature(index, idx, signature)
 
         self.index = index
+        if self.query_cache is not None:
+            self.query_cache.invalidate_results()
         return index
 
+    def shared_index(self):
+        """
+        Lay out the index built by `build_index` as a SharedIndex for multi-process querying.
+
+        Returns:
+            SharedIndex: Flat-array index; `publish` or `save` it, then `attach` or `load`
+                it in every worker.
+        """
+        store = self.index
+        if isinstance(store, SignatureStore):
+            if store.bits != 32:
+                raise ValueError("A shared index needs 32-bit or full-width signatures.")
+        else:
+            store = SignatureStore(self.lsh.num_hashes, bits=32)
+            for doc_id, signature in self.index.items():
+                store.add(doc_id, signature)
+        return SharedIndex.build(
+            store,
+            self.lsh.num_bands,
+            self.lsh.rows_per_band,
+            self.lsh.shingle_size,
+            self.lsh.minhash_method,
+        )
+
+    def query_candidates(self, cleaned_query, fingerprint, threshold):
+        """Indexed documents whose similarity to a cleaned query exceeds the threshold."""
+        cache = self.query_cache
+        query_signature = None
+        if cache is not None:
+            query_signature = cache.get("signature", fingerprint)
+        if query_signature is None:
+            query_signature = self.lsh.minhash(self.lsh.shingle_document(cleaned_query))
+            if cache is not None:
+                cache.put("signature", fingerprint, query_signature)
+
+        # Find candidates using LSH
+        candidates = []
+        if isinstance(self.index, SignatureStore):
+            doc_ids, similarities = self.index.query(query_signature)
+            candidates = doc_ids[similarities > threshold].tolist()
+        else:
+            for idx, signature in self.index.items():
+                if self.jaccard_similarity(query_signature, signature) > threshold:
+                    candidates.append(idx)
+        return candidates
+
     # Online (Querying) for Nearest Neighbor Search
     def nearest_neighbor_search(self, query_doc, threshold=0.7):
         """Find approximate nearest neighbors for a query document."""
         cleaned_query = self.clean_document(query_doc)
-        query_signature = self.lsh.minhash(self.lsh.shingle_document(cleaned_query))
-        
-        # Find candidates using LSH
-        candidates = []
-        for idx, signature in self.index.items():
-            if self.jaccard_similarity(query_signature, signature) > threshold:
-                candidates.append(idx)
-        
+        fingerprint = hashlib.md5(cleaned_query.encode("utf-8")).hexdigest()
+        cache = self.query_cache
+        candidates = None
+        if cache is not None:
+            # Only candidates are cached: clustering below depends on earlier queries too
+            candidates = cache.get("result", (fingerprint, threshold))
+        if candidates is None:
+            candidates = self.query_candidates(cleaned_query, fingerprint, threshold)
+            if cache is not None:
+                cache.put("result", (fingerprint, threshold), candidates)
+
         # Cluster the candidates with Union-Find
         clusters = self.cluster_documents([(0, c) for c in candidates])  # Single document to candidates
-        
         return clusters
@@ -0,0 +1,105 @@
+import hashlib
+from collections import OrderedDict
+from typing import List, Optional
+
+# Default bound of a FeatureStore: enough to reuse the features of exact duplicates that
+# arrive close together, without keeping every document's signature for the whole run.
+# A duplicate arriving after this many other distinct documents is signed again; pass
+# max_entries=None to sign every distinct document exactly once.
+DEFAULT_MAX_ENTRIES = 128
+
+
+def fingerprint(doc: str) -> bytes:
+    """Content fingerprint (MD5 digest) identifying a document's text."""
+    return hashlib.md5(doc.encode("utf-8")).digest()
+
+
+class DocumentFeatures:
+    """Everything derived from one document's text: its signature and band hashes."""
+
+    __slots__ = ("fingerprint", "signature", "band_hashes", "runner_up", "probe_hashes")
+
+    def __init__(
+        self,
+        fingerprint: Optional[bytes],
+        signature: List[int],
+        band_hashes: List[int],
+        runner_up: Optional[List[int]] = None,
+        probe_hashes: Optional[List[int]] = None,
+    ):
+        """
+        Initialize the features.
+
+        Parameters:
+            fingerprint (bytes): Content fingerprint, or None for a bare signature.
+            signature (List[int]): Minhash signature.
+            band_hashes (List[int]): Hash of every signature band.
+            runner_up (List[int]): Second-smallest hash value of every row, for multi-probe LSH.
+            probe_hashes (List[int]): Ranked multi-probe band hashes.
+        """
+        self.fingerprint = fingerprint
+        self.signature = signature
+        self.band_hashes = band_hashes
+        self.runner_up = runner_up
+        self.probe_hashes = probe_hashes
+
+
+class FeatureStore:
+    """
+    Per-run store of document features keyed by content fingerprint.
+
+    Identical documents are shingled, minhashed and banded once while their features are
+    stored; later occurrences reuse them. The store is a bounded LRU cache: once it holds
+    `max_entries` documents, the least recently used entries are dropped, so a document
+    repeated only after `max_entries` other distinct documents is signed again. Without a
+    bound, every distinct document is signed exactly once per run, at the cost of keeping
+    all of their features.
+    """
+
+    def __init__(self, max_entries: Optional[int] = DEFAULT_MAX_ENTRIES):
+        """
+        Initialize the feature store.
+
+        Parameters:
+            max_entries (int): Largest number of documents kept; 0 disables the store and
+                None removes the bound.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.entries
+
+    def get(self, key: bytes) -> Optional[DocumentFeatures]:
+        """
+        Look up the features of a document.
+
+        Parameters:
+            key (bytes): Content fingerprint of the document.
+
+        Returns:
+            DocumentFeatures: The stored features, or None on a miss.
+        """
+        features = self.entries.get(key)
+        if features is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.max_entries is not None:
+            self.entries.move_to_end(key)
+        return features
+
+    def put(self, features: DocumentFeatures):
+        """Store the features of a document under its fingerprint."""
+        self.entries[features.fingerprint] = features
+        if self.max_entries is not None and len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every stored entry."""
+        self.entries.clear()
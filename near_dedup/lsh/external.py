@@ -0,0 +1,138 @@
+import heapq
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+# One spilled (band_key, doc_id) record; the 128-bit band key is split into two words.
+RECORD_DTYPE = np.dtype([("key_hi", "<u8"), ("key_lo", "<u8"), ("doc_id", "<i8")])
+SORT_ORDER = ["key_hi", "key_lo", "doc_id"]
+LOW_WORD = (1 << 64) - 1
+
+
+def group_buckets(records: Iterator[tuple]) -> Iterator[List[int]]:
+    """
+    Group a key-sorted stream of records into buckets.
+
+    Parameters:
+        records (Iterator[tuple]): (key_hi, key_lo, doc_id) records sorted by key.
+
+    Returns:
+        Iterator[List[int]]: The document IDs sharing each band key, in key order.
+    """
+    current_key, members = None, []
+    for key_hi, key_lo, doc_id in records:
+        if (key_hi, key_lo) != current_key:
+            if members:
+                yield members
+            current_key, members = (key_hi, key_lo), []
+        members.append(doc_id)
+    if members:
+        yield members
+
+
+class ExternalBandGrouper:
+    """
+    Out-of-core grouping of (band_key, doc_id) records by band key.
+
+    Records are buffered in a fixed-size NumPy array; whenever it fills up the buffer is
+    sorted and spilled to a run file on local disk. `iter_buckets` k-way merges the runs
+    by key and yields the document IDs of one bucket at a time, so peak memory is bounded
+    by `memory_budget` rather than by the number of records.
+    """
+
+    def __init__(
+        self, memory_budget: int = 64 * 1024 * 1024, spill_dir: Optional[str] = None
+    ):
+        """
+        Initialize the grouper.
+
+        Parameters:
+            memory_budget (int): Bytes available for the record buffer and merge read buffers.
+            spill_dir (str): Directory for run files; a temporary directory when None.
+        """
+        self.memory_budget = memory_budget
+        self.chunk_records = max(1, memory_budget // (2 * RECORD_DTYPE.itemsize))
+        self.owns_dir = spill_dir is None
+        if spill_dir is None:
+            spill_dir = tempfile.mkdtemp(prefix="near_dedup_runs_")
+        self.spill_dir = spill_dir
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.buffer = np.empty(self.chunk_records, dtype=RECORD_DTYPE)
+        self.count = 0
+        self.runs: List[str] = []
+        self.num_records = 0
+
+    def add(self, band_key: int, doc_id: int):
+        """
+        Buffer one record, spilling a sorted run when the buffer is full.
+
+        Parameters:
+            band_key (int): Band hash (up to 128 bits).
+            doc_id (int): Identifier of the document.
+        """
+        self.buffer[self.count] = (band_key >> 64, band_key & LOW_WORD, doc_id)
+        self.count += 1
+        self.num_records += 1
+        if self.count == self.chunk_records:
+            self.spill()
+
+    def spill(self):
+        """Sort the buffered records and write them to a new run file."""
+        if self.count == 0:
+            return
+        run = np.sort(self.buffer[: self.count], order=SORT_ORDER)
+        path = os.path.join(self.spill_dir, f"run-{len(self.runs):06d}.bin")
+        run.tofile(path)
+        self.runs.append(path)
+        self.count = 0
+        logging.debug(f"Spilled {len(run)} band records to {path}.")
+
+    def iter_run(self, path: str, block_records: int) -> Iterator[tuple]:
+        """Stream the records of one run file in blocks of `block_records`."""
+        with open(path, "rb") as file:
+            while True:
+                block = np.fromfile(file, dtype=RECORD_DTYPE, count=block_records)
+                if len(block) == 0:
+                    return
+                yield from block.tolist()
+
+    def iter_sorted(self) -> Iterator[tuple]:
+        """
+        Merge all runs into one stream of records sorted by band key.
+
+        Returns:
+            Iterator[tuple]: (key_hi, key_lo, doc_id) records in key order.
+        """
+        self.spill()
+        if not self.runs:
+            return iter(())
+        block_records = max(1, self.chunk_records // len(self.runs))
+        return heapq.merge(*(self.iter_run(path, block_records) for path in self.runs))
+
+    def iter_buckets(self) -> Iterator[List[int]]:
+        """
+        Yield the document IDs of every band bucket, one bucket at a time.
+
+        Returns:
+            Iterator[List[int]]: Sorted document IDs sharing a band key.
+        """
+        return group_buckets(self.iter_sorted())
+
+    def close(self):
+        """Delete the run files (and the spill directory if the grouper created it)."""
+        for path in self.runs:
+            if os.path.exists(path):
+                os.remove(path)
+        self.runs = []
+        if self.owns_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
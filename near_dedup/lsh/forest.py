@@ -0,0 +1,356 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from near_dedup.features.features import DocumentFeatures
+from near_dedup.lsh.lsh import LSHBase, UnionFind
+
+# Bytes kept per minhash value in the prefix keys (values are truncated to 32 bits).
+VALUE_BYTES = 4
+
+
+class LSHForest(LSHBase):
+    """
+    LSH Forest over minhash signatures for query-time threshold selection.
+
+    The signature is split into `num_trees` trees of `max_depth` rows. Every tree keeps
+    the documents' row values as fixed-width byte keys in one sorted array, so all
+    documents agreeing on the first `depth` rows of a tree form a contiguous range that
+    a binary search finds. Picking `depth` at query time gives the banding behaviour of
+    `num_trees` bands with `depth` rows per band, so one index serves several thresholds.
+    """
+
+    def __init__(
+        self,
+        num_trees: int,
+        max_depth: int,
+        num_hashes: Optional[int] = None,
+        shingle_size: int = 5,
+        minhash_method: str = "classic",
+    ):
+        """
+        Initializes the LSH Forest with the specified parameters.
+
+        Parameters:
+        - num_trees: Number of prefix trees (bands).
+        - max_depth: Maximum prefix length, in signature rows, of every tree.
+        - num_hashes: Number of hash functions; defaults to `num_trees * max_depth`.
+        - shingle_size: Size of each shingle (substring) to be generated from documents.
+        - minhash_method: 'classic' or 'oph', as for `LSHBase`.
+        """
+        if num_hashes is None:
+            num_hashes = num_trees * max_depth
+        if num_hashes < num_trees * max_depth:
+            raise ValueError("num_hashes must be at least num_trees * max_depth.")
+        super().__init__(
+            num_trees, max_depth, num_hashes, shingle_size, minhash_method
+        )
+        self.features.max_entries = 0  # Documents are signed once; nbytes is the index
+        self.num_trees = num_trees
+        self.max_depth = max_depth
+        self.key_width = VALUE_BYTES * max_depth
+        self.pending_ids: List[int] = []
+        self.pending_keys: List[List[bytes]] = []
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.trees: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    def tree_keys(self, signature: List[int]) -> List[bytes]:
+        """
+        Encodes every tree's rows of a signature as a big-endian byte key.
+
+        Parameters:
+        - signature: Minhash signature list.
+
+        Returns:
+        - One key per tree; byte order matches lexicographic row order.
+        """
+        mask = (1 << (8 * VALUE_BYTES)) - 1
+        keys = []
+        for tree in range(self.num_trees):
+            rows = signature[tree * self.max_depth : (tree + 1) * self.max_depth]
+            keys.append(
+                b"".join(
+                    (int(value) & mask if value != float("inf") else mask).to_bytes(
+                        VALUE_BYTES, "big"
+                    )
+                    for value in rows
+                )
+            )
+        return keys
+
+    def add_signature(self, doc_id: int, signature: List[int]):
+        """
+        Adds a document with a precomputed minhash signature to the forest.
+
+        Parameters:
+        - doc_id: Unique identifier for the document.
+        - signature: Minhash signature of the document.
+        """
+        self.keep_signature(doc_id, signature)
+        self.pending_ids.append(doc_id)
+        self.pending_keys.append(self.tree_keys(signature))
+
+    def add_features(self, doc_id: int, features: DocumentFeatures):
+        """Adds a document with precomputed features to the forest."""
+        self.add_signature(doc_id, features.signature)
+
+    def is_indexed(self, doc_id: int) -> bool:
+        """Whether a document is pending or built into the forest and not removed."""
+        if doc_id in self.pending_ids:
+            return True
+        return doc_id not in self.tombstones and bool(np.any(self.doc_ids == doc_id))
+
+    def remove_document(self, doc_id: int):
+        """
+        Removes a document from the forest.
+
+        A pending document is dropped at once. A built one becomes a tombstone that the
+        next `build`, which every query and clustering call runs first, filters out of
+        the sorted arrays without re-sorting them. Unlike `LSHBase`, the forest needs no
+        `removable` bookkeeping: its rows already record every document ID.
+
+        Parameters:
+        - doc_id: Identifier of an indexed document.
+        """
+        if doc_id in self.pending_ids:
+            position = self.pending_ids.index(doc_id)
+            del self.pending_ids[position], self.pending_keys[position]
+            return
+        if not self.is_indexed(doc_id):
+            raise KeyError(f"Document {doc_id} is not in the index.")
+        self.tombstones.add(doc_id)
+
+    def update_document(self, doc_id: int, doc: str) -> DocumentFeatures:
+        """
+        Replaces the text of an indexed document, or adds it if it is not indexed.
+
+        Parameters:
+        - doc_id: Identifier of the document.
+        - doc: New document text.
+
+        Returns:
+        - The features of the new text.
+        """
+        if self.is_indexed(doc_id):
+            self.remove_document(doc_id)
+        return self.add_document(doc_id, doc)
+
+    def purge(self):
+        """Drops the rows of removed documents from the sorted arrays, keeping their order."""
+        keep = ~np.isin(self.doc_ids, list(self.tombstones))
+        positions = np.cumsum(keep) - 1  # New row of every kept row
+        trees = []
+        for keys, rows in self.trees:
+            kept = keep[rows]
+            trees.append((keys[kept], positions[rows[kept]]))
+        self.trees = trees
+        self.doc_ids = self.doc_ids[keep]
+        self.tombstones = set()
+
+    def build(self):
+        """Purges removed documents and merges pending ones into the sorted prefix arrays."""
+        if self.tombstones:
+            self.purge()
+        if not self.pending_ids:
+            return
+        offset = len(self.doc_ids)
+        self.doc_ids = np.concatenate(
+            [self.doc_ids, np.array(self.pending_ids, dtype=np.int64)]
+        )
+        trees = []
+        for tree in range(self.num_trees):
+            new_keys = np.array(
+                [keys[tree] for keys in self.pending_keys], dtype=f"S{self.key_width}"
+            )
+            new_rows = np.arange(offset, offset + len(new_keys), dtype=np.int64)
+            if self.trees:
+                old_keys, old_rows = self.trees[tree]
+                new_keys = np.concatenate([old_keys, new_keys])
+                new_rows = np.concatenate([old_rows, new_rows])
+            order = np.argsort(new_keys, kind="stable")
+            trees.append((new_keys[order], new_rows[order]))
+        self.trees = trees
+        self.pending_ids, self.pending_keys = [], []
+
+    def calculate_probability(self, similarity: float, depth: int) -> float:
+        """Calculate the probability of two items sharing a depth-long prefix in at least one tree."""
+        return 1 - (1 - similarity**depth) ** self.num_trees
+
+    def depth_for_threshold(self, threshold: float) -> int:
+        """
+        Picks the prefix depth whose LSH S-curve is centred closest to a similarity threshold.
+
+        With `num_trees` bands of `depth` rows, the candidate probability rises most
+        steeply near (1 / num_trees) ** (1 / depth).
+
+        Parameters:
+        - threshold: Target Jaccard similarity threshold.
+
+        Returns:
+        - Prefix depth between 1 and `max_depth`.
+        """
+        return min(
+            range(1, self.max_depth + 1),
+            key=lambda depth: abs((1 / self.num_trees) ** (1 / depth) - threshold),
+        )
+
+    def prefix_range(self, tree: int, key: bytes, depth: int) -> Tuple[int, int]:
+        """Binary-searches the rows of a tree sharing the first `depth` values of a key."""
+        keys = self.trees[tree][0]
+        prefix = key[: VALUE_BYTES * depth]
+        upper = prefix + b"\xff" * (self.key_width - len(prefix))
+        left = int(np.searchsorted(keys, np.bytes_(prefix), side="left"))
+        right = int(np.searchsorted(keys, np.bytes_(upper), side="right"))
+        return left, right
+
+    def query_signature(
+        self,
+        signature: List[int],
+        k: Optional[int] = None,
+        depth: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Finds indexed documents sharing a prefix with a signature in any tree.
+
+        Without `k`, returns every document sharing `depth` (default `max_depth`) leading
+        rows with the query in at least one tree. With `k`, descends synchronously from
+        `max_depth` (or from `depth`, if given, without descending) and stops at the
+        deepest level that yields at least `k` documents.
+
+        Parameters:
+        - signature: Minhash signature of the query document.
+        - k: Number of nearest candidates wanted.
+        - depth: Fixed prefix depth to match.
+
+        Returns:
+        - Document IDs, those matching longer prefixes first.
+        """
+        if depth is not None:
+            depths = [self.resolve_depth(depth, None)]
+        elif k is None:
+            depths = [self.max_depth]
+        else:
+            depths = range(self.max_depth, 0, -1)
+        self.build()
+        if not self.trees:
+            return []
+        keys = self.tree_keys(signature)
+        found: Dict[int, None] = {}
+        for level in depths:
+            level_rows = set()
+            for tree, key in enumerate(keys):
+                left, right = self.prefix_range(tree, key, level)
+                level_rows.update(self.trees[tree][1][left:right].tolist())
+            for doc_id in sorted(self.doc_ids[list(level_rows)].tolist()):
+                found.setdefault(doc_id)
+            if k is not None and len(found) >= k:
+                break
+        results = list(found)
+        return results if k is None else results[:k]
+
+    def query(
+        self,
+        doc: str,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+        depth: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Finds indexed documents similar to a query document.
+
+        Parameters:
+        - doc: Query document as a string.
+        - k: Number of nearest candidates wanted.
+        - threshold: Similarity threshold, translated to a prefix depth.
+        - depth: Fixed prefix depth to match; overrides `threshold`.
+
+        Returns:
+        - Document IDs, those matching longer prefixes first.
+        """
+        if depth is None and threshold is not None:
+            depth = self.depth_for_threshold(threshold)
+        signature = self.minhash(self.shingle_document(doc))
+        return self.query_signature(signature, k=k, depth=depth)
+
+    def prefix_runs(self, depth: int):
+        """Yields the rows of every run of documents sharing a depth-long prefix in some tree."""
+        self.build()
+        width = VALUE_BYTES * depth
+        for keys, rows in self.trees:
+            if len(keys) < 2:
+                continue
+            prefixes = keys.view(np.uint8).reshape(len(keys), self.key_width)[:, :width]
+            changed = np.any(prefixes[1:] != prefixes[:-1], axis=1)
+            boundaries = np.flatnonzero(changed) + 1
+            for run in np.split(rows, boundaries):
+                if len(run) > 1:
+                    yield run
+
+    def find_candidates(
+        self, depth: Optional[int] = None, threshold: Optional[float] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        Finds pairs of documents sharing a prefix of the chosen depth in some tree.
+
+        Parameters:
+        - depth: Prefix depth; defaults to `max_depth`.
+        - threshold: Similarity threshold, translated to a prefix depth.
+
+        Returns:
+        - A list of tuples, where each tuple contains two document IDs that are candidate pairs.
+        """
+        depth = self.resolve_depth(depth, threshold)
+        candidate_pairs = set()
+        for run in self.prefix_runs(depth):
+            doc_ids = sorted(self.doc_ids[run].tolist())
+            for i in range(len(doc_ids)):
+                for j in range(i + 1, len(doc_ids)):
+                    candidate_pairs.add((doc_ids[i], doc_ids[j]))
+        return list(candidate_pairs)
+
+    def cluster_candidates(
+        self, depth: Optional[int] = None, threshold: Optional[float] = None
+    ) -> Dict[int, List[int]]:
+        """
+        Clusters documents sharing a prefix of the chosen depth using Union-Find.
+
+        Parameters:
+        - depth: Prefix depth; defaults to `max_depth`.
+        - threshold: Similarity threshold, translated to a prefix depth.
+
+        Returns:
+        - A dictionary where each key is a root document ID, and the value is a list of document IDs in that cluster.
+        """
+        depth = self.resolve_depth(depth, threshold)
+        uf = UnionFind()
+        for run in self.prefix_runs(depth):
+            doc_ids = self.doc_ids[run].tolist()
+            for doc_id in doc_ids:
+                uf.add(doc_id)
+            for doc1, doc2 in zip(doc_ids, doc_ids[1:]):
+                uf.union(doc1, doc2)
+
+        clusters = defaultdict(list)
+        for doc_id in uf.parent:
+            clusters[uf.find(doc_id)].append(doc_id)
+        for key in clusters:
+            clusters[key].sort()
+        return clusters
+
+    def resolve_depth(self, depth: Optional[int], threshold: Optional[float]) -> int:
+        """Returns the explicit depth, the depth for a threshold, or `max_depth`."""
+        if depth is not None:
+            if not 1 <= depth <= self.max_depth:
+                raise ValueError(f"depth must be between 1 and {self.max_depth}.")
+            return depth
+        if threshold is not None:
+            return self.depth_for_threshold(threshold)
+        return self.max_depth
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the sorted prefix arrays and row indices (the forest keeps no feature store)."""
+        tree_bytes = sum(keys.nbytes + rows.nbytes for keys, rows in self.trees)
+        return tree_bytes + self.doc_ids.nbytes
+
@@ -1,13 +1,23 @@
 import hashlib
 import logging
+import random
 from abc import ABC, abstractmethod
-from collections import defaultdict
-from typing import List, Set, Tuple, Dict
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from near_dedup.bloom_filter.bloom_filter import BlockedBloomFilter, CountMinSketch
+from near_dedup.features.features import DocumentFeatures, FeatureStore, fingerprint
+from near_dedup.lsh.external import ExternalBandGrouper
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+MINHASH_METHODS = ("classic", "oph")
+# Band hashes are 128-bit MD5 digests; stored probe sequences are packed at this width.
+KEY_BYTES = 16
+HEAVY_BUCKET_POLICIES = ("cap", "sample", "split")
+
 
 class AbstractLSH(ABC):
     """Abstract class for Locality Sensitive Hashing (LSH) operations."""
@@ -38,11 +48,32 @@ class AbstractLSH(ABC):
         pass
 
 
+def pack_keys(keys: List[int]) -> bytes:
+    """Packs 128-bit bucket keys into one bytes object (16 bytes per key)."""
+    return b"".join(key.to_bytes(KEY_BYTES, "little") for key in keys)
+
+
+def unpack_keys(data: bytes) -> List[int]:
+    """Unpacks bucket keys packed by `pack_keys`."""
+    return [
+        int.from_bytes(data[i : i + KEY_BYTES], "little")
+        for i in range(0, len(data), KEY_BYTES)
+    ]
+
+
 class LSHBase(AbstractLSH):
     """Locality Sensitive Hashing (LSH) for finding near-duplicate documents."""
 
     def __init__(
-        self, num_bands: int, rows_per_band: int, num_hashes: int, shingle_size: int = 5
+        self,
+        num_bands: int,
+        rows_per_band: int,
+        num_hashes: int,
+        shingle_size: int = 5,
+        minhash_method: str = "classic",
+        max_bucket_size: Optional[int] = None,
+        heavy_bucket_policy: str = "cap",
+        removable: bool = False,
     ):
         """
         Initializes the LSH with the specified parameters.
@@ -52,12 +83,58 @@ class LSHBase(AbstractLSH):
         - rows_per_band: Number of rows per band.
         - num_hashes: Number of hash functions to generate the minhash signature.
         - shingle_size: Size of each shingle (substring) to be generated from documents.
+        - minhash_method: 'classic' for one hash function per signature row, or 'oph' for
+          one-permutation hashing with optimal densification.
+        - max_bucket_size: Largest number of documents a bucket may hold; None for no limit.
+        - heavy_bucket_policy: What to do once a bucket is full: 'cap' drops new documents,
+          'sample' keeps a uniform reservoir sample, and 'split' sub-partitions the bucket
+          with an extra hash band (capping sub-buckets that fill up again).
+        - removable: If True, record the buckets of every document so documents can be
+          removed and updated; this costs a list of bucket keys per document.
         """
+        if minhash_method not in MINHASH_METHODS:
+            raise ValueError(
+                f"minhash_method must be one of {MINHASH_METHODS}, got '{minhash_method}'."
+            )
+        if heavy_bucket_policy not in HEAVY_BUCKET_POLICIES:
+            raise ValueError(
+                f"heavy_bucket_policy must be one of {HEAVY_BUCKET_POLICIES}, got '{heavy_bucket_policy}'."
+            )
+        if heavy_bucket_policy == "split" and num_hashes <= rows_per_band:
+            raise ValueError(
+                "heavy_bucket_policy 'split' needs signature rows outside every band."
+            )
         self.num_bands = num_bands
         self.rows_per_band = rows_per_band
         self.num_hashes = num_hashes
         self.shingle_size = shingle_size
+        self.minhash_method = minhash_method
+        self.max_bucket_size = max_bucket_size
+        self.heavy_bucket_policy = heavy_bucket_policy
+        self.removable = removable
         self.buckets = defaultdict(list)
+        self.heavy_buckets = set()
+        self.split_keys = defaultdict(list)
+        self.bucket_seen = defaultdict(int)
+        self.bucket_stats = {
+            "heavy_buckets": 0,
+            "capped": 0,
+            "sampled_out": 0,
+            "split_buckets": 0,
+        }
+        self.rng = random.Random(0)
+        self.df_sketch = None
+        self.max_df = None
+        self.stop_shingles_dropped = 0
+        self.df_digest = None
+        self.signature_cache = None
+        self.signature_store = None
+        self.features = FeatureStore()
+        self.uf = UnionFind()
+        self.doc_bands = defaultdict(list)
+        self.tombstones = set()
+        self.dirty_buckets = set()
+        self.compaction_ratio = 0.25
         logging.info(
             f"Initialized LSH with {num_bands} bands, {rows_per_band} rows per band, {num_hashes} hash functions."
         )
@@ -72,11 +149,112 @@ class LSHBase(AbstractLSH):
         Returns:
         - A set of shingles extracted from the document.
         """
+        shingles = self.raw_shingles(doc)
+        if self.df_sketch is None:
+            return shingles
+        kept = {
+            shingle
+            for shingle in shingles
+            if self.df_sketch.estimate(shingle) <= self.max_df
+        }
+        if not kept:
+            return shingles  # Keep documents made only of stop shingles comparable
+        self.stop_shingles_dropped += len(shingles) - len(kept)
+        return kept
+
+    def raw_shingles(self, doc: str) -> Set[str]:
+        """Generates every shingle of the document, ignoring the stop-shingle filter."""
         return {
             doc[i : i + self.shingle_size]
             for i in range(len(doc) - self.shingle_size + 1)
         }
 
+    def document_frequency_sketch(
+        self, documents: Iterable[str], epsilon: float = 0.0001, delta: float = 0.01
+    ) -> CountMinSketch:
+        """
+        Counts in how many documents every shingle occurs, in bounded memory.
+
+        Parameters:
+        - documents: Documents to count; each distinct shingle counts once per document.
+        - epsilon: Maximum overcount as a fraction of the total shingle count.
+        - delta: Probability of exceeding the epsilon error bound.
+
+        Returns:
+        - A Count-Min Sketch of shingle document frequencies. Sketches from several
+          workers can be combined with `CountMinSketch.merge`.
+        """
+        sketch = CountMinSketch(epsilon, delta)
+        for doc in documents:
+            for shingle in self.raw_shingles(doc):
+                sketch.add(shingle)
+        return sketch
+
+    def set_stop_shingle_filter(self, sketch: Optional[CountMinSketch], max_df: int):
+        """
+        Drops shingles whose estimated document frequency exceeds `max_df` before MinHash.
+
+        Parameters:
+        - sketch: Document-frequency sketch, or None to disable filtering.
+        - max_df: Largest document frequency a shingle may have and still be hashed.
+        """
+        self.df_sketch = sketch
+        self.max_df = max_df
+        self.df_digest = (
+            None if sketch is None else hashlib.sha256(sketch.to_bytes()).hexdigest()
+        )
+
+    def set_signature_cache(self, cache):
+        """
+        Reuses signatures from a persistent cache when adding documents.
+
+        Parameters:
+        - cache: A `SignatureCache`, or None to always compute signatures.
+        """
+        self.signature_cache = cache
+
+    def set_signature_store(self, store):
+        """
+        Keeps a compressed copy of every added document's signature.
+
+        Parameters:
+        - store: A `SignatureStore` filled as documents are added, or None to keep none.
+        """
+        self.signature_store = store
+
+    def keep_signature(self, doc_id: int, signature: List[int]):
+        """Adds a signature to the signature store, if one is set."""
+        if self.signature_store is not None:
+            self.signature_store.add(doc_id, signature)
+
+    def signature_params(self) -> dict:
+        """Returns the parameters that determine a document's signature, for cache keys."""
+        return {
+            "shingle_size": self.shingle_size,
+            "num_hashes": self.num_hashes,
+            "minhash_method": self.minhash_method,
+            "max_df": self.max_df,
+            "df_sketch": self.df_digest,
+        }
+
+    def document_signature(self, doc: str) -> List[int]:
+        """
+        Shingles and minhashes a document, consulting the signature cache if one is set.
+
+        Parameters:
+        - doc: Document as a string.
+
+        Returns:
+        - Minhash signature of the document.
+        """
+        if self.signature_cache is None:
+            return self.minhash(self.shingle_document(doc))
+        return self.signature_cache.fetch(
+            doc,
+            self.signature_params(),
+            lambda: self.minhash(self.shingle_document(doc)),
+        )
+
     def minhash(self, shingles: Set[str]) -> List[int]:
         """
         Generates a minhash signature from the set of shingles.
@@ -87,6 +265,8 @@ class LSHBase(AbstractLSH):
         Returns:
         - List of integers representing the minhash signature.
         """
+        if self.minhash_method == "oph":
+            return self.one_permutation_minhash(shingles)
         signature = []
         for i in range(self.num_hashes):
             min_hash = float("inf")
@@ -98,6 +278,60 @@ class LSHBase(AbstractLSH):
             signature.append(min_hash)
         return signature
 
+    def one_permutation_minhash(self, shingles: Set[str]) -> List[int]:
+        """
+        Generates a minhash signature with one-permutation hashing (OPH).
+
+        Each shingle is hashed once; the hash picks one of `num_hashes` bins and the
+        remaining bits are the value kept as the bin minimum. Empty bins are filled by
+        optimal densification: bin j probes bins chosen by a hash of (j, attempt) until it
+        finds a non-empty one and borrows its value. The probe sequence depends only on
+        the bin, so two documents agree on a densified bin with the Jaccard probability.
+
+        Parameters:
+        - shingles: Set of shingles from a document.
+
+        Returns:
+        - List of integers representing the minhash signature.
+        """
+        bins = [float("inf")] * self.num_hashes
+        for shingle in shingles:
+            hash_value = int(hashlib.md5(shingle.encode()).hexdigest(), 16)
+            value, bin_index = divmod(hash_value, self.num_hashes)
+            if value < bins[bin_index]:
+                bins[bin_index] = value
+        if not shingles:
+            return bins
+        return [bins[source] for source in self.densification_sources(bins)]
+
+    def densification_sources(self, bins: List[float]) -> List[int]:
+        """
+        Picks, for every OPH bin, the bin whose value it takes after optimal densification.
+
+        Non-empty bins keep their own value; empty bin j probes bins chosen by a hash of
+        (j, attempt) until it finds a non-empty one. At least one bin must be non-empty.
+
+        Parameters:
+        - bins: Per-bin minimum values, with infinity marking empty bins.
+
+        Returns:
+        - List with the source bin index for every bin.
+        """
+        sources = []
+        for bin_index, value in enumerate(bins):
+            source, attempt = bin_index, 0
+            while value == float("inf"):
+                attempt += 1
+                source = (
+                    int(
+                        hashlib.md5(f"{bin_index}-{attempt}".encode()).hexdigest(), 16
+                    )
+                    % self.num_hashes
+                )
+                value = bins[source]
+            sources.append(source)
+        return sources
+
     def banding(self, signature: List[int]) -> List[int]:
         """
         Divides the minhash signature into bands and hashes each band.
@@ -117,18 +351,182 @@ class LSHBase(AbstractLSH):
             band_hashes.append(band_hash)
         return band_hashes
 
-    def add_document(self, doc_id: int, doc: str):
+    def compute_features(self, doc: str, key: bytes) -> DocumentFeatures:
+        """Shingles, minhashes and bands a document."""
+        signature = self.document_signature(doc)
+        return DocumentFeatures(key, signature, self.banding(signature))
+
+    def document_features(self, doc: str) -> DocumentFeatures:
+        """
+        Returns a document's features, computing them only the first time its text is seen.
+
+        Parameters:
+        - doc: Document as a string.
+
+        Returns:
+        - The document's fingerprint, signature and band hashes.
+        """
+        key = fingerprint(doc)
+        features = self.features.get(key)
+        if features is None:
+            features = self.compute_features(doc, key)
+            self.features.put(features)
+        return features
+
+    def add_document(self, doc_id: int, doc: str) -> DocumentFeatures:
         """
         Adds a document to the LSH by hashing its signature bands and storing them in buckets.
 
         Parameters:
         - doc_id: Unique identifier for the document.
         - doc: Document as a string.
+
+        Returns:
+        - The document's features, so callers can reuse its signature.
+        """
+        features = self.document_features(doc)
+        self.add_features(doc_id, features)
+        return features
+
+    def add_signature(self, doc_id: int, signature: List[int]):
+        """
+        Adds a document with a precomputed minhash signature to the buckets.
+
+        Parameters:
+        - doc_id: Unique identifier for the document.
+        - signature: Minhash signature of the document.
+        """
+        self.add_features(
+            doc_id, DocumentFeatures(None, signature, self.banding(signature))
+        )
+
+    def add_features(self, doc_id: int, features: DocumentFeatures):
+        """
+        Adds a document with precomputed features to the buckets.
+
+        Parameters:
+        - doc_id: Unique identifier for the document.
+        - features: Signature and band hashes of the document.
+        """
+        self.keep_signature(doc_id, features.signature)
+        if self.removable:
+            self.doc_bands[doc_id]  # Register the document even if every band is capped
+        for band, band_hash in enumerate(features.band_hashes):
+            self.insert_band(band, band_hash, doc_id, features.signature)
+
+    def split_key(self, band: int, band_hash: int, signature: List[int]) -> int:
+        """
+        Hashes a band together with an extra band of rows to sub-partition a heavy bucket.
+
+        The extra band takes the first `rows_per_band` rows outside the band, starting
+        after the last banded row, offset by the band index and wrapping around the
+        signature. Members of a heavy bucket agree on the band's own rows, so those are
+        skipped even when every row of the signature is banded.
+
+        Parameters:
+        - band: Index of the band.
+        - band_hash: Hash of the band.
+        - signature: Minhash signature of the document.
+
+        Returns:
+        - Key of the sub-bucket.
+        """
+        start = (self.num_bands + band) * self.rows_per_band
+        band_rows = range(band * self.rows_per_band, (band + 1) * self.rows_per_band)
+        rows = ((start + offset) % self.num_hashes for offset in range(self.num_hashes))
+        extra_rows = [signature[row] for row in rows if row not in band_rows]
+        extra_rows = extra_rows[: self.rows_per_band]
+        return int(hashlib.md5(str((band_hash, extra_rows)).encode()).hexdigest(), 16)
+
+    def bucket_key(self, band: int, band_hash: int, signature: List[int]) -> int:
+        """Returns the bucket a band lives in, following heavy buckets that were split."""
+        if band_hash in self.heavy_buckets and self.heavy_bucket_policy == "split":
+            return self.split_key(band, band_hash, signature)
+        return band_hash
+
+    def insert_band(
+        self, band: int, band_hash: int, doc_id: int, signature: List[int]
+    ):
+        """
+        Appends a document to a band bucket, applying the heavy-bucket policy when it is full.
+
+        Parameters:
+        - band: Index of the band.
+        - band_hash: Hash of the band.
+        - doc_id: Unique identifier for the document.
+        - signature: Minhash signature of the document.
         """
-        shingles = self.shingle_document(doc)
-        signature = self.minhash(shingles)
-        for band_hash in self.banding(signature):
+        if self.max_bucket_size is None:
             self.buckets[band_hash].append(doc_id)
+            self.record_band(doc_id, band_hash)
+            return
+
+        key = self.bucket_key(band, band_hash, signature)
+        bucket = self.buckets[key]
+        if len(bucket) < self.max_bucket_size:
+            bucket.append(doc_id)
+            self.record_band(doc_id, key)
+            if self.heavy_bucket_policy == "split" and key == band_hash:
+                self.split_keys[key].append(self.split_key(band, band_hash, signature))
+            return
+
+        if key not in self.heavy_buckets:
+            self.heavy_buckets.add(key)
+            self.bucket_stats["heavy_buckets"] += 1
+            logging.info(
+                f"Bucket {key:x} reached {self.max_bucket_size} documents; applying '{self.heavy_bucket_policy}' policy."
+            )
+            if self.heavy_bucket_policy == "split" and key == band_hash:
+                self.bucket_stats["split_buckets"] += 1
+                members = self.buckets.pop(key)
+                for member, member_key in zip(members, self.split_keys.pop(key)):
+                    self.buckets[member_key].append(member)
+                    self.record_band(member, member_key)
+                self.insert_band(band, band_hash, doc_id, signature)
+                return
+
+        if self.heavy_bucket_policy == "sample":
+            self.bucket_seen[key] = max(self.bucket_seen[key], len(bucket)) + 1
+            slot = self.rng.randrange(self.bucket_seen[key])
+            if slot < len(bucket):
+                bucket[slot] = doc_id
+                self.record_band(doc_id, key)
+            self.bucket_stats["sampled_out"] += 1
+        else:
+            self.bucket_stats["capped"] += 1
+
+    def record_band(self, doc_id: int, key: int):
+        """Remembers that a document was stored in a bucket, if documents can be removed."""
+        if self.removable:
+            self.doc_bands[doc_id].append(key)
+
+    def query(self, doc: str) -> List[int]:
+        """
+        Finds indexed documents that share at least one band bucket with a query document.
+
+        Parameters:
+        - doc: Query document as a string.
+
+        Returns:
+        - A sorted list of candidate document IDs.
+        """
+        return self.query_signature(self.minhash(self.shingle_document(doc)))
+
+    def query_signature(self, signature: List[int]) -> List[int]:
+        """
+        Finds indexed documents that share at least one band bucket with a signature.
+
+        Parameters:
+        - signature: Minhash signature of the query document.
+
+        Returns:
+        - A sorted list of candidate document IDs.
+        """
+        candidates = set()
+        for band, band_hash in enumerate(self.banding(signature)):
+            key = self.bucket_key(band, band_hash, signature)
+            candidates.update(self.live(self.buckets.get(key, ())))
+        return sorted(candidates)
 
     def find_candidates(self):
         """
@@ -139,11 +537,146 @@ class LSHBase(AbstractLSH):
         """
         candidate_pairs = set()
         for bucket_docs in self.buckets.values():
+            bucket_docs = self.live(bucket_docs)
             for i in range(len(bucket_docs)):
                 for j in range(i + 1, len(bucket_docs)):
                     candidate_pairs.add((bucket_docs[i], bucket_docs[j]))
         return list(candidate_pairs)
 
+    def live(self, doc_ids: List[int]) -> List[int]:
+        """Filters removed (tombstoned) documents out of a bucket."""
+        if not self.tombstones:
+            return doc_ids
+        return [doc_id for doc_id in doc_ids if doc_id not in self.tombstones]
+
+    def record_id(self, doc_id: int) -> int:
+        """Returns the ID a document's bucket entries are stored under."""
+        return doc_id
+
+    def check_removable(self):
+        if not self.removable:
+            raise ValueError(
+                "Removing or updating documents needs an index created with removable=True."
+            )
+
+    def remove_document(self, doc_id: int):
+        """
+        Removes a document from the index.
+
+        The document becomes a tombstone that queries and clustering skip; its buckets are
+        cleaned up by the next compaction, which runs once tombstones exceed
+        `compaction_ratio` of the indexed documents (or on `compact`).
+
+        Parameters:
+        - doc_id: Identifier of an indexed document.
+        """
+        self.check_removable()
+        if doc_id not in self.doc_bands or self.record_id(doc_id) in self.tombstones:
+            raise KeyError(f"Document {doc_id} is not in the index.")
+        self.tombstones.add(self.record_id(doc_id))
+        self.dirty_buckets.update(self.doc_bands[doc_id])
+        if len(self.tombstones) > self.compaction_ratio * len(self.doc_bands):
+            self.compact()
+
+    def update_document(self, doc_id: int, doc: str) -> DocumentFeatures:
+        """
+        Replaces the text of an indexed document, or adds it if it is not indexed.
+
+        Parameters:
+        - doc_id: Identifier of the document.
+        - doc: New document text.
+
+        Returns:
+        - The features of the new text.
+        """
+        self.check_removable()
+        if doc_id in self.doc_bands and self.record_id(doc_id) not in self.tombstones:
+            self.remove_document(doc_id)
+        if self.record_id(doc_id) in self.tombstones:
+            self.compact()
+        return self.add_document(doc_id, doc)
+
+    def compact(self):
+        """
+        Purges tombstones from the buckets they were in and repairs the affected clusters.
+
+        Only buckets that held a removed document are rewritten, and only the clusters of
+        the removed documents' candidates are recomputed.
+        """
+        removed = self.tombstones
+        if not removed:
+            return
+        affected = set()
+        for doc_id in removed:
+            affected.update(self.neighbors(doc_id))
+        affected -= removed
+        for key in self.dirty_buckets:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            kept = [i for i, doc_id in enumerate(bucket) if doc_id not in removed]
+            if key in self.split_keys:
+                self.split_keys[key] = [self.split_keys[key][i] for i in kept]
+            if kept:
+                self.buckets[key] = [bucket[i] for i in kept]
+            else:
+                del self.buckets[key]
+        for doc_id in removed:
+            self.forget_document(doc_id)
+        self.tombstones, self.dirty_buckets = set(), set()
+        self.repair_clusters(removed, affected)
+        logging.info(
+            f"Compacted {len(removed)} removed documents; {len(affected)} documents were their candidates."
+        )
+
+    def forget_document(self, doc_id: int):
+        """Drops the per-document bookkeeping of a removed document."""
+        del self.doc_bands[doc_id]
+
+    def neighbors(self, doc_id: int) -> Set[int]:
+        """Returns the documents that form a candidate pair with a document."""
+        found = set()
+        for key in self.doc_bands.get(doc_id, ()):
+            bucket = self.buckets.get(key, ())
+            if doc_id in bucket:
+                found.update(bucket)
+        found.discard(doc_id)
+        return found
+
+    def repair_clusters(self, removed: Set[int], affected: Set[int]):
+        """
+        Recomputes the Union-Find clusters that contained removed documents.
+
+        Every member of such a cluster is still connected to one of the `affected`
+        documents (the removed documents' candidates), so a breadth-first search over
+        candidate pairs from them finds every surviving sub-cluster.
+        """
+        if not self.uf.parent:
+            return
+        for doc_id in removed:
+            self.uf.parent.pop(doc_id, None)
+            self.uf.rank.pop(doc_id, None)
+        visited, edges = set(), []
+        for start in affected:
+            if start in visited:
+                continue
+            visited.add(start)
+            queue = deque([start])
+            while queue:
+                doc_id = queue.popleft()
+                for other in self.neighbors(doc_id):
+                    if other not in visited:
+                        visited.add(other)
+                        queue.append(other)
+                        edges.append((doc_id, other))
+        for doc_id in visited:
+            self.uf.parent.pop(doc_id, None)
+            self.uf.rank.pop(doc_id, None)
+        for doc1, doc2 in edges:
+            self.uf.add(doc1)
+            self.uf.add(doc2)
+            self.uf.union(doc1, doc2)
+
 
 class UnionFind:
     """Union-Find data structure for clustering similar documents."""
@@ -201,23 +734,179 @@ class LSH(LSHBase):
     """LSH with Union-Find for clustering similar documents."""
 
     def __init__(
-        self, num_bands: int, rows_per_band: int, num_hashes: int, shingle_size: int = 5
+        self,
+        num_bands: int,
+        rows_per_band: int,
+        num_hashes: int,
+        shingle_size: int = 5,
+        minhash_method: str = "classic",
+        max_bucket_size: Optional[int] = None,
+        heavy_bucket_policy: str = "cap",
+        memory_budget: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        removable: bool = False,
     ):
-        super().__init__(num_bands, rows_per_band, num_hashes, shingle_size)
-        self.uf = UnionFind()
+        """
+        Initializes the LSH; see `LSHBase` for the shared parameters.
+
+        Parameters:
+        - memory_budget: If set, cluster out of core: band records are spilled to sorted
+          run files within this many bytes of buffer instead of kept in `buckets`.
+        - spill_dir: Directory for the run files; a temporary directory when None.
+        """
+        super().__init__(
+            num_bands,
+            rows_per_band,
+            num_hashes,
+            shingle_size,
+            minhash_method,
+            max_bucket_size,
+            heavy_bucket_policy,
+            removable,
+        )
+        self.external = None
+        if memory_budget is not None:
+            self.external = ExternalBandGrouper(memory_budget, spill_dir)
+        # Spilled records cannot be rewritten, so a document added again after its removal
+        # is spilled under a fresh (negative) record ID while the old one stays tombstoned.
+        self.record_ids = {}
+        self.record_docs = {}
+
+    def add_features(self, doc_id: int, features: DocumentFeatures):
+        """
+        Adds a document with precomputed features to the buckets or spill runs.
+
+        Parameters:
+        - doc_id: Unique identifier for the document.
+        - features: Signature and band hashes of the document.
+        """
+        if self.external is None:
+            super().add_features(doc_id, features)
+            return
+        self.keep_signature(doc_id, features.signature)
+        if self.removable:
+            self.doc_bands[doc_id]
+        record_id = self.record_id(doc_id)
+        if record_id in self.tombstones:
+            record_id = -1 - len(self.record_docs)
+            self.record_ids[doc_id] = record_id
+            self.record_docs[record_id] = doc_id
+        for band_hash in features.band_hashes:
+            self.external.add(band_hash, record_id)
+
+    def record_id(self, doc_id: int) -> int:
+        """Returns the ID a document's current band records are spilled under."""
+        return self.record_ids.get(doc_id, doc_id)
+
+    def add_documents_two_pass(
+        self,
+        doc_ids: List[int],
+        documents: List[str],
+        false_positive_rate: float = 0.01,
+        batch_size: int = 1024,
+    ) -> Dict[str, int]:
+        """
+        Adds documents in two passes, storing only band keys shared by two or more documents.
+
+        A bucket holding a single document never yields a candidate pair, yet such buckets
+        are most of the band tables. The first pass records every band key in a blocked
+        Bloom filter and the keys it has already seen in a second one; the second pass
+        adds only the bands whose key is in the second filter. Filters have no false
+        negatives, so every shared bucket is kept and the clusters are unchanged; a false
+        positive only keeps a useless singleton bucket. Both filters take about two bytes
+        per band record, instead of a bucket entry per record. Features bypass the feature
+        store, so no signature outlives its batch: documents are minhashed in both passes
+        (the signature cache, if set, serves the second).
+
+        Parameters:
+        - doc_ids: Unique identifiers of the documents.
+        - documents: Documents as strings; read twice.
+        - false_positive_rate: False positive rate of the key filters.
+        - batch_size: Documents whose band keys are checked per filter batch.
+
+        Returns:
+        - The number of band records seen and of those stored.
+        """
+
+        def batches():
+            for start in range(0, len(documents), batch_size):
+                yield [
+                    (doc_id, self.compute_features(doc, fingerprint(doc)))
+                    for doc_id, doc in zip(
+                        doc_ids[start : start + batch_size],
+                        documents[start : start + batch_size],
+                    )
+                ]
+
+        capacity = max(1, len(documents) * self.num_bands)
+        seen = BlockedBloomFilter(capacity, false_positive_rate)
+        repeated = BlockedBloomFilter(max(1, capacity // 2), false_positive_rate)
+        for batch in batches():
+            keys = [
+                f"{band_hash:x}" for _, features in batch for band_hash in features.band_hashes
+            ]
+            flags = seen.add_batch(keys)
+            repeated.add_batch([key for key, flag in zip(keys, flags) if flag])
+
+        stats = {"band_records": 0, "stored_records": 0}
+        for batch in batches():
+            keys = [
+                f"{band_hash:x}" for _, features in batch for band_hash in features.band_hashes
+            ]
+            shared = iter(repeated.contains_batch(keys).tolist())
+            for doc_id, features in batch:
+                self.keep_signature(doc_id, features.signature)
+                if self.removable:
+                    self.doc_bands[doc_id]
+                for band, band_hash in enumerate(features.band_hashes):
+                    stats["band_records"] += 1
+                    if not next(shared):
+                        continue
+                    stats["stored_records"] += 1
+                    if self.external is None:
+                        self.insert_band(band, band_hash, doc_id, features.signature)
+                    else:
+                        self.external.add(band_hash, self.record_id(doc_id))
+        logging.info(
+            f"Two-pass indexing stored {stats['stored_records']} of {stats['band_records']} band records."
+        )
+        return stats
+
+    def compact(self):
+        """Compacts in-memory buckets; spilled runs keep their tombstones, which clustering skips."""
+        if self.external is None:
+            super().compact()
 
     def cluster_candidates(self) -> dict:
         """
         Clusters documents based on candidate pairs using Union-Find.
 
+        Out of core, buckets are streamed from the merged run files and each bucket's
+        members are unioned directly, which yields the same clusters.
+
         Returns:
         - A dictionary where each key is a root document ID, and the value is a list of document IDs in that cluster.
         """
-        candidate_pairs = self.find_candidates()
-        for doc1, doc2 in candidate_pairs:
-            self.uf.add(doc1)
-            self.uf.add(doc2)
-            self.uf.union(doc1, doc2)
+        if self.external is not None:
+            self.uf = UnionFind()  # Every run is streamed again, so rebuild from scratch
+            for bucket_docs in self.external.iter_buckets():
+                bucket_docs = [
+                    self.record_docs.get(record_id, record_id)
+                    for record_id in self.live(bucket_docs)
+                ]
+                if len(bucket_docs) < 2:
+                    continue
+                for doc_id in bucket_docs:
+                    self.uf.add(doc_id)
+                for doc1, doc2 in zip(bucket_docs, bucket_docs[1:]):
+                    self.uf.union(doc1, doc2)
+        else:
+            self.compact()
+            candidate_pairs = self.find_candidates()
+            for doc1, doc2 in candidate_pairs:
+                self.uf.add(doc1)
+                self.uf.add(doc2)
+                self.uf.union(doc1, doc2)
 
         clusters = defaultdict(list)
         for doc_id in self.uf.parent:
@@ -226,8 +915,23 @@ class LSH(LSHBase):
         return clusters
 
 
-class LSHImproved:
-    """Improved LSH with multi-probe support and Union-Find for clustering."""
+class LSHImproved(LSHBase):
+    """
+    Improved LSH with query-directed multi-probe support and Union-Find for clustering.
+
+    Each band is inserted once. At query and clustering time every document also probes
+    perturbed band signatures: one row of a band is replaced by the document's
+    runner-up minhash value for that row, i.e. the value a near neighbour would hold if
+    it lacks the shingle that produced the minimum. Such a probe succeeds only if the
+    neighbour has no other shingle hashing between the minimum and the runner-up, so
+    perturbations are ranked by that gap (smallest first) and the best
+    `probes * num_bands` of them are probed.
+
+    Clustering needs every document's probe sequence, so the index keeps it packed at
+    16 bytes per probe: `16 * probes * num_bands` bytes per document on top of the band
+    tables (about a sixth more than `LSH` with one probe, a third more with three, for
+    10 bands).
+    """
 
     def __init__(
         self,
@@ -236,21 +940,24 @@ class LSHImproved:
         num_hashes: int,
         shingle_size: int = 5,
         probes: int = 1,
+        minhash_method: str = "classic",
+        max_bucket_size: Optional[int] = None,
+        heavy_bucket_policy: str = "cap",
+        removable: bool = False,
     ):
-        self.num_bands = num_bands
-        self.rows_per_band = rows_per_band
-        self.num_hashes = num_hashes
-        self.shingle_size = shingle_size
+        super().__init__(
+            num_bands,
+            rows_per_band,
+            num_hashes,
+            shingle_size,
+            minhash_method,
+            max_bucket_size,
+            heavy_bucket_policy,
+            removable,
+        )
         self.probes = probes
-        self.buckets = defaultdict(list)
-        self.uf = UnionFind()
-
-    def shingle_document(self, doc: str) -> Set[str]:
-        """Generates shingles (substrings) of fixed size from the document."""
-        return {
-            doc[i : i + self.shingle_size]
-            for i in range(len(doc) - self.shingle_size + 1)
-        }
+        self.probe_keys = {}
+        self.probers = defaultdict(set)
 
     def calculate_probability(self, similarity: float) -> float:
         """Calculate the probability of two items being in the same bucket at least once based on similarity."""
@@ -258,52 +965,163 @@ class LSHImproved:
         b = self.num_bands
         return 1 - (1 - similarity**r) ** b
 
-    def minhash(self, shingles: Set[str]) -> List[int]:
-        """Generates a minhash signature from the set of shingles."""
-        signature = []
+    def minhash_with_runner_up(
+        self, shingles: Set[str]
+    ) -> Tuple[List[int], List[int]]:
+        """Generates a minhash signature together with the second-smallest hash value of every row."""
+        inf = float("inf")
+        if self.minhash_method == "oph":
+            first, second = [inf] * self.num_hashes, [inf] * self.num_hashes
+            for shingle in shingles:
+                hash_value = int(hashlib.md5(shingle.encode()).hexdigest(), 16)
+                value, bin_index = divmod(hash_value, self.num_hashes)
+                if value < first[bin_index]:
+                    first[bin_index], second[bin_index] = value, first[bin_index]
+                elif value < second[bin_index]:
+                    second[bin_index] = value
+            if not shingles:
+                return first, second
+            sources = self.densification_sources(first)
+            return [first[s] for s in sources], [second[s] for s in sources]
+
+        signature, runner_up = [], []
         for i in range(self.num_hashes):
-            min_hash = float("inf")
+            min_hash = second_hash = inf
             for shingle in shingles:
                 hash_value = int(
                     hashlib.md5((str(i) + shingle).encode()).hexdigest(), 16
                 )
-                min_hash = min(min_hash, hash_value)
+                if hash_value < min_hash:
+                    min_hash, second_hash = hash_value, min_hash
+                elif hash_value < second_hash:
+                    second_hash = hash_value
             signature.append(min_hash)
-        return signature
+            runner_up.append(second_hash)
+        return signature, runner_up
 
     def multi_probe_banding(self, signature: List[int]) -> List[int]:
-        """Divides the minhash signature into bands and hashes each band with multi-probe support."""
-        band_hashes = []
+        """Divides the minhash signature into bands and hashes each band once; probing happens at query time."""
+        return self.banding(signature)
+
+    def probe_band_hashes(
+        self, signature: List[int], runner_up: List[int]
+    ) -> List[int]:
+        """Returns perturbed band hashes ordered by how likely they are to hit a near neighbour."""
+        perturbations = []
         for band in range(self.num_bands):
-            band_signature = signature[
-                band * self.rows_per_band : (band + 1) * self.rows_per_band
-            ]
-            base_band_hash = int(
-                hashlib.md5(str(band_signature).encode()).hexdigest(), 16
-            )
-            band_hashes.append(base_band_hash)
-            for probe in range(1, self.probes + 1):
-                band_hashes.extend([base_band_hash + probe, base_band_hash - probe])
-        return band_hashes
+            start = band * self.rows_per_band
+            band_signature = signature[start : start + self.rows_per_band]
+            for offset, row in enumerate(range(start, start + len(band_signature))):
+                if runner_up[row] == float("inf"):
+                    continue
+                gap = runner_up[row] - signature[row]
+                perturbed = list(band_signature)
+                perturbed[offset] = runner_up[row]
+                perturbations.append((gap, band, offset, perturbed))
+        perturbations.sort(key=lambda perturbation: perturbation[:3])
+        return [
+            int(hashlib.md5(str(perturbed).encode()).hexdigest(), 16)
+            for _, _, _, perturbed in perturbations[: self.probes * self.num_bands]
+        ]
 
-    def add_document(self, doc_id: int, doc: str):
+    def document_signature_with_runner_up(
+        self, doc: str
+    ) -> Tuple[List[int], List[int]]:
+        """Generates a document's signature and runner-up values, consulting the signature cache if one is set."""
+        if self.signature_cache is None:
+            return self.minhash_with_runner_up(self.shingle_document(doc))
+
+        def compute():
+            shingles = self.shingle_document(doc)
+            signature, runner_up = self.minhash_with_runner_up(shingles)
+            return signature + runner_up
+
+        values = self.signature_cache.fetch(
+            doc, dict(self.signature_params(), runner_up=True), compute
+        )
+        return values[: self.num_hashes], values[self.num_hashes :]
+
+    def signature_features(
+        self,
+        key: Optional[bytes],
+        signature: List[int],
+        runner_up: Optional[List[int]] = None,
+    ) -> DocumentFeatures:
+        """Bands a signature and ranks its probes once, for indexing and clustering."""
+        probe_hashes = None
+        if runner_up is not None and self.probes > 0:
+            probe_hashes = self.probe_band_hashes(signature, runner_up)
+        return DocumentFeatures(
+            key, signature, self.multi_probe_banding(signature), runner_up, probe_hashes
+        )
+
+    def compute_features(self, doc: str, key: bytes) -> DocumentFeatures:
+        """Shingles and minhashes a document, then bands it and ranks its probes."""
+        signature, runner_up = self.document_signature_with_runner_up(doc)
+        return self.signature_features(key, signature, runner_up)
+
+    def add_signature(
+        self, doc_id: int, signature: List[int], runner_up: Optional[List[int]] = None
+    ):
         """Adds a document to the Improved LSH by hashing its signature bands and storing them in buckets."""
-        shingles = self.shingle_document(doc)
-        signature = self.minhash(shingles)
-        for band_hash in self.multi_probe_banding(signature):
-            self.buckets[band_hash].append(doc_id)
+        self.add_features(doc_id, self.signature_features(None, signature, runner_up))
+
+    def add_features(self, doc_id: int, features: DocumentFeatures):
+        """Adds a document's bands to the buckets and remembers its probe sequence for clustering."""
+        super().add_features(doc_id, features)
+        if features.probe_hashes is not None:
+            # Packed, a probe sequence takes 16 bytes per probe instead of a boxed int
+            self.probe_keys[doc_id] = pack_keys(features.probe_hashes)
+            if self.removable:  # Only compaction needs to find a bucket's probers
+                for probe_hash in features.probe_hashes:
+                    self.probers[probe_hash].add(doc_id)
+
+    def forget_document(self, doc_id: int):
+        """Drops a removed document's buckets and probe sequence."""
+        super().forget_document(doc_id)
+        for probe_hash in unpack_keys(self.probe_keys.pop(doc_id, b"")):
+            probers = self.probers[probe_hash]
+            probers.discard(doc_id)
+            if not probers:
+                del self.probers[probe_hash]
+
+    def neighbors(self, doc_id: int) -> Set[int]:
+        """Returns the documents sharing a bucket with a document or probing into one of its buckets."""
+        found = super().neighbors(doc_id)
+        for probe_hash in unpack_keys(self.probe_keys.get(doc_id, b"")):
+            found.update(self.buckets.get(probe_hash, ()))
+        for key in self.doc_bands.get(doc_id, ()):
+            if doc_id in self.buckets.get(key, ()):
+                found.update(self.probers.get(key, ()))
+        found.discard(doc_id)
+        return found
+
+    def query(self, doc: str) -> List[int]:
+        """Finds indexed documents sharing a bucket with the query's bands or its probes."""
+        signature, runner_up = self.minhash_with_runner_up(self.shingle_document(doc))
+        candidates = set(self.query_signature(signature))
+        if self.probes > 0:
+            for probe_hash in self.probe_band_hashes(signature, runner_up):
+                candidates.update(self.live(self.buckets.get(probe_hash, ())))
+        return sorted(candidates)
 
     def find_candidates(self) -> List[Tuple[int, int]]:
-        """Finds candidate pairs of documents that are likely to be similar."""
-        candidate_pairs = set()
-        for bucket_docs in self.buckets.values():
-            for i in range(len(bucket_docs)):
-                for j in range(i + 1, len(bucket_docs)):
-                    candidate_pairs.add((bucket_docs[i], bucket_docs[j]))
+        """Finds candidate pairs from shared buckets and from every document's probe sequence."""
+        candidate_pairs = set(super().find_candidates())
+        for doc_id, probe_hashes in self.probe_keys.items():
+            if doc_id in self.tombstones:
+                continue
+            for probe_hash in unpack_keys(probe_hashes):
+                for other_id in self.live(self.buckets.get(probe_hash, ())):
+                    if other_id != doc_id:
+                        candidate_pairs.add(
+                            (min(doc_id, other_id), max(doc_id, other_id))
+                        )
         return list(candidate_pairs)
 
     def cluster_candidates(self) -> Dict[int, List[int]]:
         """Clusters documents based on candidate pairs using Union-Find."""
+        self.compact()
         candidate_pairs = self.find_candidates()
         for doc1, doc2 in candidate_pairs:
             self.uf.add(doc1)
@@ -0,0 +1,365 @@
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from near_dedup.lsh.external import LOW_WORD, RECORD_DTYPE, SORT_ORDER, group_buckets
+from near_dedup.lsh.lsh import LSHBase, UnionFind
+
+MANIFEST = "manifest.json"
+SEGMENT_PREFIX = "segment-"
+
+
+class SegmentedIndex:
+    """
+    LSH index made of immutable, sorted, memory-mapped segments.
+
+    Every ingest batch becomes one segment: its (band_key, doc_id) records, sorted by
+    key and written once as a `.npy` file that is memory-mapped for reading. Queries binary
+    search each segment and merge the results; clustering k-way merges the segments like
+    the runs of an `ExternalBandGrouper`. Compaction merges segments of similar size
+    (size-tiered: `min_merge` segments of one tier become one segment of the next), so
+    the number of segments stays logarithmic in the index size. Clusters are identified
+    by their smallest document ID, which does not depend on how records are split into
+    segments.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        num_bands: int,
+        rows_per_band: int,
+        num_hashes: int,
+        shingle_size: int = 5,
+        minhash_method: str = "classic",
+        min_merge: int = 4,
+        background_compaction: bool = False,
+        block_records: int = 1 << 16,
+    ):
+        """
+        Open (or create) a segmented index in a directory.
+
+        Parameters:
+            directory (str): Directory holding the manifest and segment files.
+            num_bands (int): Number of bands.
+            rows_per_band (int): Number of rows per band.
+            num_hashes (int): Number of hash functions.
+            shingle_size (int): Size of shingles (n-grams).
+            minhash_method (str): 'classic' or 'oph'.
+            min_merge (int): Number of same-tier segments merged by compaction.
+            background_compaction (bool): If True, every ingest starts compaction in a
+                background thread when none is running.
+            block_records (int): Records read per segment and written per block when merging.
+        """
+        if min_merge < 2:
+            raise ValueError("min_merge must be at least 2.")
+        self.directory = directory
+        self.min_merge = min_merge
+        self.background_compaction = background_compaction
+        self.block_records = block_records
+        self.signer = LSHBase(
+            num_bands, rows_per_band, num_hashes, shingle_size, minhash_method
+        )
+        self.signer.features.max_entries = 0  # Appends and queries are unbounded streams
+        self.params = {
+            "num_bands": num_bands,
+            "rows_per_band": rows_per_band,
+            "num_hashes": num_hashes,
+            "shingle_size": shingle_size,
+            "minhash_method": minhash_method,
+        }
+        self.lock = threading.Lock()
+        self.compaction_thread: Optional[threading.Thread] = None
+        self.merging = set()  # Segments reserved by a running merge
+        self.segments: List[dict] = []
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.next_segment = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST)
+
+    def __len__(self) -> int:
+        """Number of indexed documents."""
+        return sum(segment["documents"] for segment in self.segments)
+
+    @property
+    def num_records(self) -> int:
+        return sum(segment["records"] for segment in self.segments)
+
+    def load(self):
+        """Load the manifest and memory-map its segments."""
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as file:
+            manifest = json.load(file)
+        if manifest["params"] != self.params:
+            raise ValueError(
+                f"Index in {self.directory} was written with different parameters: {manifest['params']}"
+            )
+        self.segments = manifest["segments"]
+        self.next_segment = manifest["next_segment"]
+        self.arrays = {
+            segment["file"]: self.open_segment(segment["file"])
+            for segment in self.segments
+        }
+
+    def write_manifest(self):
+        """Atomically replace the manifest with the current segment list."""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(
+                {
+                    "params": self.params,
+                    "segments": self.segments,
+                    "next_segment": self.next_segment,
+                },
+                file,
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def open_segment(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.directory, name), mmap_mode="r")
+
+    def new_segment_name(self) -> str:
+        with self.lock:
+            name = f"{SEGMENT_PREFIX}{self.next_segment:06d}.npy"
+            self.next_segment += 1
+        return name
+
+    def add_batch(self, doc_ids: List[int], documents: List[str]) -> Optional[str]:
+        """
+        Index a batch of documents as one new segment.
+
+        Parameters:
+            doc_ids (List[int]): Identifiers of the documents, unique across the index.
+            documents (List[str]): Document texts.
+
+        Returns:
+            str: Name of the new segment, or None for an empty batch.
+        """
+        records = []
+        for doc_id, doc in zip(doc_ids, documents):
+            for band_hash in self.signer.document_features(doc).band_hashes:
+                records.append((band_hash >> 64, band_hash & LOW_WORD, doc_id))
+        if not records:
+            return None
+        run = np.sort(np.array(records, dtype=RECORD_DTYPE), order=SORT_ORDER)
+        name = self.new_segment_name()
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        with open(tmp_path, "wb") as file:
+            np.save(file, run)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        segment = {"file": name, "records": len(run), "documents": len(set(doc_ids))}
+        with self.lock:
+            self.segments.append(segment)
+            self.arrays[name] = self.open_segment(name)
+            self.write_manifest()
+        logging.info(f"Wrote segment {name} with {len(doc_ids)} documents.")
+        if self.background_compaction:
+            self.compact(background=True)
+        return name
+
+    def query(self, doc: str) -> List[int]:
+        """
+        Find the indexed documents sharing a band bucket with a document, across all segments.
+
+        Parameters:
+            doc (str): Query document.
+
+        Returns:
+            List[int]: Sorted candidate document IDs.
+        """
+        with self.lock:
+            arrays = list(self.arrays.values())
+        candidates = set()
+        for band_hash in self.signer.document_features(doc).band_hashes:
+            key_hi = np.uint64(band_hash >> 64)
+            key_lo = np.uint64(band_hash & LOW_WORD)
+            for array in arrays:
+                hi = array["key_hi"]
+                start = np.searchsorted(hi, key_hi, side="left")
+                end = np.searchsorted(hi, key_hi, side="right")
+                lo = array["key_lo"][start:end]
+                left = start + np.searchsorted(lo, key_lo, side="left")
+                right = start + np.searchsorted(lo, key_lo, side="right")
+                candidates.update(array["doc_id"][left:right].tolist())
+        return sorted(candidates)
+
+    def iter_blocks(self, array: np.ndarray) -> Iterator[tuple]:
+        """Stream the records of a segment in blocks of `block_records`."""
+        for start in range(0, len(array), self.block_records):
+            yield from array[start : start + self.block_records].tolist()
+
+    def iter_buckets(
+        self, arrays: Optional[List[np.ndarray]] = None
+    ) -> Iterator[List[int]]:
+        """
+        Yield the document IDs of every band bucket, merged across segments.
+
+        Parameters:
+            arrays (List[np.ndarray]): Segments to merge; all segments when None.
+
+        Returns:
+            Iterator[List[int]]: Sorted document IDs sharing a band key.
+        """
+        if arrays is None:
+            with self.lock:
+                arrays = list(self.arrays.values())
+        records = heapq.merge(*(self.iter_blocks(array) for array in arrays))
+        return group_buckets(records)
+
+    def cluster_candidates(self) -> Dict[int, List[int]]:
+        """
+        Clusters documents that share a bucket in any segment.
+
+        Returns:
+            Dict[int, List[int]]: Sorted members of every cluster, keyed by its smallest
+                document ID.
+        """
+        uf = UnionFind()
+        for bucket_docs in self.iter_buckets():
+            for doc_id in bucket_docs:
+                uf.add(doc_id)
+            for doc1, doc2 in zip(bucket_docs, bucket_docs[1:]):
+                uf.union(doc1, doc2)
+        groups = defaultdict(list)
+        for doc_id in uf.parent:
+            groups[uf.find(doc_id)].append(doc_id)
+        clusters = {}
+        for members in groups.values():
+            if len(members) > 1:
+                members.sort()
+                clusters[members[0]] = members
+        return clusters
+
+    def tier(self, segment: dict) -> int:
+        """Size tier of a segment: segments within a factor of `min_merge` share a tier."""
+        return int(math.log(max(segment["records"], 1), self.min_merge))
+
+    def compaction_plan(self) -> Optional[List[dict]]:
+        """
+        Pick the segments to merge next: the `min_merge` smallest segments of the
+        smallest tier holding at least `min_merge` segments that no other merge has
+        reserved. The chosen segments are reserved until `release` is called, so
+        concurrent compactions never merge a segment twice.
+
+        Returns:
+            List[dict]: Segments to merge, or None when no tier is full.
+        """
+        with self.lock:
+            tiers = defaultdict(list)
+            for segment in self.segments:
+                if segment["file"] not in self.merging:
+                    tiers[self.tier(segment)].append(segment)
+            for tier in sorted(tiers):
+                if len(tiers[tier]) >= self.min_merge:
+                    members = sorted(tiers[tier], key=lambda segment: segment["records"])
+                    plan = members[: self.min_merge]
+                    self.merging.update(segment["file"] for segment in plan)
+                    return plan
+        return None
+
+    def release(self, segments: List[dict]):
+        """Drop the merge reservation of segments."""
+        with self.lock:
+            self.merging.difference_update(segment["file"] for segment in segments)
+
+    def merge(self, segments: List[dict]) -> dict:
+        """
+        Merge segments into one new segment and swap it into the index.
+
+        Readers holding the old memory maps keep working; the old files are deleted
+        once the manifest no longer lists them.
+
+        Parameters:
+            segments (List[dict]): Manifest entries of the segments to merge.
+
+        Returns:
+            dict: Manifest entry of the merged segment.
+        """
+        with self.lock:
+            arrays = [self.arrays[segment["file"]] for segment in segments]
+        total = sum(len(array) for array in arrays)
+        name = self.new_segment_name()
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        merged = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=RECORD_DTYPE, shape=(total,)
+        )
+        records = heapq.merge(*(self.iter_blocks(array) for array in arrays))
+        position, block = 0, []
+        for record in records:
+            block.append(record)
+            if len(block) == self.block_records:
+                merged[position : position + len(block)] = block
+                position, block = position + len(block), []
+        merged[position : position + len(block)] = block
+        merged.flush()
+        del merged
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        merged_segment = {
+            "file": name,
+            "records": total,
+            "documents": sum(segment["documents"] for segment in segments),
+        }
+        with self.lock:
+            for segment in segments:
+                self.segments.remove(segment)
+                del self.arrays[segment["file"]]
+            self.segments.append(merged_segment)
+            self.arrays[name] = self.open_segment(name)
+            self.write_manifest()
+        for segment in segments:
+            os.remove(os.path.join(self.directory, segment["file"]))
+        logging.info(f"Merged {len(segments)} segments ({total} records) into {name}.")
+        return merged_segment
+
+    def run_compaction(self):
+        """Merge segments until no size tier holds `min_merge` segments."""
+        plan = self.compaction_plan()
+        while plan is not None:
+            try:
+                self.merge(plan)
+            finally:
+                self.release(plan)
+            plan = self.compaction_plan()
+
+    def compact(self, background: bool = False) -> Optional[threading.Thread]:
+        """
+        Run size-tiered compaction.
+
+        Parameters:
+            background (bool): If True, compact in a daemon thread (unless one is already
+                running) and return it; ingest and queries continue meanwhile.
+
+        Returns:
+            threading.Thread: The compaction thread, when compacting in the background.
+        """
+        if not background:
+            self.run_compaction()
+            return None
+        with self.lock:
+            if self.compaction_thread is None or not self.compaction_thread.is_alive():
+                self.compaction_thread = threading.Thread(
+                    target=self.run_compaction, daemon=True
+                )
+                self.compaction_thread.start()
+            return self.compaction_thread
+
+    def wait(self):
+        """Wait for a running background compaction to finish."""
+        thread = self.compaction_thread
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,273 @@
+import hashlib
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from near_dedup.lsh.lsh import UnionFind
+
+# Number of set bits for every possible byte value, used to popcount uint64 arrays.
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+FINGERPRINT_BITS = 64
+
+
+def hamming_distance(fingerprints: np.ndarray, fingerprint: int) -> np.ndarray:
+    """
+    Computes the Hamming distance between an array of fingerprints and a single fingerprint.
+
+    Parameters:
+    - fingerprints: NumPy uint64 array of fingerprints.
+    - fingerprint: Fingerprint to compare against.
+
+    Returns:
+    - NumPy array with the number of differing bits for each fingerprint.
+    """
+    diff = np.bitwise_xor(
+        np.asarray(fingerprints, dtype=np.uint64), np.uint64(fingerprint)
+    )
+    diff = np.ascontiguousarray(diff.astype("<u8"))
+    return POPCOUNT_TABLE[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def rotate_left(values: np.ndarray, shift: int) -> np.ndarray:
+    """
+    Rotates 64-bit values to the left by `shift` bits.
+
+    Parameters:
+    - values: NumPy uint64 array (or scalar) to rotate.
+    - shift: Number of bits to rotate by.
+
+    Returns:
+    - Rotated values as uint64.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    shift %= FINGERPRINT_BITS
+    if shift == 0:
+        return values
+    return (values << np.uint64(shift)) | (
+        values >> np.uint64(FINGERPRINT_BITS - shift)
+    )
+
+
+class SimHashIndex:
+    """
+    SimHash index for finding near-duplicate documents by Hamming distance.
+
+    Each document is reduced to a 64-bit SimHash fingerprint. Near matches within
+    `max_distance` bits are found with Manku-style permutation tables: the fingerprint
+    is split into `num_blocks` bit blocks and, for every block, a table stores the
+    fingerprints rotated so that block forms the leading bits. Two fingerprints that
+    differ in at most `num_blocks - 1` bits agree exactly on at least one block, so a
+    binary search on that block's leading bits finds every candidate.
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 3,
+        shingle_size: int = 5,
+        num_blocks: Optional[int] = None,
+    ):
+        """
+        Initializes the SimHash index with the specified parameters.
+
+        Parameters:
+        - max_distance: Maximum Hamming distance for two documents to be near-duplicates.
+        - shingle_size: Size of each shingle (substring) used as a SimHash feature.
+        - num_blocks: Number of bit blocks (and permutation tables). Must exceed `max_distance`;
+          defaults to `max_distance + 1`.
+        """
+        if num_blocks is None:
+            num_blocks = max_distance + 1
+        if num_blocks <= max_distance:
+            raise ValueError("num_blocks must be greater than max_distance.")
+        if num_blocks > FINGERPRINT_BITS:
+            raise ValueError(f"num_blocks cannot exceed {FINGERPRINT_BITS}.")
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.num_blocks = num_blocks
+        self.block_bounds = self.split_bits(num_blocks)
+        self.fingerprints = np.zeros(0, dtype=np.uint64)
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.size = 0
+        self.uf = UnionFind()
+        self.tables = None
+        logging.info(
+            f"Initialized SimHash with {num_blocks} permutation tables, max Hamming distance {max_distance}."
+        )
+
+    @staticmethod
+    def split_bits(num_blocks: int) -> List[Tuple[int, int]]:
+        """Splits the 64 fingerprint bits into `num_blocks` contiguous (low, high) bit ranges."""
+        base, extra = divmod(FINGERPRINT_BITS, num_blocks)
+        bounds = []
+        low = 0
+        for block in range(num_blocks):
+            high = low + base + (1 if block < extra else 0)
+            bounds.append((low, high))
+            low = high
+        return bounds
+
+    def simhash(self, doc: str) -> int:
+        """
+        Computes the 64-bit SimHash fingerprint of a document.
+
+        Every shingle is hashed once to 64 bits; each bit position accumulates +weight
+        when the bit is set and -weight otherwise, where the weight is the number of
+        occurrences of the shingle. The fingerprint keeps the sign of each position.
+
+        Parameters:
+        - doc: Document as a string.
+
+        Returns:
+        - The fingerprint as a Python integer.
+        """
+        counts = Counter(
+            doc[i : i + self.shingle_size]
+            for i in range(len(doc) - self.shingle_size + 1)
+        )
+        if not counts:
+            return 0
+        hashes = np.array(
+            [
+                int.from_bytes(hashlib.md5(shingle.encode()).digest()[:8], "little")
+                for shingle in counts
+            ],
+            dtype="<u8",
+        )
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        bits = np.unpackbits(
+            hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little"
+        )
+        votes = weights @ (2.0 * bits - 1.0)
+        packed = np.packbits(votes > 0, bitorder="little")
+        return int(packed.view("<u8")[0])
+
+    def add_fingerprint(self, doc_id: int, fingerprint: int):
+        """
+        Adds a precomputed fingerprint to the index.
+
+        Parameters:
+        - doc_id: Unique identifier for the document.
+        - fingerprint: 64-bit SimHash fingerprint of the document.
+        """
+        if self.size == len(self.fingerprints):
+            capacity = max(16, 2 * self.size)
+            self.fingerprints = np.resize(self.fingerprints, capacity)
+            self.doc_ids = np.resize(self.doc_ids, capacity)
+        self.fingerprints[self.size] = fingerprint
+        self.doc_ids[self.size] = doc_id
+        self.size += 1
+        self.tables = None
+
+    def add_document(self, doc_id: int, doc: str):
+        """
+        Adds a document to the index by computing and storing its fingerprint.
+
+        Parameters:
+        - doc_id: Unique identifier for the document.
+        - doc: Document as a string.
+        """
+        self.add_fingerprint(doc_id, self.simhash(doc))
+
+    def build_tables(self) -> List[Tuple[np.ndarray, np.ndarray, np.uint64, int]]:
+        """
+        Builds one sorted permutation table per bit block.
+
+        Returns:
+        - A list of (sorted permuted fingerprints, row order, prefix mask, rotation) tuples.
+        """
+        if self.tables is not None:
+            return self.tables
+        fingerprints = self.fingerprints[: self.size]
+        tables = []
+        for low, high in self.block_bounds:
+            rotation = FINGERPRINT_BITS - high
+            width = high - low
+            mask = np.uint64(((1 << width) - 1) << (FINGERPRINT_BITS - width))
+            permuted = rotate_left(fingerprints, rotation)
+            order = np.argsort(permuted, kind="stable")
+            tables.append((permuted[order], order, mask, rotation))
+        self.tables = tables
+        return tables
+
+    def query_fingerprint(self, fingerprint: int) -> List[int]:
+        """
+        Finds indexed documents within `max_distance` bits of a fingerprint.
+
+        Parameters:
+        - fingerprint: 64-bit SimHash fingerprint to search for.
+
+        Returns:
+        - A sorted list of matching document IDs.
+        """
+        if self.size == 0:
+            return []
+        rows = set()
+        for permuted, order, mask, rotation in self.build_tables():
+            prefix = rotate_left(np.uint64(fingerprint), rotation) & mask
+            left = np.searchsorted(permuted, prefix, side="left")
+            right = np.searchsorted(permuted, prefix | ~mask, side="right")
+            rows.update(order[left:right].tolist())
+        if not rows:
+            return []
+        rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        distances = hamming_distance(self.fingerprints[rows], fingerprint)
+        return sorted(self.doc_ids[rows[distances <= self.max_distance]].tolist())
+
+    def query(self, doc: str) -> List[int]:
+        """
+        Finds indexed documents within `max_distance` bits of a query document.
+
+        Parameters:
+        - doc: Query document as a string.
+
+        Returns:
+        - A sorted list of matching document IDs.
+        """
+        return self.query_fingerprint(self.simhash(doc))
+
+    def find_candidates(self) -> List[Tuple[int, int]]:
+        """
+        Finds pairs of indexed documents within `max_distance` bits of each other.
+
+        Returns:
+        - A list of tuples, where each tuple contains two document IDs that are candidate pairs.
+        """
+        candidate_pairs = set()
+        fingerprints = self.fingerprints[: self.size]
+        for permuted, order, mask, _ in self.build_tables():
+            prefixes = permuted & mask
+            run_starts = np.flatnonzero(np.diff(prefixes)) + 1
+            for run in np.split(order, run_starts):
+                for i in range(len(run) - 1):
+                    others = run[i + 1 :]
+                    distances = hamming_distance(
+                        fingerprints[others], fingerprints[run[i]]
+                    )
+                    doc_id = int(self.doc_ids[run[i]])
+                    for other in others[distances <= self.max_distance]:
+                        other_id = int(self.doc_ids[other])
+                        candidate_pairs.add(
+                            (min(doc_id, other_id), max(doc_id, other_id))
+                        )
+        return list(candidate_pairs)
+
+    def cluster_candidates(self) -> Dict[int, List[int]]:
+        """
+        Clusters documents based on candidate pairs using Union-Find.
+
+        Returns:
+        - A dictionary where each key is a root document ID, and the value is a list of document IDs in that cluster.
+        """
+        for doc1, doc2 in self.find_candidates():
+            self.uf.add(doc1)
+            self.uf.add(doc2)
+            self.uf.union(doc1, doc2)
+
+        clusters = defaultdict(list)
+        for doc_id in self.uf.parent:
+            root = self.uf.find(doc_id)
+            clusters[root].append(doc_id)
+        return clusters
@@ -0,0 +1,210 @@
+import logging
+import math
+from typing import Dict, Optional
+
+from near_dedup.features.features import DEFAULT_MAX_ENTRIES
+
+# Approximate CPython (64-bit) sizes used by the estimates.
+LIST_BYTES = 56
+POINTER_BYTES = 8
+HASH_INT_BYTES = 44  # A 128-bit MD5-derived int
+STR_BYTES = 49
+# One (band key, doc_id) entry of the in-memory band tables: dict slot, key, list slot
+# and the per-document bucket list kept for removals.
+BAND_RECORD_BYTES = 160
+# Per-document overhead of a SignatureStore (row index, doc_id list) and of clustering.
+STORE_DOC_BYTES = 100
+CLUSTER_DOC_BYTES = 120
+# Per-document feature cache entry besides the signature: the entry, its fingerprint
+# and the band hash list.
+FEATURE_ENTRY_BYTES = 300
+SPILL_BUFFER_BYTES = 64 * 1024 * 1024
+MIN_SPILL_BUFFER_BYTES = 64 * 1024
+# Peak of out-of-core grouping per byte of its budget: merged run blocks are read back
+# as Python tuples, which take several times their packed size.
+SPILL_PEAK_FACTOR = 4
+RELAXED_FALSE_POSITIVE_RATE = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def bloom_filter_bytes(num_elements: int, false_positive_rate: float) -> int:
+    """Bytes of a Bloom filter sized for `num_elements` at `false_positive_rate`."""
+    bits = -max(num_elements, 1) * math.log(false_positive_rate) / (math.log(2) ** 2)
+    return int(bits / 8) + 1
+
+
+def signature_bytes(num_hashes: int, bits: Optional[int]) -> int:
+    """Bytes per stored signature: full-width lists, or a SignatureStore row of `bits`."""
+    if bits is None:
+        return LIST_BYTES + num_hashes * (HASH_INT_BYTES + POINTER_BYTES)
+    # A growing SignatureStore briefly holds the old and the resized array.
+    return 2 * math.ceil(num_hashes * bits / 8) + STORE_DOC_BYTES
+
+
+def estimate_footprint(
+    num_documents: int,
+    text_bytes: int,
+    num_hashes: int,
+    num_bands: int,
+    signature_bits: Optional[int] = None,
+    feature_entries: Optional[int] = DEFAULT_MAX_ENTRIES,
+    spill_bytes: Optional[int] = None,
+    false_positive_rate: float = 0.01,
+) -> Dict[str, int]:
+    """
+    Estimate the peak memory of a collection deduplication run, by component.
+
+    Parameters:
+        num_documents (int): Number of documents.
+        text_bytes (int): Total length of the documents.
+        num_hashes (int): Number of hash functions.
+        num_bands (int): Number of LSH bands.
+        signature_bits (int): Signature storage bits, or None for full-width lists.
+        feature_entries (int): Bound of the feature cache, or None for one entry per document.
+        spill_bytes (int): Buffer size when band tables are spilled to disk, or None to
+            keep them in memory.
+        false_positive_rate (float): Bloom filter false positive rate.
+
+    Returns:
+        Dict[str, int]: Estimated bytes of every component.
+    """
+    entries = num_documents
+    if feature_entries is not None:
+        entries = min(feature_entries, num_documents)
+    entry_bytes = FEATURE_ENTRY_BYTES + num_bands * (HASH_INT_BYTES + POINTER_BYTES)
+    if signature_bits is not None:
+        # Cached features still hold the full-width signature.
+        entry_bytes += signature_bytes(num_hashes, None)
+    if spill_bytes is None:
+        band_tables = num_documents * num_bands * BAND_RECORD_BYTES
+    else:
+        band_tables = SPILL_PEAK_FACTOR * spill_bytes
+        band_tables += num_documents * (LIST_BYTES + POINTER_BYTES)
+    return {
+        "documents": text_bytes + num_documents * (STR_BYTES + POINTER_BYTES),
+        "bloom_filter": bloom_filter_bytes(num_documents, false_positive_rate),
+        "signatures": num_documents * signature_bytes(num_hashes, signature_bits),
+        "feature_cache": entries * entry_bytes,
+        "band_tables": band_tables,
+        "clusters": num_documents * CLUSTER_DOC_BYTES,
+    }
+
+
+def plan_memory(
+    max_memory: int,
+    num_documents: int,
+    text_bytes: int,
+    num_hashes: int,
+    num_bands: int,
+    signature_bits: Optional[int] = None,
+    false_positive_rate: float = 0.01,
+) -> dict:
+    """
+    Choose the settings of a deduplication run so its estimated footprint fits a budget.
+
+    Starting from the requested settings, the plan applies adaptations in order of their
+    cost to result quality until the estimate fits: drop the feature cache (exact
+    duplicates are already removed, so it rarely hits), store signatures as 32-bit values,
+    spill band tables to disk, store 8-bit and then 4-bit signatures, and finally relax
+    the Bloom filter's false positive rate. Adaptations that would not shrink the
+    estimate are skipped.
+
+    Parameters:
+        max_memory (int): Budget in bytes.
+        num_documents (int): Number of documents.
+        text_bytes (int): Total length of the documents.
+        num_hashes (int): Number of hash functions.
+        num_bands (int): Number of LSH bands.
+        signature_bits (int): Requested signature storage bits; never widened.
+        false_positive_rate (float): Requested Bloom filter false positive rate.
+
+    Returns:
+        dict: The chosen `settings`, the estimated `components` and their `expected` total,
+            and the `adaptations` applied.
+
+    Raises:
+        ValueError: If the budget is not positive.
+        MemoryError: If the estimate exceeds the budget even with every adaptation.
+    """
+    if max_memory <= 0:
+        raise ValueError("max_memory must be a positive number of bytes.")
+    settings = {
+        "signature_bits": signature_bits,
+        "feature_entries": DEFAULT_MAX_ENTRIES,
+        "spill_bytes": None,
+        "false_positive_rate": false_positive_rate,
+    }
+
+    def total() -> int:
+        return sum(
+            estimate_footprint(
+                num_documents, text_bytes, num_hashes, num_bands, **settings
+            ).values()
+        )
+
+    def narrow_bits(bits):
+        def apply():
+            current = settings["signature_bits"]
+            if current is None or current > bits:
+                settings["signature_bits"] = bits
+
+        return apply
+
+    def spill():
+        fixed = total() - estimate_footprint(
+            num_documents, text_bytes, num_hashes, num_bands, **settings
+        )["band_tables"]
+        headroom = (max_memory - fixed) // (2 * SPILL_PEAK_FACTOR)
+        settings["spill_bytes"] = max(
+            MIN_SPILL_BUFFER_BYTES, min(SPILL_BUFFER_BYTES, headroom)
+        )
+
+    def drop_features():
+        settings["feature_entries"] = 0
+
+    def relax_bloom_filter():
+        settings["false_positive_rate"] = max(
+            false_positive_rate, RELAXED_FALSE_POSITIVE_RATE
+        )
+
+    steps = [
+        ("no feature cache", drop_features),
+        ("32-bit signatures", narrow_bits(32)),
+        ("spilled band tables", spill),
+        ("8-bit signatures", narrow_bits(8)),
+        ("4-bit signatures", narrow_bits(4)),
+        ("relaxed Bloom filter", relax_bloom_filter),
+    ]
+    adaptations = []
+    for name, apply in steps:
+        current = total()
+        if current <= max_memory:
+            break
+        before = dict(settings)
+        apply()
+        if total() < current:
+            adaptations.append(name)
+        else:
+            settings.update(before)
+    if settings["spill_bytes"] is not None:
+        spill()  # Give the spill buffer the headroom left by later adaptations
+    components = estimate_footprint(
+        num_documents, text_bytes, num_hashes, num_bands, **settings
+    )
+    expected = sum(components.values())
+    if expected > max_memory:
+        raise MemoryError(
+            f"Deduplicating {num_documents} documents needs about {expected} bytes even with "
+            f"every adaptation, over the {max_memory}-byte budget: {components}"
+        )
+    if adaptations:
+        logger.info(
+            f"Adapted to the {max_memory}-byte budget with: {', '.join(adaptations)}."
+        )
+    return {
+        "settings": settings,
+        "components": components,
+        "expected": expected,
+        "adaptations": adaptations,
+    }
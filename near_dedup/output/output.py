@@ -0,0 +1,182 @@
+import csv
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+OUTPUT_FORMATS = ("text", "npy", "csv")
+OUTPUT_EXTENSIONS = {"text": "txt", "npy": "npy", "csv": "csv"}
+UNCLUSTERED = -1
+
+
+class ClusterWriter(ABC):
+    """
+    Streams clusters to an output file as they are finalized.
+
+    Every cluster is written (and can be dropped by the caller) as soon as it is passed to
+    `write`. The cluster ID of a cluster is its smallest document ID.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the writer.
+
+        Parameters:
+            path (str): Output file; parent directories are created.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.clusters = 0
+
+    @abstractmethod
+    def write(self, cluster: Iterable[int]):
+        """
+        Write one cluster.
+
+        Parameters:
+            cluster (Iterable[int]): Document IDs of the cluster.
+        """
+        pass
+
+    def write_all(self, clusters: Iterable[Iterable[int]]):
+        """Write every cluster of an iterable, one at a time."""
+        for cluster in clusters:
+            self.write(cluster)
+
+    def close(self):
+        """Flush and close the output file."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TextClusterWriter(ClusterWriter):
+    """Writes one line of space-separated, sorted document IDs per cluster."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.file = open(path, "w")
+
+    def write(self, cluster: Iterable[int]):
+        self.file.write(" ".join(map(str, sorted(cluster))) + "\n")
+        self.clusters += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ArrayClusterWriter(ClusterWriter):
+    """
+    Writes a doc_id -> cluster_id int64 array in `.npy` format.
+
+    The array is a memory-mapped `.npy` file, so downstream jobs can open it with
+    `np.load(path, mmap_mode="r")` without parsing. Documents in no cluster keep
+    `UNCLUSTERED` (-1); a document written to several clusters keeps the smallest ID.
+    """
+
+    def __init__(self, path: str, num_documents: int):
+        """
+        Initialize the writer.
+
+        Parameters:
+            path (str): Output `.npy` file.
+            num_documents (int): Length of the array (largest document ID + 1).
+        """
+        super().__init__(path)
+        self.array = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.int64, shape=(num_documents,)
+        )
+        self.array[:] = UNCLUSTERED
+
+    def write(self, cluster: Iterable[int]):
+        doc_ids = np.fromiter(cluster, dtype=np.int64)
+        if len(doc_ids) == 0:
+            return
+        cluster_id = doc_ids.min()
+        current = self.array[doc_ids]
+        self.array[doc_ids] = np.where(
+            current == UNCLUSTERED, cluster_id, np.minimum(current, cluster_id)
+        )
+        self.clusters += 1
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+
+class CSVClusterWriter(ClusterWriter):
+    """
+    Writes (doc_id, cluster_id, similarity) rows, one per clustered document.
+
+    The similarity of a document is estimated against its cluster ID by the `similarity`
+    callback; the column is left empty when no callback is given.
+    """
+
+    def __init__(
+        self, path: str, similarity: Optional[Callable[[int, int], float]] = None
+    ):
+        """
+        Initialize the writer.
+
+        Parameters:
+            path (str): Output CSV file.
+            similarity (Callable[[int, int], float]): Estimates the similarity of a
+                document to its cluster ID.
+        """
+        super().__init__(path)
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["doc_id", "cluster_id", "similarity"])
+        self.similarity = similarity
+
+    def write(self, cluster: Iterable[int]):
+        doc_ids = sorted(cluster)
+        if not doc_ids:
+            return
+        cluster_id = doc_ids[0]
+        for doc_id in doc_ids:
+            similarity = ""
+            if self.similarity is not None:
+                similarity = round(self.similarity(doc_id, cluster_id), 4)
+            self.writer.writerow([doc_id, cluster_id, similarity])
+        self.clusters += 1
+
+    def close(self):
+        self.file.close()
+
+
+def open_writer(
+    output_format: str,
+    path: str,
+    num_documents: Optional[int] = None,
+    similarity: Optional[Callable[[int, int], float]] = None,
+) -> ClusterWriter:
+    """
+    Open a cluster writer for an output format.
+
+    Parameters:
+        output_format (str): One of `OUTPUT_FORMATS`.
+        path (str): Output file.
+        num_documents (int): Number of documents; required for the 'npy' format.
+        similarity (Callable[[int, int], float]): Similarity callback for the 'csv' format.
+
+    Returns:
+        ClusterWriter: The writer, usable as a context manager.
+    """
+    if output_format == "text":
+        return TextClusterWriter(path)
+    if output_format == "npy":
+        if num_documents is None:
+            raise ValueError("num_documents is required for the 'npy' format.")
+        return ArrayClusterWriter(path, num_documents)
+    if output_format == "csv":
+        return CSVClusterWriter(path, similarity)
+    raise ValueError(
+        f"output_format must be one of {OUTPUT_FORMATS}, got '{output_format}'."
+    )
@@ -0,0 +1,273 @@
+import csv
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from near_dedup.lsh.lsh import LSHBase, LSHImproved
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream in the stage queues.
+END = None
+
+# Per-process signer, created once by the pool initializer.
+_signer: Optional[LSHImproved] = None
+
+
+def read_documents(file_path: str) -> Iterator[str]:
+    """
+    Stream documents from a TSV file, one per line, using the second column when present.
+
+    Parameters:
+        file_path (str): Path to the TSV file.
+
+    Returns:
+        Iterator[str]: Document texts in file order.
+    """
+    with open(file_path, "r") as file:
+        for row in csv.reader(file, delimiter="\t"):
+            if len(row) > 1:
+                yield row[1].strip()
+            elif row:
+                yield row[0].strip()
+
+
+def init_signer(num_hashes, shingle_size, minhash_method, df_sketch, max_df):
+    """Create the signer of a worker process, with the index's stop-shingle filter."""
+    global _signer
+    _signer = LSHImproved(1, 1, num_hashes, shingle_size, minhash_method=minhash_method)
+    _signer.set_stop_shingle_filter(df_sketch, max_df)
+
+
+def sign_batch(documents: List[str], runner_up: bool) -> Tuple[list, float]:
+    """
+    Shingle and minhash a batch of documents in a worker process.
+
+    Parameters:
+        documents (List[str]): Documents of the batch.
+        runner_up (bool): Also return the runner-up values multi-probe LSH needs.
+
+    Returns:
+        Tuple[list, float]: Signatures (or (signature, runner_up) pairs) and busy seconds.
+    """
+    start = time.perf_counter()
+    if runner_up:
+        signed = [
+            _signer.minhash_with_runner_up(_signer.shingle_document(doc))
+            for doc in documents
+        ]
+    else:
+        signed = [_signer.minhash(_signer.shingle_document(doc)) for doc in documents]
+    return signed, time.perf_counter() - start
+
+
+class StageMetrics:
+    """Throughput counters of one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+    def report(self) -> dict:
+        """Return the counters and the throughput while busy, in documents per second."""
+        return {
+            "documents": self.items,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "blocked_seconds": round(self.blocked_seconds, 4),
+            "docs_per_second": (
+                round(self.items / self.busy_seconds, 1) if self.busy_seconds else 0.0
+            ),
+        }
+
+
+class IngestPipeline:
+    """
+    Staged ingestion of documents into an LSH index.
+
+    A reader thread decodes documents into batches, a process pool shingles and minhashes
+    batches in parallel, and the calling thread adds the signatures to the index in input
+    order. Stages are connected by bounded queues, so a slow stage blocks the ones before
+    it instead of letting batches pile up in memory, and end-to-end time approaches that of
+    the slowest stage. `stop` (or an error in any stage) shuts every stage down.
+    """
+
+    def __init__(
+        self,
+        lsh: LSHBase,
+        workers: Optional[int] = None,
+        batch_size: int = 256,
+        queue_size: int = 8,
+    ):
+        """
+        Initialize the pipeline.
+
+        Parameters:
+            lsh (LSHBase): Index the documents are added to; `LSHImproved` indexes also
+                get the runner-up values for multi-probe.
+            workers (int): Number of hashing processes; the CPU count when None.
+            batch_size (int): Number of documents per batch.
+            queue_size (int): Largest number of batches waiting between two stages.
+        """
+        self.lsh = lsh
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.runner_up = isinstance(lsh, LSHImproved)
+        self.stop_event = threading.Event()
+        self.stages = {name: StageMetrics(name) for name in ("read", "hash", "index")}
+        self.elapsed = 0.0
+
+    def put(self, stage_queue: queue.Queue, item, metrics: StageMetrics) -> bool:
+        """Put an item on a bounded queue, waiting for room; False once stopped."""
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                metrics.blocked_seconds += time.perf_counter() - start
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, stage_queue: queue.Queue):
+        """Take an item from a queue; END once stopped."""
+        while not self.stop_event.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return END
+
+    def read_stage(self, documents, batches: queue.Queue):
+        """Group documents into (first_doc_id, documents) batches."""
+        metrics = self.stages["read"]
+        batch, first_id = [], 0
+        start = time.perf_counter()
+        try:
+            for doc in documents:
+                batch.append(doc)
+                if len(batch) == self.batch_size:
+                    metrics.items += len(batch)
+                    metrics.busy_seconds += time.perf_counter() - start
+                    if not self.put(batches, (first_id, batch), metrics):
+                        return
+                    first_id, batch = first_id + len(batch), []
+                    start = time.perf_counter()
+            if batch:
+                metrics.items += len(batch)
+                metrics.busy_seconds += time.perf_counter() - start
+                self.put(batches, (first_id, batch), metrics)
+        except Exception as error:
+            self.put(batches, error, metrics)
+        finally:
+            self.put(batches, END, metrics)
+
+    def hash_stage(self, executor, batches: queue.Queue, signed: queue.Queue):
+        """Submit batches to the worker pool, passing futures on in input order."""
+        metrics = self.stages["hash"]
+        while True:
+            item = self.get(batches)
+            if item is END or isinstance(item, Exception):
+                self.put(signed, item, metrics)
+                return
+            first_id, batch = item
+            future = executor.submit(sign_batch, batch, self.runner_up)
+            if not self.put(signed, (first_id, len(batch), future), metrics):
+                future.cancel()
+                return
+
+    def run(self, documents) -> LSHBase:
+        """
+        Stream documents through the pipeline into the index.
+
+        Parameters:
+            documents: Iterable of document texts; document IDs are their positions.
+
+        Returns:
+            LSHBase: The filled index, ready for clustering.
+        """
+        batches = queue.Queue(maxsize=self.queue_size)
+        signed = queue.Queue(maxsize=self.queue_size)
+        start = time.perf_counter()
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_signer,
+            initargs=(
+                self.lsh.num_hashes,
+                self.lsh.shingle_size,
+                self.lsh.minhash_method,
+                self.lsh.df_sketch,
+                self.lsh.max_df,
+            ),
+        )
+        reader = threading.Thread(
+            target=self.read_stage, args=(documents, batches), daemon=True
+        )
+        dispatcher = threading.Thread(
+            target=self.hash_stage, args=(executor, batches, signed), daemon=True
+        )
+        reader.start()
+        dispatcher.start()
+        try:
+            self.index_stage(signed)
+        finally:
+            self.stop()
+            reader.join()
+            dispatcher.join()
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.elapsed = time.perf_counter() - start
+        logger.info(f"Pipeline finished in {self.elapsed:.2f}s: {self.metrics()}")
+        return self.lsh
+
+    def index_stage(self, signed: queue.Queue):
+        """Add signed batches to the index in input order."""
+        metrics = self.stages["index"]
+        hash_metrics = self.stages["hash"]
+        while True:
+            item = self.get(signed)
+            if item is END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            first_id, count, future = item
+            wait_start = time.perf_counter()
+            results, busy_seconds = future.result()
+            metrics.blocked_seconds += time.perf_counter() - wait_start
+            hash_metrics.items += count
+            hash_metrics.busy_seconds += busy_seconds
+            start = time.perf_counter()
+            for doc_id, result in enumerate(results, first_id):
+                if self.runner_up:
+                    self.lsh.add_signature(doc_id, *result)
+                else:
+                    self.lsh.add_signature(doc_id, result)
+            metrics.items += count
+            metrics.busy_seconds += time.perf_counter() - start
+
+    def stop(self):
+        """
+        Ask every stage to finish.
+
+        Queued and in-flight batches are dropped; `run` returns the index with the
+        documents added so far (`stages["index"].items` of them).
+        """
+        self.stop_event.set()
+
+    def metrics(self) -> dict:
+        """
+        Report per-stage throughput.
+
+        `busy_seconds` of the hash stage is summed over worker processes; `blocked_seconds`
+        is time spent waiting on a full queue (read, hash) or on a worker result (index).
+
+        Returns:
+            dict: Metrics of every stage plus the end-to-end elapsed seconds.
+        """
+        report = {name: stage.report() for name, stage in self.stages.items()}
+        report["elapsed_seconds"] = round(self.elapsed, 4)
+        return report
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+from typing import List, Optional
+
+from near_dedup.baselines.baselines import compute_md5
+from near_dedup.deduplicator.deduplicator import DocumentDeduplicator
+from near_dedup.signatures.signatures import SignatureStore
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("add", "check", "search")
+
+
+class ServiceOverloaded(Exception):
+    """Raised when the request queue is full and the service sheds load."""
+
+
+class ServiceClosed(Exception):
+    """Raised for requests submitted to, or left unanswered by, a closing service."""
+
+
+class DedupService:
+    """
+    Long-running deduplication and search service over a local socket.
+
+    Requests are newline-delimited JSON objects such as
+    `{"op": "add", "text": "..."}`, `{"op": "check", "text": "..."}` or
+    `{"op": "search", "text": "...", "threshold": 0.8}`; every request gets one JSON
+    line back. Concurrent requests are coalesced into micro-batches: the batcher waits
+    at most `max_batch_delay` seconds (or until `max_batch_size` requests arrived), signs
+    the whole batch in one worker-thread call and applies the operations in arrival
+    order. When `max_queue_size` requests are already waiting, new requests are
+    rejected with an "overloaded" error instead of growing the queue.
+    """
+
+    def __init__(
+        self,
+        lsh_params=(10, 5, 100),
+        threshold: float = 0.7,
+        max_batch_size: int = 64,
+        max_batch_delay: float = 0.005,
+        max_queue_size: int = 1024,
+    ):
+        """
+        Initialize the service.
+
+        Parameters:
+            lsh_params (tuple): Parameters for initializing LSH (num_bands, rows_per_band, num_hashes).
+            threshold (float): Default similarity threshold for `check` and `search`.
+            max_batch_size (int): Maximum number of requests processed in one micro-batch.
+            max_batch_delay (float): Maximum seconds the first request of a batch waits for company.
+            max_queue_size (int): Maximum number of queued requests before new ones are rejected.
+        """
+        self.deduplicator = DocumentDeduplicator(lsh_params=lsh_params)
+        self.lsh = self.deduplicator.lsh
+        self.signatures = SignatureStore(self.lsh.num_hashes, bits=32)
+        self.exact_ids = {}
+        self.threshold = threshold
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.max_queue_size = max_queue_size
+        self.next_id = 0
+        self.queue: Optional[asyncio.Queue] = None
+        self.server = None
+        self.batcher = None
+        self.batches = 0
+        self.closing = False
+
+    def sign_batch(self, texts: List[str]) -> List[list]:
+        """Clean, shingle and minhash a batch of documents."""
+        cleaned = self.deduplicator.preprocess_documents(texts)
+        return [self.lsh.minhash(self.lsh.shingle_document(doc)) for doc in cleaned]
+
+    def matches(self, signature, threshold: float) -> List[dict]:
+        """Indexed documents whose estimated similarity to a signature reaches the threshold."""
+        candidates = self.lsh.query_signature(signature)
+        if not candidates:
+            return []
+        compressed = self.signatures.compress(signature)
+        rows = self.signatures.values[[self.signatures.rows[c] for c in candidates]]
+        similarities = self.signatures.estimate_jaccard(
+            self.signatures.agreement(rows, compressed)
+        )
+        found = [
+            {"id": doc_id, "similarity": round(float(similarity), 4)}
+            for doc_id, similarity in zip(candidates, similarities)
+            if similarity >= threshold
+        ]
+        return sorted(found, key=lambda match: -match["similarity"])
+
+    def apply(self, request: dict, signature) -> dict:
+        """Apply one request to the index, given its precomputed signature."""
+        op = request["op"]
+        text = request["text"]
+        threshold = float(request.get("threshold", self.threshold))
+        md5_hash = compute_md5(text)
+        exact = self.exact_ids.get(md5_hash)
+        if op == "search":
+            return {"ok": True, "matches": self.matches(signature, threshold)}
+
+        matches = self.matches(signature, threshold)
+        response = {
+            "ok": True,
+            "duplicate": exact is not None or bool(matches),
+            "exact": exact,
+            "matches": matches,
+        }
+        if op == "add":
+            doc_id = request.get("id", self.next_id)
+            if doc_id in self.signatures:
+                raise ValueError(f"Document {doc_id} is already indexed.")
+            self.next_id = max(self.next_id, doc_id + 1)
+            self.lsh.add_signature(doc_id, signature)
+            self.signatures.add(doc_id, signature)
+            self.exact_ids.setdefault(md5_hash, doc_id)
+            response["id"] = doc_id
+        return response
+
+    async def submit(self, request: dict) -> dict:
+        """
+        Queue a request for the next micro-batch and wait for its response.
+
+        Parameters:
+            request (dict): Request with "op" and "text" keys.
+
+        Returns:
+            dict: The response for the request.
+        """
+        if not isinstance(request, dict) or request.get("op") not in OPERATIONS:
+            raise ValueError(f"op must be one of {OPERATIONS}.")
+        if not isinstance(request.get("text"), str):
+            raise ValueError("text must be a string.")
+        if "id" in request and not isinstance(request["id"], int):
+            raise ValueError("id must be an integer.")
+        if self.closing:
+            raise ServiceClosed("the service is shutting down.")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((request, future))
+        except asyncio.QueueFull:
+            raise ServiceOverloaded(
+                f"request queue is full ({self.max_queue_size} pending)."
+            )
+        return await future
+
+    async def run_batcher(self):
+        """Collect queued requests into micro-batches and process them, until the
+        `None` sentinel queued by `close`."""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.max_batch_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.process_batch(batch)
+            if stopping:
+                return
+
+    async def process_batch(self, batch):
+        """Sign a batch in a worker thread and apply its requests in arrival order."""
+        loop = asyncio.get_running_loop()
+        try:
+            signatures = await loop.run_in_executor(
+                None, self.sign_batch, [request["text"] for request, _ in batch]
+            )
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batches += 1
+        for (request, future), signature in zip(batch, signatures):
+            if future.done():
+                continue
+            try:
+                future.set_result(self.apply(request, signature))
+            except Exception as error:
+                future.set_exception(error)
+
+    async def handle_connection(self, reader, writer):
+        """Serve newline-delimited JSON requests from one client connection."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.submit(json.loads(line))
+                except ServiceOverloaded as error:
+                    response = {
+                        "ok": False,
+                        "error": "overloaded",
+                        "detail": str(error),
+                    }
+                except ServiceClosed as error:
+                    response = {"ok": False, "error": "closed", "detail": str(error)}
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {
+                        "ok": False,
+                        "error": "bad_request",
+                        "detail": str(error),
+                    }
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0, path: Optional[str] = None
+    ):
+        """
+        Start listening on a TCP address or, when `path` is given, a Unix socket.
+
+        Parameters:
+            host (str): TCP host to bind.
+            port (int): TCP port to bind; 0 picks a free port.
+            path (str): Unix socket path to bind instead of TCP.
+        """
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.batcher = asyncio.create_task(self.run_batcher())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.handle_connection, path=path
+            )
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"Dedup service listening on {self.address}.")
+
+    @property
+    def address(self):
+        """Bound socket address of the service."""
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        """
+        Stop intake, let the batcher finish every queued request and stop it.
+
+        New requests are rejected with ServiceClosed. A sentinel queued behind the
+        pending requests stops the batcher once they are answered; any request still
+        unanswered after that (e.g. if the batcher failed) gets ServiceClosed too, so no
+        client waits forever.
+        """
+        self.closing = True
+        self.server.close()
+        if not self.batcher.done():
+            await self.queue.put(None)
+        try:
+            await self.batcher
+        finally:
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is not None and not item[1].done():
+                    item[1].set_exception(ServiceClosed("the service shut down."))
+        await self.server.wait_closed()
+
+
+class DedupClient:
+    """Minimal asyncio client for `DedupService`."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(
+        cls, host: str = "127.0.0.1", port: int = 0, path: Optional[str] = None
+    ):
+        """Open a connection to a service on a TCP address or Unix socket path."""
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, op: str, text: str, **kwargs) -> dict:
+        """Send one request and return the decoded response."""
+        payload = dict(kwargs, op=op, text=text)
+        self.writer.write((json.dumps(payload) + "\n").encode())
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        """Close the connection."""
+        self.writer.close()
+        await self.writer.wait_closed()
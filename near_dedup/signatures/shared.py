@@ -0,0 +1,267 @@
+import json
+import os
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from near_dedup.lsh.lsh import LSHBase
+from near_dedup.signatures.signatures import SignatureStore, compute_band_keys
+
+# Arrays making up a shared index, in layout order.
+ARRAY_NAMES = ("doc_ids", "signatures", "band_keys", "band_rows")
+META_FILE = "meta.json"
+ALIGNMENT = 64
+
+
+class SharedIndex:
+    """
+    Read-only signature index in flat arrays, shareable zero-copy between processes.
+
+    The index is four arrays: document IDs, (documents x num_hashes) uint32 signatures,
+    and per band the sorted uint64 band keys with the signature row of every key. A
+    query finds each band's matching rows with a binary search and verifies them
+    against the signatures. The arrays are published once, either into a
+    `multiprocessing.shared_memory` block or as `.npy` files in a directory, and every
+    worker attaches views onto the same memory. Attached arrays are read-only and the
+    query path never writes, so queries need no locks.
+    """
+
+    def __init__(
+        self,
+        arrays: Dict[str, np.ndarray],
+        meta: dict,
+        shm: Optional[shared_memory.SharedMemory] = None,
+    ):
+        """
+        Wrap index arrays; use `build`, `attach` or `load` to create an index.
+
+        Parameters:
+            arrays (Dict[str, np.ndarray]): The arrays named in `ARRAY_NAMES`.
+            meta (dict): Banding and signing parameters of the index.
+            shm (SharedMemory): Shared memory block backing the arrays, if any.
+        """
+        self.arrays = arrays
+        self.meta = meta
+        self.shm = shm
+        self.num_bands = meta["num_bands"]
+        self.rows_per_band = meta["rows_per_band"]
+        self.signer = None
+
+    @classmethod
+    def build(
+        cls,
+        store: SignatureStore,
+        num_bands: int,
+        rows_per_band: int,
+        shingle_size: int = 5,
+        minhash_method: str = "classic",
+    ) -> "SharedIndex":
+        """
+        Lay out a 32-bit signature store as a banded flat-array index.
+
+        Parameters:
+            store (SignatureStore): Signatures stored with `bits=32`.
+            num_bands (int): Number of bands.
+            rows_per_band (int): Number of rows per band.
+            shingle_size (int): Shingle size the signatures were computed with.
+            minhash_method (str): MinHash method the signatures were computed with.
+
+        Returns:
+            SharedIndex: An index backed by private (not yet shared) arrays.
+        """
+        if store.bits != 32:
+            raise ValueError("SharedIndex needs signatures stored with bits=32.")
+        signatures = store.values[: len(store)]
+        keys = compute_band_keys(signatures, num_bands, rows_per_band).T
+        order = np.argsort(keys, axis=1, kind="stable")
+        arrays = {
+            "doc_ids": np.array(store.doc_ids, dtype=np.int64),
+            "signatures": np.ascontiguousarray(signatures),
+            "band_keys": np.take_along_axis(keys, order, axis=1),
+            "band_rows": order.astype(np.int64),
+        }
+        meta = {
+            "num_bands": num_bands,
+            "rows_per_band": rows_per_band,
+            "num_hashes": store.num_hashes,
+            "shingle_size": shingle_size,
+            "minhash_method": minhash_method,
+        }
+        return cls(arrays, meta)
+
+    def __len__(self) -> int:
+        return len(self.arrays["doc_ids"])
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the index arrays."""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def layout(self) -> Tuple[dict, int]:
+        """Offsets, dtypes and shapes of the arrays in one aligned block, and its size."""
+        layout, offset = {}, 0
+        for name in ARRAY_NAMES:
+            array = self.arrays[name]
+            layout[name] = (offset, array.dtype.str, array.shape)
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        return layout, max(offset, 1)
+
+    def publish(self) -> dict:
+        """
+        Copy the index into a new shared memory block.
+
+        The publishing process owns the block and must `close` and `unlink` it once
+        the workers are done.
+
+        Returns:
+            dict: A picklable handle for `attach`.
+        """
+        layout, size = self.layout()
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        for name, (offset, dtype, shape) in layout.items():
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            view[...] = self.arrays[name]
+        handle = {"name": shm.name, "layout": layout, "meta": self.meta}
+        self.shm = shm
+        self.arrays = self.attach_arrays(shm, layout)
+        return handle
+
+    @staticmethod
+    def attach_arrays(shm: shared_memory.SharedMemory, layout: dict) -> dict:
+        """Read-only array views onto a shared memory block."""
+        arrays = {}
+        for name, (offset, dtype, shape) in layout.items():
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            arrays[name] = array
+        return arrays
+
+    @classmethod
+    def attach(cls, handle: dict) -> "SharedIndex":
+        """
+        Attach to an index published with `publish`, without copying it.
+
+        Parameters:
+            handle (dict): Handle returned by `publish`.
+
+        Returns:
+            SharedIndex: An index over read-only views of the shared block.
+        """
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=handle["name"], track=False)
+        else:
+            # Before 3.13 attaching registers the block with this process's resource
+            # tracker, which unlinks the owner's block when a worker with its own tracker
+            # exits. Forked and spawned workers inherit the owner's tracker, where the
+            # registration is a harmless duplicate that unregistering would remove, so
+            # only a tracker this process had not started yet (its own) is corrected.
+            inherited = resource_tracker._resource_tracker._fd is not None
+            shm = shared_memory.SharedMemory(name=handle["name"])
+            if not inherited:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(cls.attach_arrays(shm, handle["layout"]), handle["meta"], shm)
+
+    def save(self, directory: str):
+        """
+        Write the index as `.npy` files plus metadata, for memory-mapped loading.
+
+        Parameters:
+            directory (str): Output directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(directory, f"{name}.npy"), self.arrays[name])
+        with open(os.path.join(directory, META_FILE), "w") as file:
+            json.dump(self.meta, file)
+
+    @classmethod
+    def load(cls, directory: str) -> "SharedIndex":
+        """
+        Memory-map an index written by `save`; the OS page cache is shared by all readers.
+
+        Parameters:
+            directory (str): Directory written by `save`.
+
+        Returns:
+            SharedIndex: An index over read-only memory maps.
+        """
+        with open(os.path.join(directory, META_FILE)) as file:
+            meta = json.load(file)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ARRAY_NAMES
+        }
+        return cls(arrays, meta)
+
+    def candidate_rows(self, signature: np.ndarray) -> np.ndarray:
+        """Signature rows sharing at least one band key with a uint32 signature."""
+        query_keys = compute_band_keys(
+            signature[np.newaxis, :], self.num_bands, self.rows_per_band
+        )[0]
+        band_keys, band_rows = self.arrays["band_keys"], self.arrays["band_rows"]
+        matches = []
+        for band, key in enumerate(query_keys):
+            left = np.searchsorted(band_keys[band], key, side="left")
+            right = np.searchsorted(band_keys[band], key, side="right")
+            matches.append(band_rows[band, left:right])
+        return np.unique(np.concatenate(matches))
+
+    def query(self, signature, threshold: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find indexed documents sharing a band with a signature and estimate their similarity.
+
+        Parameters:
+            signature: Minhash signature (full-width values are truncated to 32 bits).
+            threshold (float): Smallest estimated Jaccard similarity to return.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Document IDs and similarities, most similar first.
+        """
+        compressed = np.array(
+            [
+                int(value) & 0xFFFFFFFF if value != float("inf") else 0xFFFFFFFF
+                for value in signature
+            ],
+            dtype=np.uint32,
+        )
+        rows = self.candidate_rows(compressed)
+        similarities = np.mean(self.arrays["signatures"][rows] == compressed, axis=1)
+        keep = similarities >= threshold
+        rows, similarities = rows[keep], similarities[keep]
+        order = np.argsort(-similarities, kind="stable")
+        return self.arrays["doc_ids"][rows[order]], similarities[order]
+
+    def search(self, doc: str, threshold: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sign a query document with the index's parameters and `query` it.
+
+        Parameters:
+            doc (str): Query document, normalized the same way as the indexed documents.
+            threshold (float): Smallest estimated Jaccard similarity to return.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Document IDs and similarities, most similar first.
+        """
+        if self.signer is None:
+            self.signer = LSHBase(
+                1,
+                1,
+                self.meta["num_hashes"],
+                self.meta["shingle_size"],
+                self.meta["minhash_method"],
+            )
+        signature = self.signer.minhash(self.signer.shingle_document(doc))
+        return self.query(signature, threshold)
+
+    def close(self):
+        """Detach from the shared memory block, if any."""
+        if self.shm is not None:
+            self.arrays = {}
+            self.shm.close()
+
+    def unlink(self):
+        """Free the shared memory block; only the publishing process should call this."""
+        if self.shm is not None:
+            self.shm.unlink()
@@ -0,0 +1,206 @@
+import math
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+SUPPORTED_BITS = (1, 2, 3, 4, 5, 6, 7, 8, 32)
+
+# Multipliers of the splitmix64 finalizer used to mix band keys.
+MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    """
+    Vectorized splitmix64 finalizer: a bijective, well-mixed uint64 -> uint64 hash.
+
+    Parameters:
+        values (np.ndarray): uint64 values.
+
+    Returns:
+        np.ndarray: Mixed uint64 values (arithmetic wraps modulo 2^64).
+    """
+    values = values ^ (values >> np.uint64(30))
+    values = values * MIX_MULTIPLIERS[0]
+    values = values ^ (values >> np.uint64(27))
+    values = values * MIX_MULTIPLIERS[1]
+    return values ^ (values >> np.uint64(31))
+
+
+def compute_band_keys(
+    signatures: np.ndarray, num_bands: int, rows_per_band: int
+) -> np.ndarray:
+    """
+    Hash every band of 32-bit signature rows to a uint64 key, for all documents at once.
+
+    Each band key starts from a per-band seed and absorbs the band's values one row at a
+    time, so equal rows in different bands give different keys.
+
+    Parameters:
+        signatures (np.ndarray): (documents x num_hashes) uint32 signature values.
+        num_bands (int): Number of bands.
+        rows_per_band (int): Number of rows per band.
+
+    Returns:
+        np.ndarray: (documents x num_bands) uint64 band keys.
+    """
+    signatures = np.atleast_2d(signatures)
+    if num_bands * rows_per_band > signatures.shape[1]:
+        raise ValueError("num_bands * rows_per_band exceeds the signature length.")
+    bands = signatures[:, : num_bands * rows_per_band].reshape(
+        len(signatures), num_bands, rows_per_band
+    )
+    keys = np.broadcast_to(
+        mix64(np.arange(1, num_bands + 1, dtype=np.uint64)), bands.shape[:2]
+    )
+    for row in range(rows_per_band):
+        keys = mix64(keys ^ bands[:, :, row].astype(np.uint64))
+    return keys
+
+
+class SignatureStore:
+    """
+    Compressed storage for minhash signatures.
+
+    Signatures are kept either as 32-bit truncated values in a (documents x num_hashes)
+    uint32 array, or as the lowest `bits` (1-8) bits of every value packed into a uint8
+    array. Both the offline index and the verification stage read similarities from it.
+    """
+
+    def __init__(self, num_hashes: int, bits: int = 32, capacity: int = 1024):
+        """
+        Initialize the signature store.
+
+        Parameters:
+            num_hashes (int): Number of values in each minhash signature.
+            bits (int): Bits kept per value: 32 for truncated storage, or 1-8 for b-bit storage.
+            capacity (int): Initial number of signature rows to allocate.
+        """
+        if bits not in SUPPORTED_BITS:
+            raise ValueError(f"bits must be one of {SUPPORTED_BITS}, got {bits}.")
+        self.num_hashes = num_hashes
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        if bits == 32:
+            self.values = np.zeros((capacity, num_hashes), dtype=np.uint32)
+        else:
+            row_bytes = math.ceil(num_hashes * bits / 8)
+            self.values = np.zeros((capacity, row_bytes), dtype=np.uint8)
+        self.doc_ids: List[int] = []
+        self.rows = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self.rows
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes used by the stored signature rows."""
+        return len(self) * self.values.shape[1] * self.values.itemsize
+
+    def compress(self, signature: Iterable[int]) -> np.ndarray:
+        """
+        Truncate a minhash signature to the stored representation.
+
+        Parameters:
+            signature (Iterable[int]): Minhash signature values.
+
+        Returns:
+            np.ndarray: The compressed signature row.
+        """
+        truncated = np.array(
+            [
+                int(value) & self.mask if value != float("inf") else self.mask
+                for value in signature
+            ],
+            dtype=np.uint32,
+        )
+        if self.bits == 32:
+            return truncated
+        low_bytes = truncated.astype(np.uint8)[:, np.newaxis]
+        value_bits = np.unpackbits(low_bytes, axis=1, bitorder="little")[:, : self.bits]
+        return np.packbits(value_bits.ravel(), bitorder="little")
+
+    def add(self, doc_id: int, signature: Iterable[int]):
+        """
+        Store the compressed signature of a document.
+
+        Parameters:
+            doc_id (int): Identifier of the document.
+            signature (Iterable[int]): Minhash signature of the document.
+        """
+        row = self.compress(signature)
+        if doc_id in self.rows:
+            self.values[self.rows[doc_id]] = row
+            return
+        if len(self) == len(self.values):
+            self.values = np.resize(self.values, (max(1, 2 * len(self)), row.shape[0]))
+        self.rows[doc_id] = len(self)
+        self.values[len(self)] = row
+        self.doc_ids.append(doc_id)
+
+    def agreement(self, rows: np.ndarray, compressed: np.ndarray) -> np.ndarray:
+        """
+        Fraction of signature positions on which stored rows agree with a compressed signature.
+
+        Parameters:
+            rows (np.ndarray): Compressed signature rows.
+            compressed (np.ndarray): Compressed signature to compare against.
+
+        Returns:
+            np.ndarray: Agreement fraction for every row.
+        """
+        if self.bits == 32:
+            return np.mean(rows == compressed, axis=1)
+        diff = np.unpackbits(rows ^ compressed, axis=1, bitorder="little")
+        diff = diff[:, : self.num_hashes * self.bits].reshape(
+            len(rows), self.num_hashes, self.bits
+        )
+        return 1.0 - np.mean(diff.any(axis=2), axis=1)
+
+    def estimate_jaccard(self, agreement: np.ndarray) -> np.ndarray:
+        """
+        Bias-corrected Jaccard estimate from the fraction of agreeing positions.
+
+        Two b-bit values also collide by chance when the full minhash values differ. For a
+        hash universe much larger than the sets (128-bit md5 here) that chance is 2^-b, so
+        P(agree) = 2^-b + (1 - 2^-b) * J and J = (P - 2^-b) / (1 - 2^-b) (Li and Konig, 2010).
+
+        Parameters:
+            agreement (np.ndarray): Observed agreement fractions.
+
+        Returns:
+            np.ndarray: Estimated Jaccard similarities, clipped to [0, 1].
+        """
+        collision = 2.0**-self.bits
+        return np.clip((agreement - collision) / (1.0 - collision), 0.0, 1.0)
+
+    def similarity(self, doc1: int, doc2: int) -> float:
+        """
+        Estimate the Jaccard similarity between two stored documents.
+
+        Parameters:
+            doc1 (int): Identifier of the first document.
+            doc2 (int): Identifier of the second document.
+
+        Returns:
+            float: Estimated Jaccard similarity.
+        """
+        row1 = self.values[self.rows[doc1]]
+        row2 = self.values[self.rows[doc2]][np.newaxis, :]
+        return float(self.estimate_jaccard(self.agreement(row2, row1))[0])
+
+    def query(self, signature: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Estimate the similarity of a query signature against every stored document.
+
+        Parameters:
+            signature (Iterable[int]): Minhash signature of the query document.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Document identifiers and their estimated similarities.
+        """
+        rows = self.values[: len(self)]
+        similarities = self.estimate_jaccard(self.agreement(rows, self.compress(signature)))
+        return np.array(self.doc_ids, dtype=np.int64), similarities
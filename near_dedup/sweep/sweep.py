@@ -0,0 +1,209 @@
+import logging
+import time
+import tracemalloc
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from near_dedup.lsh.lsh import LSHImproved
+
+logger = logging.getLogger(__name__)
+
+
+def load_clusters(file_path: str) -> List[List[int]]:
+    """
+    Load clusters written in the text format, one line of document IDs per cluster.
+
+    Parameters:
+        file_path (str): Results file, e.g. `results/1000-baseline.txt`.
+
+    Returns:
+        List[List[int]]: Document IDs of every non-empty cluster.
+    """
+    with open(file_path) as file:
+        return [
+            [int(doc_id) for doc_id in line.split()] for line in file if line.strip()
+        ]
+
+
+def cluster_labels(clusters: Iterable[Iterable[int]], num_documents: int) -> np.ndarray:
+    """
+    Label every document with the smallest document ID of its cluster.
+
+    Documents in no cluster are labelled with their own ID, i.e. treated as singletons.
+
+    Parameters:
+        clusters (Iterable[Iterable[int]]): Clusters of document IDs.
+        num_documents (int): Number of documents.
+
+    Returns:
+        np.ndarray: int64 cluster label of every document.
+    """
+    labels = np.arange(num_documents, dtype=np.int64)
+    for cluster in clusters:
+        doc_ids = np.fromiter(cluster, dtype=np.int64)
+        if len(doc_ids):
+            labels[doc_ids] = np.minimum(labels[doc_ids], doc_ids.min())
+    return labels
+
+
+def count_pairs(sizes: np.ndarray) -> int:
+    """Number of unordered pairs within groups of the given sizes."""
+    sizes = sizes.astype(np.int64)
+    return int(np.sum(sizes * (sizes - 1) // 2))
+
+
+def pair_precision_recall(
+    true_labels: np.ndarray, predicted_labels: np.ndarray
+) -> Tuple[float, float]:
+    """
+    Pair-counting precision and recall of a clustering against a reference clustering.
+
+    A pair of documents is positive when both share a cluster. True positives are
+    counted from the contingency table of (true, predicted) label pairs, so no pair is
+    ever enumerated: sum over cells of n_ij * (n_ij - 1) / 2.
+
+    Parameters:
+        true_labels (np.ndarray): Reference cluster label of every document.
+        predicted_labels (np.ndarray): Predicted cluster label of every document.
+
+    Returns:
+        Tuple[float, float]: Precision and recall (1.0 when there are no pairs to find).
+    """
+    _, cells = np.unique(
+        np.stack([true_labels, predicted_labels]), axis=1, return_counts=True
+    )
+    true_positives = count_pairs(cells)
+    predicted_pairs = count_pairs(np.unique(predicted_labels, return_counts=True)[1])
+    true_pairs = count_pairs(np.unique(true_labels, return_counts=True)[1])
+    precision = true_positives / predicted_pairs if predicted_pairs else 1.0
+    recall = true_positives / true_pairs if true_pairs else 1.0
+    return precision, recall
+
+
+class ParameterSweep:
+    """
+    Evaluates many (bands, rows, probes) LSH configurations from one set of signatures.
+
+    Signatures (and the runner-up values multi-probe needs) only depend on the number of
+    hashes, the shingle size and the MinHash method, so they are computed once; every
+    configuration then only bands, probes and clusters the stored signatures.
+    """
+
+    def __init__(
+        self,
+        documents: Sequence[str],
+        num_hashes: int = 100,
+        shingle_size: int = 5,
+        minhash_method: str = "classic",
+    ):
+        """
+        Compute the signatures of all documents.
+
+        Parameters:
+            documents (Sequence[str]): Documents, identified by position.
+            num_hashes (int): Signature length; every configuration uses a prefix of it.
+            shingle_size (int): Size of each shingle.
+            minhash_method (str): 'classic' or 'oph'.
+        """
+        self.num_hashes = num_hashes
+        self.shingle_size = shingle_size
+        self.minhash_method = minhash_method
+        self.signer = LSHImproved(
+            1, 1, num_hashes, shingle_size, minhash_method=minhash_method
+        )
+        start = time.perf_counter()
+        self.signatures = [
+            self.signer.document_signature_with_runner_up(doc) for doc in documents
+        ]
+        self.signature_seconds = time.perf_counter() - start
+        logger.info(
+            f"Computed {len(documents)} signatures in {self.signature_seconds:.2f}s."
+        )
+
+    def run_config(self, num_bands: int, rows_per_band: int, probes: int) -> dict:
+        """
+        Index and cluster the stored signatures with one configuration.
+
+        Runtime and peak memory are measured with tracemalloc running, so times include
+        its overhead and are meant for comparing configurations.
+
+        Parameters:
+            num_bands (int): Number of bands.
+            rows_per_band (int): Number of rows per band.
+            probes (int): Number of additional probes per band for multi-probe LSH.
+
+        Returns:
+            dict: The clusters plus the runtime and traced peak memory.
+        """
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        lsh = LSHImproved(
+            num_bands,
+            rows_per_band,
+            self.num_hashes,
+            self.shingle_size,
+            probes=probes,
+            minhash_method=self.minhash_method,
+        )
+        for doc_id, (signature, runner_up) in enumerate(self.signatures):
+            lsh.add_signature(doc_id, signature, runner_up)
+        clusters = lsh.cluster_candidates()
+        seconds = time.perf_counter() - start
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        peak_bytes -= baseline  # Memory the caller already held is not this run's
+        if not tracing:
+            tracemalloc.stop()
+        return {"clusters": clusters, "seconds": seconds, "peak_bytes": peak_bytes}
+
+    def run(
+        self,
+        configs: Iterable[Tuple[int, int, int]],
+        baseline_clusters: Optional[Iterable[Iterable[int]]] = None,
+    ) -> List[dict]:
+        """
+        Evaluate every configuration, optionally against a baseline clustering.
+
+        Parameters:
+            configs (Iterable[Tuple[int, int, int]]): (num_bands, rows_per_band, probes) triples.
+            baseline_clusters (Iterable[Iterable[int]]): Reference clusters for precision/recall.
+
+        Returns:
+            List[dict]: One report row per configuration that fits in `num_hashes`.
+        """
+        num_documents = len(self.signatures)
+        true_labels = None
+        if baseline_clusters is not None:
+            true_labels = cluster_labels(baseline_clusters, num_documents)
+        reports = []
+        for num_bands, rows_per_band, probes in configs:
+            if num_bands * rows_per_band > self.num_hashes:
+                logger.warning(
+                    f"Skipping b={num_bands}, r={rows_per_band}: needs more than {self.num_hashes} hashes."
+                )
+                continue
+            result = self.run_config(num_bands, rows_per_band, probes)
+            labels = cluster_labels(result["clusters"].values(), num_documents)
+            report = {
+                "num_bands": num_bands,
+                "rows_per_band": rows_per_band,
+                "probes": probes,
+                "threshold": round((1 / num_bands) ** (1 / rows_per_band), 4),
+                "clusters": int(np.sum(np.unique(labels, return_counts=True)[1] > 1)),
+                "seconds": round(result["seconds"], 4),
+                "peak_bytes": result["peak_bytes"],
+            }
+            if true_labels is not None:
+                precision, recall = pair_precision_recall(true_labels, labels)
+                total = precision + recall
+                f1 = 2 * precision * recall / total if total else 0.0
+                report["precision"] = round(precision, 4)
+                report["recall"] = round(recall, 4)
+                report["f1"] = round(f1, 4)
+            logger.info(f"Sweep result: {report}")
+            reports.append(report)
+        return reports
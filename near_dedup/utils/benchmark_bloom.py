@@ -0,0 +1,95 @@
+import argparse
+import time
+
+from near_dedup.bloom_filter.bloom_filter import (
+    BlockedBloomFilter,
+    BloomFilter,
+    CountingBloomFilter,
+    CuckooFilter,
+)
+
+# Micro-benchmark of the membership filters on MD5-like keys: the standard and the
+# cache-line blocked Bloom filter, and the deletable counting Bloom and cuckoo filters.
+# Reports insert and lookup throughput, memory, and the measured false positive rate
+# next to the rate each filter was sized for (corrected, for the blocked filter).
+
+
+def make_keys(count, prefix):
+    """Distinct string keys, shaped like the MD5 hex digests of the exact-dup stage."""
+    return [f"{prefix}{i:030x}" for i in range(count)]
+
+
+def bench(filter_class, num_elements, false_positive_rate, num_queries, batch):
+    """Return (insert us/key, lookup us/key, bytes, measured FPR, expected FPR)."""
+    members = make_keys(num_elements, "m")
+    queries = make_keys(num_queries, "q")
+    bloom = filter_class(num_elements, false_positive_rate)
+
+    start = time.perf_counter()
+    if batch:
+        bloom.add_batch(members)
+    else:
+        for key in members:
+            bloom.add(key)
+    insert = (time.perf_counter() - start) / num_elements
+
+    start = time.perf_counter()
+    if batch:
+        hits = int(bloom.contains_batch(queries).sum())
+    else:
+        hits = sum(bloom.contains(key) for key in queries)
+    lookup = (time.perf_counter() - start) / num_queries
+
+    if isinstance(bloom, BlockedBloomFilter):
+        size = bloom.blocks.nbytes
+        expected = bloom.expected_false_positive_rate(
+            bloom.num_blocks, num_elements, bloom.num_hashes
+        )
+    elif isinstance(bloom, CuckooFilter):
+        size = bloom.nbytes
+        # Each of the 2 * bucket_size probed slots holds a matching fingerprint with
+        # probability load / (2^f - 1).
+        slots = 2 * bloom.bucket_size * bloom.load_factor
+        expected = 1 - (1 - 1 / ((1 << bloom.fingerprint_bits) - 1)) ** slots
+    else:
+        size = len(bloom.bit_array) // 8
+        expected = (1 - (1 - 1 / bloom.size) ** (bloom.num_hashes * num_elements)) ** (
+            bloom.num_hashes
+        )
+    return insert * 1e6, lookup * 1e6, size, hits / num_queries, expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Throughput and accuracy of BloomFilter vs BlockedBloomFilter."
+    )
+    parser.add_argument("--num_elements", type=int, nargs="*", default=[10**4, 10**5, 10**6])
+    parser.add_argument("--false_positive_rate", type=float, default=0.01)
+    parser.add_argument("--num_queries", type=int, default=100000)
+    args = parser.parse_args()
+
+    variants = [
+        ("standard", BloomFilter, False),
+        ("blocked", BlockedBloomFilter, False),
+        ("blocked-batch", BlockedBloomFilter, True),
+        ("counting", CountingBloomFilter, False),
+        ("cuckoo", CuckooFilter, False),
+        ("cuckoo-batch", CuckooFilter, True),
+    ]
+    print(
+        f"{'elements':>10} {'filter':<14}{'add us':>9}{'query us':>10}"
+        f"{'KiB':>10}{'FPR':>9}{'expected':>10}"
+    )
+    for num_elements in args.num_elements:
+        for name, filter_class, batch in variants:
+            insert, lookup, size, measured, expected = bench(
+                filter_class,
+                num_elements,
+                args.false_positive_rate,
+                args.num_queries,
+                batch,
+            )
+            print(
+                f"{num_elements:>10} {name:<14}{insert:>9.2f}{lookup:>10.2f}"
+                f"{size / 1024:>10.1f}{measured:>9.4f}{expected:>10.4f}"
+            )
@@ -0,0 +1,152 @@
+import argparse
+import csv
+import os
+import random
+import time
+
+import numpy as np
+
+from near_dedup.lsh.lsh import LSHBase
+
+# Compare classic MinHash against one-permutation hashing (OPH) on the bundled datasets.
+# Accuracy is the mean absolute error of the signature-agreement estimate against the
+# exact shingle Jaccard similarity; speed is the signature time per document. Random
+# document pairs are almost all dissimilar, so evaluation pairs are stratified by exact
+# Jaccard and the reported error is the mean over the strata that have pairs.
+
+# Upper edges of the exact-Jaccard strata.
+STRATA = (0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+def load_documents(file_path):
+    """Load the document column of a TSV dataset."""
+    with open(file_path, "r") as file:
+        return [row[-1].strip() for row in csv.reader(file, delimiter="\t") if row]
+
+
+def estimate_similarity(sig1, sig2):
+    """Fraction of signature rows on which two minhash signatures agree."""
+    return sum(a == b for a, b in zip(sig1, sig2)) / len(sig1)
+
+
+def jaccard(set1, set2):
+    """Exact Jaccard similarity of two shingle sets."""
+    return len(set1 & set2) / max(1, len(set1 | set2))
+
+
+def stratum(similarity):
+    """Index of the exact-Jaccard stratum a similarity falls in."""
+    return next(i for i, edge in enumerate(STRATA) if similarity <= edge)
+
+
+def candidate_pool(shingle_sets, num_hashes, shingle_size, num_pairs, rng):
+    """
+    Pairs to stratify: LSH candidates for the similar strata plus random pairs.
+
+    A loose OPH index with two rows per band surfaces most pairs above Jaccard ~0.3,
+    which random sampling would almost never draw.
+    """
+    index = LSHBase(num_hashes // 2, 2, num_hashes, shingle_size, minhash_method="oph")
+    for doc_id, shingles in enumerate(shingle_sets):
+        index.add_signature(doc_id, index.minhash(shingles))
+    pool = set(index.find_candidates())
+    num_docs = len(shingle_sets)
+    for _ in range(min(num_pairs * len(STRATA), num_docs * (num_docs - 1) // 2)):
+        i, j = sorted(rng.sample(range(num_docs), 2))
+        pool.add((i, j))
+    return sorted(pool)
+
+
+def sample_pairs(shingle_sets, num_hashes, shingle_size, num_pairs, seed=0):
+    """
+    Sample up to `num_pairs` pairs spread evenly over the exact-Jaccard strata.
+
+    Returns:
+        list: One list of (i, j, exact Jaccard) tuples per stratum.
+    """
+    rng = random.Random(seed)
+    strata = [[] for _ in STRATA]
+    if len(shingle_sets) < 2:
+        return strata
+    for i, j in candidate_pool(shingle_sets, num_hashes, shingle_size, num_pairs, rng):
+        similarity = jaccard(shingle_sets[i], shingle_sets[j])
+        strata[stratum(similarity)].append((i, j, similarity))
+    per_stratum = max(1, num_pairs // len(STRATA))
+    return [rng.sample(pairs, min(per_stratum, len(pairs))) for pairs in strata]
+
+
+def mean_error(signatures, pairs):
+    """Mean absolute agreement-estimate error over (i, j, exact) pairs, or None."""
+    if not pairs:
+        return None
+    return float(
+        np.mean(
+            [
+                abs(estimate_similarity(signatures[i], signatures[j]) - exact)
+                for i, j, exact in pairs
+            ]
+        )
+    )
+
+
+def compare(documents, num_hashes, shingle_size, num_pairs, seed=0):
+    """
+    Compare signature time and accuracy of both minhash methods on a document list.
+
+    Returns:
+        dict: {method: (seconds per document, mean of the per-stratum MAEs,
+        per-stratum MAEs with None for empty strata)}.
+    """
+    lsh = LSHBase(1, 1, num_hashes, shingle_size)
+    shingle_sets = [lsh.shingle_document(doc) for doc in documents]
+    strata = sample_pairs(shingle_sets, num_hashes, shingle_size, num_pairs, seed)
+
+    results = {}
+    for method in ("classic", "oph"):
+        lsh.minhash_method = method
+        start = time.perf_counter()
+        signatures = [lsh.minhash(shingles) for shingles in shingle_sets]
+        elapsed = (time.perf_counter() - start) / max(1, len(documents))
+        errors = [mean_error(signatures, pairs) for pairs in strata]
+        filled = [error for error in errors if error is not None]
+        mae = float(np.mean(filled)) if filled else float("nan")
+        results[method] = (elapsed, mae, errors)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Accuracy-vs-speed comparison of classic MinHash and OPH."
+    )
+    parser.add_argument(
+        "datasets",
+        nargs="*",
+        default=["data/hundred.tsv", "data/threehundred.tsv", "data/onek.tsv"],
+    )
+    parser.add_argument("--num_hashes", type=int, default=100)
+    parser.add_argument("--shingle_size", type=int, default=5)
+    parser.add_argument("--num_pairs", type=int, default=500)
+    args = parser.parse_args()
+
+    edges = [f"<={edge:.1f}" for edge in STRATA]
+    print(
+        f"{'dataset':<24}{'method':<10}{'ms/doc':>10}{'MAE':>10}{'speedup':>10}"
+        + "".join(f"{edge:>8}" for edge in edges)
+    )
+    for dataset in args.datasets:
+        if not os.path.exists(dataset):
+            print(f"{dataset:<24}missing")
+            continue
+        results = compare(
+            load_documents(dataset), args.num_hashes, args.shingle_size, args.num_pairs
+        )
+        baseline = results["classic"][0]
+        for method, (elapsed, mae, errors) in results.items():
+            print(
+                f"{os.path.basename(dataset):<24}{method:<10}"
+                f"{elapsed * 1000:>10.3f}{mae:>10.4f}{baseline / elapsed:>9.1f}x"
+                + "".join(
+                    f"{'-':>8}" if error is None else f"{error:>8.4f}"
+                    for error in errors
+                )
+            )
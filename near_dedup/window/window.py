@@ -0,0 +1,203 @@
+import logging
+import time
+from collections import defaultdict, deque
+from typing import List, Optional
+
+import numpy as np
+
+from near_dedup.baselines.baselines import compute_md5
+from near_dedup.bloom_filter.bloom_filter import BlockedBloomFilter
+from near_dedup.lsh.lsh import LSHBase
+from near_dedup.signatures.signatures import SignatureStore
+
+logger = logging.getLogger(__name__)
+
+
+class Generation:
+    """
+    One generation of a sliding window: the documents added during one rotation period.
+
+    Holds an exact-duplicate filter, band tables and 32-bit signatures for its documents
+    only, all sized for `capacity` documents, so dropping a generation drops exactly the
+    state of the documents that left the window.
+    """
+
+    def __init__(
+        self,
+        number: int,
+        capacity: int,
+        num_hashes: int,
+        false_positive_rate: float,
+        started: float,
+    ):
+        """
+        Initialize an empty generation.
+
+        Parameters:
+            number (int): Sequence number of the generation.
+            capacity (int): Expected number of documents per generation.
+            num_hashes (int): Number of minhash values per signature.
+            false_positive_rate (float): False positive rate of the exact-duplicate filter.
+            started (float): Timestamp of the generation's first document.
+        """
+        self.number = number
+        self.started = started
+        self.exact = BlockedBloomFilter(capacity, false_positive_rate)
+        self.buckets = defaultdict(list)
+        self.signatures = SignatureStore(num_hashes, bits=32, capacity=capacity)
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+
+class SlidingWindowDeduplicator:
+    """
+    Streaming near-duplicate detection over a sliding window of recent documents.
+
+    The window is a ring of `num_generations` generations. New documents go to the
+    newest generation; once it holds `generation_size` documents (or, with
+    `generation_seconds`, once it is that old) a fresh generation is started and the
+    oldest one is dropped whole. Expiry therefore costs O(1) work regardless of how
+    many documents expire, and memory is bounded by the window size for an unbounded
+    stream. A document is compared against every generation still in the window, so
+    duplicates are detected if the earlier copy arrived within the last
+    `num_generations - 1` full generations (plus the current, partial one).
+    """
+
+    def __init__(
+        self,
+        lsh_params=(10, 5, 100),
+        num_generations: int = 4,
+        generation_size: int = 10000,
+        generation_seconds: Optional[float] = None,
+        threshold: float = 0.7,
+        false_positive_rate: float = 0.01,
+    ):
+        """
+        Initialize the sliding-window deduplicator.
+
+        Parameters:
+            lsh_params (tuple): Parameters for initializing LSH (num_bands, rows_per_band,
+                num_hashes[, shingle_size, minhash_method]).
+            num_generations (int): Number of generations in the window.
+            generation_size (int): Documents per generation; with `generation_seconds`,
+                the expected number, used to size the generation's structures.
+            generation_seconds (float): If set, rotate generations by age instead of by
+                document count.
+            threshold (float): Smallest estimated Jaccard similarity of a near-duplicate.
+            false_positive_rate (float): False positive rate of each exact-duplicate filter.
+        """
+        if num_generations < 1 or generation_size < 1:
+            raise ValueError("num_generations and generation_size must be positive.")
+        self.lsh = LSHBase(*lsh_params)
+        self.lsh.features.max_entries = 0  # The window is the only per-document state
+        self.num_generations = num_generations
+        self.generation_size = generation_size
+        self.generation_seconds = generation_seconds
+        self.threshold = threshold
+        self.false_positive_rate = false_positive_rate
+        self.generations = deque(maxlen=num_generations)
+        self.next_id = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        """Number of documents in the window."""
+        return sum(len(generation) for generation in self.generations)
+
+    def new_generation(self, timestamp: float):
+        """Start a generation; the deque drops the oldest one once the ring is full."""
+        number = self.generations[-1].number + 1 if self.generations else 0
+        if len(self.generations) == self.num_generations:
+            self.expired += len(self.generations[0])
+            logger.debug(f"Expired generation {self.generations[0].number}.")
+        self.generations.append(
+            Generation(
+                number,
+                self.generation_size,
+                self.lsh.num_hashes,
+                self.false_positive_rate,
+                timestamp,
+            )
+        )
+
+    def rotate(self, timestamp: float):
+        """Start new generations as needed before adding a document at `timestamp`."""
+        if not self.generations:
+            self.new_generation(timestamp)
+            return
+        current = self.generations[-1]
+        if self.generation_seconds is None:
+            if len(current) >= self.generation_size:
+                self.new_generation(timestamp)
+            return
+        elapsed = int((timestamp - current.started) // self.generation_seconds)
+        # After a long gap every generation has aged out; only the last rotations matter
+        first = max(1, elapsed - self.num_generations + 1)
+        for step in range(first, elapsed + 1):
+            self.new_generation(current.started + step * self.generation_seconds)
+
+    def matches(self, signature, band_hashes: List[int]) -> List[dict]:
+        """Documents in the window whose estimated similarity reaches the threshold."""
+        found = []
+        for generation in self.generations:
+            candidates = set()
+            for band_hash in band_hashes:
+                candidates.update(generation.buckets.get(band_hash, ()))
+            if not candidates:
+                continue
+            store = generation.signatures
+            candidates = sorted(candidates)
+            rows = store.values[[store.rows[doc_id] for doc_id in candidates]]
+            similarities = store.estimate_jaccard(
+                store.agreement(rows, store.compress(signature))
+            )
+            found.extend(
+                {"id": doc_id, "similarity": round(float(similarity), 4)}
+                for doc_id, similarity in zip(candidates, similarities)
+                if similarity >= self.threshold
+            )
+        return sorted(found, key=lambda match: (-match["similarity"], match["id"]))
+
+    def add(self, doc: str, timestamp: Optional[float] = None) -> dict:
+        """
+        Check a document against the window, then add it to the newest generation.
+
+        Parameters:
+            doc (str): Document text, normalized the same way as earlier documents.
+            timestamp (float): Arrival time, for time-based rotation; defaults to now.
+
+        Returns:
+            dict: The document's "id", whether it is a "duplicate", whether an "exact" copy
+                may be in the window (per the generation filters), and its near-duplicate
+                "matches" with their estimated similarities.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.rotate(timestamp)
+        md5_hash = compute_md5(doc)
+        exact = any(
+            generation.exact.contains(md5_hash) for generation in self.generations
+        )
+        features = self.lsh.document_features(doc)
+        matches = self.matches(features.signature, features.band_hashes)
+
+        doc_id = self.next_id
+        self.next_id += 1
+        generation = self.generations[-1]
+        generation.exact.add(md5_hash)
+        for band_hash in features.band_hashes:
+            generation.buckets[band_hash].append(doc_id)
+        generation.signatures.add(doc_id, features.signature)
+        return {
+            "id": doc_id,
+            "duplicate": exact or bool(matches),
+            "exact": exact,
+            "matches": matches,
+        }
+
+    def window_ids(self) -> np.ndarray:
+        """IDs of the documents currently in the window, oldest first."""
+        ids = [generation.signatures.doc_ids for generation in self.generations]
+        return np.array(
+            [doc_id for doc_ids in ids for doc_id in doc_ids], dtype=np.int64
+        )
@@ -2,11 +2,53 @@
 """Tests for `near_dedup` package."""
 
 import pytest
-from near_dedup.bloom_filter.bloom_filter import BloomFilter
+from near_dedup.bloom_filter.bloom_filter import (
+    BlockedBloomFilter,
+    BloomFilter,
+    CountMinSketch,
+    CountingBloomFilter,
+    CuckooFilter,
+    HyperLogLog,
+    estimate_distinct,
+)
 from near_dedup.baselines.baselines import find_exact_duplicates
 from near_dedup.lsh.lsh import LSH, LSHImproved
+from near_dedup.lsh.forest import LSHForest
+from near_dedup.lsh.segments import SegmentedIndex
+from near_dedup.lsh.simhash import SimHashIndex, hamming_distance
+from near_dedup.signatures.shared import SharedIndex
+from near_dedup.signatures.signatures import SignatureStore, compute_band_keys
+from near_dedup.deduplicator.deduplicator import DocumentDeduplicator
+from near_dedup.cache.cache import QueryCache, SignatureCache
+from near_dedup.features.features import DEFAULT_MAX_ENTRIES, fingerprint
+from near_dedup.service.service import (
+    DedupClient,
+    DedupService,
+    ServiceClosed,
+    ServiceOverloaded,
+)
+from near_dedup.checkpoint.checkpoint import CheckpointManager, index_documents
+from near_dedup.memory.memory import estimate_footprint, plan_memory
+from near_dedup.output.output import ClusterWriter, open_writer
+from near_dedup.pipeline.pipeline import IngestPipeline
+from near_dedup.sweep.sweep import ParameterSweep, cluster_labels, pair_precision_recall
+from near_dedup.window.window import SlidingWindowDeduplicator
+from near_dedup.utils.compare_minhash import STRATA, sample_pairs
+from unittest import mock
+import numpy as np
+import asyncio
 import csv
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
 import io
+import pickle
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
 
 # Sample documents to test with LSH
 sample_docs = [
@@ -144,6 +186,34 @@ def load_documents_from_tsv(tsv_string):
 sample_docs = load_documents_from_tsv(sample_tsv_data)
 
 
+def near_duplicate_docs(
+    seed, families, length, variants=2, trim=1, edits=0, vocabulary=5000
+):
+    """
+    Build families of near-duplicate documents over a random vocabulary.
+
+    Every family is a random base document of `length` words followed by `variants - 1`
+    variants: variant k drops its last `k * trim` words, then has `edits` words replaced.
+    """
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    docs = []
+    for _ in range(families):
+        base = rng.choices(words, k=length)
+        docs.append(" ".join(base))
+        for k in range(1, variants):
+            variant = base[: length - k * trim]
+            for _ in range(edits):
+                variant[rng.randrange(len(variant))] = rng.choice(words)
+            docs.append(" ".join(variant))
+    return docs
+
+
+def cluster_sets(clusters):
+    """Clusters as a sorted list of sorted members, for order-independent comparison."""
+    return sorted(sorted(members) for members in clusters.values())
+
+
 def test_lsh_with_union_find():
     """Test LSH with Union-Find for clustering similar documents."""
     lsh_union_find = LSH(num_bands=10, rows_per_band=5, num_hashes=100)
@@ -184,5 +254,1093 @@ def test_improved_lsh_multi_probe():
         assert pair in result_pairs, f"Expected pair {pair} to be in {result_pairs}"
 
 
+def test_simhash_index_clusters_near_duplicates():
+    """Test SimHash clustering of near-duplicate documents by Hamming distance."""
+    base = " ".join(
+        f"word{n} appears in sentence {n * 7 % 13} of the long document"
+        for n in range(40)
+    )
+    docs = [base, base + " today", base[::-1]]
+    index = SimHashIndex(max_distance=3)
+    for idx, doc in enumerate(docs):
+        index.add_document(idx, doc)
+
+    assert index.fingerprints.dtype == np.uint64
+    clusters = index.cluster_candidates()
+    assert any({0, 1} <= set(cluster) for cluster in clusters.values())
+    assert all(2 not in cluster for cluster in clusters.values())
+    assert index.query(base) == [0, 1]
+
+
+def test_simhash_permutation_tables_find_all_within_distance():
+    """Test that permutation-table lookups match a brute-force Hamming scan."""
+    rng = np.random.default_rng(0)
+    base = int(rng.integers(0, 2**63, dtype=np.uint64))
+    index = SimHashIndex(max_distance=4, num_blocks=6)
+    fingerprints = []
+    for idx in range(200):
+        flips = rng.choice(64, size=int(rng.integers(0, 9)), replace=False)
+        fingerprint = base
+        for bit in flips:
+            fingerprint ^= 1 << int(bit)
+        fingerprints.append(fingerprint)
+        index.add_fingerprint(idx, fingerprint)
+
+    distances = hamming_distance(np.array(fingerprints, dtype=np.uint64), base)
+    expected = sorted(np.flatnonzero(distances <= 4).tolist())
+    assert index.query_fingerprint(base) == expected
+
+
+def test_one_permutation_minhash_estimates_jaccard():
+    """Test that OPH signatures are densified and agree at roughly the Jaccard rate."""
+    lsh = LSH(num_bands=10, rows_per_band=5, num_hashes=64, minhash_method="oph")
+    shingles1 = {f"shingle{i}" for i in range(400)}
+    shingles2 = {f"shingle{i}" for i in range(100, 500)}
+    sig1, sig2 = lsh.minhash(shingles1), lsh.minhash(shingles2)
+
+    assert len(sig1) == 64
+    assert all(value != float("inf") for value in lsh.minhash({"only"}))
+    agreement = sum(a == b for a, b in zip(sig1, sig2)) / len(sig1)
+    assert abs(agreement - 300 / 500) < 0.2
+    assert len(lsh.banding(sig1)) == 10
+
+
+def test_improved_lsh_with_one_permutation_minhash():
+    """Test that OPH signatures plug into the multi-probe LSH pipeline."""
+    improved_lsh = LSHImproved(
+        num_bands=10, rows_per_band=5, num_hashes=100, minhash_method="oph"
+    )
+    for idx, doc in enumerate(sample_docs):
+        improved_lsh.add_document(idx, doc)
+    assert (0, 1) in set(improved_lsh.find_candidates())
+
+
+def test_minhash_comparison_pairs_cover_every_similarity_stratum():
+    """Test that the comparison samples similar pairs, not only random dissimilar ones."""
+    rng = random.Random(1)
+    shingle_sets = []
+    for cluster in range(20):
+        base = [f"c{cluster}s{i}" for i in range(100)]
+        for edits in range(0, 100, 20):
+            noise = [f"x{rng.random()}" for _ in range(edits)]
+            shingle_sets.append(set(base[edits:] + noise))
+    strata = sample_pairs(shingle_sets, 100, 5, num_pairs=50)
+
+    assert len(strata) == len(STRATA)
+    assert all(len(pairs) == 10 for pairs in strata)
+    for pairs, upper in zip(strata, STRATA):
+        assert all(upper - 0.2 <= exact <= upper for _, _, exact in pairs)
+
+
+@pytest.mark.parametrize("bits", [1, 4, 32])
+def test_signature_store_bias_corrected_estimate(bits):
+    """Test that compressed signatures estimate Jaccard similarity close to the full signatures."""
+    lsh = LSH(num_bands=10, rows_per_band=5, num_hashes=200)
+    shingles1 = {f"shingle{i}" for i in range(300)}
+    shingles2 = {f"shingle{i}" for i in range(100, 400)}
+    store = SignatureStore(num_hashes=200, bits=bits)
+    store.add(1, lsh.minhash(shingles1))
+    store.add(2, lsh.minhash(shingles2))
+
+    assert abs(store.similarity(1, 2) - 0.5) < 0.15
+    assert store.similarity(1, 1) == 1.0
+    assert store.nbytes <= 2 * 200 * 4
+
+
+def test_deduplicator_search_with_compressed_signatures():
+    """Test nearest neighbor search over a b-bit signature index."""
+    deduplicator = DocumentDeduplicator(signature_bits=8)
+    index = deduplicator.build_index(sample_docs)
+
+    assert isinstance(index, SignatureStore)
+    clusters = deduplicator.nearest_neighbor_search(sample_docs[0], threshold=0.9)
+    assert any(0 in cluster for cluster in clusters.values())
+
+
+def test_dedup_service_add_check_search_over_socket():
+    """Test the micro-batching service end to end with a local TCP client."""
+
+    async def scenario():
+        service = DedupService(max_batch_delay=0.01)
+        await service.start(port=0)
+        host, port = service.address[:2]
+        clients = [await DedupClient.connect(host, port) for _ in sample_docs]
+        added = await asyncio.gather(
+            *(
+                client.request("add", doc, id=idx)
+                for idx, (client, doc) in enumerate(zip(clients, sample_docs))
+            )
+        )
+        check = await clients[0].request("check", sample_docs[0].upper())
+        search = await clients[1].request("search", sample_docs[0], threshold=0.9)
+        bad = await clients[2].request("delete", sample_docs[0])
+        for client in clients:
+            await client.close()
+        await service.close()
+        return service, added, check, search, bad
+
+    service, added, check, search, bad = asyncio.run(scenario())
+    assert [response["id"] for response in added] == list(range(len(sample_docs)))
+    assert service.batches < len(sample_docs)
+    assert check["duplicate"] is True and check["exact"] == 0
+    assert search["matches"][0] == {"id": 0, "similarity": 1.0}
+    assert bad == {"ok": False, "error": "bad_request", "detail": bad["detail"]}
+
+
+def test_dedup_service_rejects_requests_when_queue_is_full():
+    """Test that the service sheds load once the bounded queue is full."""
+
+    async def scenario():
+        service = DedupService(max_batch_size=1, max_queue_size=2)
+        await service.start(port=0)
+        results = await asyncio.gather(
+            *(service.submit({"op": "add", "text": doc}) for doc in sample_docs),
+            return_exceptions=True,
+        )
+        await service.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert sum(isinstance(result, ServiceOverloaded) for result in results) == 4
+    assert sum(isinstance(result, dict) for result in results) == 2
+
+
+def test_dedup_service_close_answers_pending_requests_and_rejects_duplicate_ids():
+    """Test that closing drains in-flight batches and that client ids must be unique."""
+
+    async def scenario():
+        service = DedupService(lsh_params=(5, 4, 20), max_batch_size=2)
+        await service.start(port=0)
+        first = await service.submit({"op": "add", "text": sample_docs[0], "id": 7})
+        with pytest.raises(ValueError):
+            await service.submit({"op": "add", "text": sample_docs[1], "id": 7})
+        pending = [
+            asyncio.ensure_future(service.submit({"op": "add", "text": doc}))
+            for doc in sample_docs
+        ]
+        await asyncio.sleep(0)
+        await service.close()
+        with pytest.raises(ServiceClosed):
+            await service.submit({"op": "check", "text": sample_docs[0]})
+        return first, await asyncio.gather(*pending)
+
+    first, responses = asyncio.run(scenario())
+    assert first["id"] == 7
+    assert [response["id"] for response in responses] == list(
+        range(8, 8 + len(sample_docs))
+    )
+
+
+def test_query_cache_lru_eviction_by_bytes():
+    """Test that the query cache evicts least recently used entries to fit its byte budget."""
+    cache = QueryCache(max_bytes=3000)
+    for key in range(3):
+        cache.put("signature", key, list(range(20)))
+    assert cache.get("signature", 0) is not None  # 0 becomes most recently used
+    cache.put("signature", 3, list(range(20)))
+
+    assert cache.current_bytes <= 3000
+    assert cache.get("signature", 1) is None
+    assert cache.get("signature", 0) is not None
+    assert cache.stats()["evictions"] >= 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_nearest_neighbor_search_uses_and_invalidates_cache():
+    """Test that repeated queries hit the cache and rebuilding the index invalidates results."""
+    deduplicator = DocumentDeduplicator(query_cache_bytes=1 << 20)
+    deduplicator.build_index(sample_docs)
+    first = deduplicator.nearest_neighbor_search(sample_docs[0])
+    # Same normalized document, different punctuation and case
+    second = deduplicator.nearest_neighbor_search(sample_docs[0].upper() + "!")
+    assert dict(first) == dict(second)
+    assert deduplicator.query_cache.hits == 1
+
+    deduplicator.build_index(sample_docs[:3])
+    deduplicator.nearest_neighbor_search(sample_docs[0])
+    stats = deduplicator.query_cache.stats()
+    assert stats["invalidations"] == 2
+    assert stats["hits"] == 2  # result was recomputed, signature was reused
+
+
+def test_cached_nearest_neighbor_search_matches_uncached_calls():
+    """Test that cached answers equal uncached ones after other queries ran."""
+    cached = DocumentDeduplicator(lsh_params=(5, 4, 20), query_cache_bytes=1 << 20)
+    uncached = DocumentDeduplicator(lsh_params=(5, 4, 20))
+    for deduplicator in (cached, uncached):
+        deduplicator.build_index(sample_docs)
+    for query in (sample_docs[2], sample_docs[0], sample_docs[4], sample_docs[2]):
+        expected = uncached.nearest_neighbor_search(query, threshold=0.3)
+        assert dict(cached.nearest_neighbor_search(query, threshold=0.3)) == dict(expected)
+    assert cached.query_cache.hits == 1
+
+
+def test_query_directed_multi_probe_improves_recall_without_extra_buckets():
+    """Test that probing raises recall while each band is still inserted once."""
+    docs = near_duplicate_docs(3, families=60, length=60, trim=0, edits=16)
+    recalls = []
+    for probes in (0, 3):
+        improved_lsh = LSHImproved(
+            num_bands=10,
+            rows_per_band=5,
+            num_hashes=50,
+            probes=probes,
+            minhash_method="oph",
+        )
+        for idx, doc in enumerate(docs):
+            improved_lsh.add_document(idx, doc)
+        assert sum(map(len, improved_lsh.buckets.values())) == 10 * len(docs)
+        pairs = set(improved_lsh.find_candidates())
+        recalls.append(sum((2 * i, 2 * i + 1) in pairs for i in range(60)) / 60)
+        assert set(improved_lsh.query(docs[0])) >= {0}
+
+    assert recalls[1] > recalls[0]
+
+
+def test_lsh_forest_matches_lsh_at_full_depth_and_relaxes_with_threshold():
+    """Test that one LSH Forest serves the banded LSH result and looser thresholds."""
+    docs = near_duplicate_docs(5, families=30, length=60, trim=0, edits=10)
+    forest = LSHForest(num_trees=10, max_depth=5, minhash_method="oph")
+    lsh = LSH(num_bands=10, rows_per_band=5, num_hashes=50, minhash_method="oph")
+    for idx, doc in enumerate(docs):
+        forest.add_document(idx, doc)
+        lsh.add_document(idx, doc)
+    expected = cluster_sets(lsh.cluster_candidates())
+    assert cluster_sets(forest.cluster_candidates()) == expected
+    assert forest.depth_for_threshold(0.3) < forest.depth_for_threshold(0.8)
+    assert len(forest.find_candidates(threshold=0.3)) >= len(forest.find_candidates())
+    assert forest.query(docs[0], k=2)[0] == 0
+    assert 0 in forest.query(docs[0], threshold=0.8)
+    assert len(forest.features) == 0
+    for depth in (0, forest.max_depth + 1):
+        with pytest.raises(ValueError):
+            forest.query(docs[0], depth=depth)
+    assert forest.nbytes == len(docs) * (10 * (forest.key_width + 8) + 8)
+
+
+@pytest.mark.parametrize("policy", ["cap", "sample", "split"])
+def test_heavy_buckets_are_bounded_and_reported(policy):
+    """Test that boilerplate-heavy buckets stay within max_bucket_size under every policy."""
+    boilerplate = "This site uses cookies to improve your experience. "
+    lsh = LSH(
+        num_bands=10,
+        rows_per_band=2,
+        num_hashes=40,
+        minhash_method="oph",
+        max_bucket_size=5,
+        heavy_bucket_policy=policy,
+    )
+    for idx in range(40):
+        lsh.add_document(idx, boilerplate * 5 + f"article number {idx} " * (idx % 3))
+
+    assert max(len(bucket) for bucket in lsh.buckets.values()) <= 5
+    assert lsh.bucket_stats["heavy_buckets"] > 0
+    dropped = lsh.bucket_stats["capped"] + lsh.bucket_stats["sampled_out"]
+    if policy == "split":
+        assert lsh.bucket_stats["split_buckets"] > 0
+    else:
+        assert dropped > 0
+    assert lsh.query(boilerplate * 5)
+
+
+def test_split_policy_partitions_heavy_buckets_when_every_row_is_banded():
+    """Test that split sub-buckets differ when num_hashes == num_bands * rows_per_band."""
+    lsh = LSH(10, 10, 100, max_bucket_size=5, heavy_bucket_policy="split")
+    rng = random.Random(0)
+    shared = [rng.randrange(1 << 32) for _ in range(100)]
+    for idx in range(20):
+        signature = [rng.randrange(1 << 32) for _ in range(100)]
+        signature[30:40] = shared[30:40]  # Only band 3 is shared
+        lsh.add_signature(idx, signature)
+
+    assert lsh.bucket_stats["split_buckets"] == 1
+    assert lsh.bucket_stats["capped"] == 0
+    assert max(len(bucket) for bucket in lsh.buckets.values()) <= 5
+    with pytest.raises(ValueError):
+        LSH(1, 20, 20, heavy_bucket_policy="split")
+
+
+def test_count_min_sketch_estimates_merges_and_serializes():
+    """Test Count-Min Sketch estimates, merging across workers and round-tripping bytes."""
+    worker1, worker2 = CountMinSketch(0.01, 0.01), CountMinSketch(0.01, 0.01)
+    for i in range(200):
+        worker1.add(f"item{i % 20}")
+        worker2.add(f"item{i % 10}")
+    worker1.merge(worker2)
+
+    assert worker1.estimate("item3") >= 30
+    assert worker1.estimate("item15") >= 10
+    assert worker1.estimate("item15") <= 10 + 0.01 * worker1.total
+    restored = CountMinSketch.from_bytes(worker1.to_bytes())
+    assert restored.estimate("item3") == worker1.estimate("item3")
+    with pytest.raises(ValueError):
+        worker1.merge(CountMinSketch(0.1, 0.01))
+
+
+def test_stop_shingle_filter_drops_frequent_shingles():
+    """Test that shingles above the document-frequency cutoff are dropped before MinHash."""
+    docs = [f"cookie banner text. document {i} body" for i in range(20)]
+    lsh = LSH(num_bands=10, rows_per_band=5, num_hashes=50)
+    lsh.set_stop_shingle_filter(lsh.document_frequency_sketch(docs), max_df=5)
+
+    shingles = lsh.shingle_document(docs[0])
+    assert "cooki" not in shingles
+    assert "ent 0" in shingles
+    assert lsh.stop_shingles_dropped > 0
+
+
+def test_out_of_core_clustering_matches_in_memory(tmp_path):
+    """Test that external-sort band grouping reproduces the in-memory clusters."""
+    docs = near_duplicate_docs(7, families=25, length=40, variants=3, vocabulary=2000)
+    in_memory = LSH(num_bands=10, rows_per_band=3, num_hashes=30, minhash_method="oph")
+    external = LSH(
+        num_bands=10,
+        rows_per_band=3,
+        num_hashes=30,
+        minhash_method="oph",
+        memory_budget=48 * 50,  # 50 records per run
+        spill_dir=str(tmp_path),
+    )
+    for idx, doc in enumerate(docs):
+        in_memory.add_document(idx, doc)
+        external.add_document(idx, doc)
+
+    expected = cluster_sets(in_memory.cluster_candidates())
+    assert cluster_sets(external.cluster_candidates()) == expected
+    assert len(external.external.runs) > 1
+    external.external.close()
+    assert not list(tmp_path.iterdir())
+
+
+def test_checkpoint_resume_matches_uninterrupted_run(tmp_path):
+    """Test that resuming from checkpoints (including a corrupt one) reproduces the full run."""
+    docs = sample_docs * 3 + [""]
+    params = {"num_hashes": 20}
+    full = LSH(num_bands=5, rows_per_band=4, num_hashes=20)
+    for idx, doc in enumerate(docs):
+        full.add_document(idx, doc)
+
+    manager = CheckpointManager(str(tmp_path), params)
+    manager.reset()
+    index_documents(LSH(5, 4, 20), docs[:12], manager, checkpoint_every=4)
+    assert [s["end"] for s in manager.segments] == [4, 8, 12]
+    with open(tmp_path / manager.segments[-1]["file"], "r+b") as file:
+        file.write(b"corrupt")
+
+    resumed = LSH(5, 4, 20)
+    manager = CheckpointManager(str(tmp_path), params)
+    assert manager.load() == 8
+    assert index_documents(resumed, docs, manager, checkpoint_every=4) == 8
+    assert manager.offset == len(docs)
+    assert resumed.cluster_candidates() == full.cluster_candidates()
+
+    with pytest.raises(ValueError):
+        CheckpointManager(str(tmp_path), {"num_hashes": 30}).load()
+
+
+def test_checkpoint_resume_restores_multi_probe_keys(tmp_path):
+    """Test that a resumed LSHImproved run probes restored documents like a full run."""
+    docs = sample_docs * 2 + ["", "x"]
+    full = LSHImproved(5, 4, 20, probes=2, minhash_method="oph")
+    for idx, doc in enumerate(docs):
+        full.add_document(idx, doc)
+
+    manager = CheckpointManager(str(tmp_path), {})
+    manager.reset()
+    first = LSHImproved(5, 4, 20, probes=2, minhash_method="oph")
+    index_documents(first, docs, manager, checkpoint_every=5)
+    resumed = LSHImproved(5, 4, 20, probes=2, minhash_method="oph")
+    manager = CheckpointManager(str(tmp_path), {})
+    manager.load()
+    assert index_documents(resumed, docs, manager) == len(docs)
+    assert resumed.probe_keys == full.probe_keys
+    assert sorted(resumed.find_candidates()) == sorted(full.find_candidates())
+
+
+def test_signature_cache_reuses_signatures_across_runs(tmp_path):
+    """Test that a re-run only hashes new content and that parameter changes miss the cache."""
+    path = str(tmp_path / "signatures.db")
+    first = LSH(num_bands=5, rows_per_band=4, num_hashes=20, minhash_method="oph")
+    first.set_signature_cache(SignatureCache(path))
+    for idx, doc in enumerate(sample_docs + [""]):
+        first.add_document(idx, doc)
+    first.signature_cache.close()
+
+    cache = SignatureCache(path)
+    second = LSH(num_bands=5, rows_per_band=4, num_hashes=20, minhash_method="oph")
+    second.set_signature_cache(cache)
+    for idx, doc in enumerate(sample_docs + ["", "a brand new document"]):
+        second.add_document(idx, doc)
+    assert (cache.hits, cache.misses) == (len(sample_docs) + 1, 1)
+    assert second.document_signature("") == [float("inf")] * 20
+    assert second.document_signature(sample_docs[1]) == first.minhash(
+        first.shingle_document(sample_docs[1])
+    )
+
+    improved = LSHImproved(num_bands=5, rows_per_band=4, num_hashes=20)
+    improved.set_signature_cache(cache)
+    improved.add_document(0, sample_docs[0])
+    assert cache.misses == 2  # Runner-up values are cached separately
+    assert improved.document_signature_with_runner_up(sample_docs[0]) == (
+        improved.minhash_with_runner_up(improved.shingle_document(sample_docs[0]))
+    )
+
+
+def test_signature_cache_evicts_least_recently_used(tmp_path):
+    """Test that the on-disk cache stays within its byte bound."""
+    cache = SignatureCache(str(tmp_path / "signatures.db"), max_bytes=3 * 163)
+    params = {"num_hashes": 10}
+    for doc in ["a", "b", "c"]:
+        cache.put(cache.key(doc, params), list(range(10)))
+    cache.get(cache.key("a", params))
+    cache.put(cache.key("d", params), [2**127] * 10)
+
+    assert cache.evictions == 1
+    assert cache.get(cache.key("b", params)) is None
+    assert cache.get(cache.key("a", params)) == list(range(10))
+    assert cache.get(cache.key("d", params)) == [2**127] * 10
+    assert cache.stats()["bytes"] <= 3 * 163
+
+
+def test_add_document_computes_features_once_per_distinct_text():
+    """Test that identical documents are minhashed once and add_document exposes the signature."""
+    for lsh in (LSH(5, 4, 20), LSHImproved(5, 4, 20)):
+        with mock.patch.object(
+            lsh, "shingle_document", wraps=lsh.shingle_document
+        ) as shingle:
+            docs = sample_docs * 3
+            features = [lsh.add_document(i, doc) for i, doc in enumerate(docs)]
+        assert shingle.call_count == len(sample_docs)
+        assert features[0] is features[len(sample_docs)]
+        assert len(lsh.features) == len(sample_docs)
+        assert (0, len(sample_docs)) in lsh.find_candidates()
+
+
+def test_feature_store_is_bounded_by_default():
+    """Test that the store reuses features of duplicates within its LRU window only."""
+    distinct = [f"document number {idx}" for idx in range(DEFAULT_MAX_ENTRIES)]
+    for max_entries, signings in ((DEFAULT_MAX_ENTRIES, 2), (None, 1)):
+        lsh = LSH(5, 4, 20, 3, "oph")
+        lsh.features.max_entries = max_entries
+        docs = ["repeated"] + distinct[:-1] + ["repeated"] + distinct + ["repeated"]
+        with mock.patch.object(lsh, "minhash", wraps=lsh.minhash) as minhash:
+            for idx, doc in enumerate(docs):
+                lsh.add_document(idx, doc)
+        assert minhash.call_count == len(distinct) + signings
+        assert len(lsh.features) == min(max_entries or len(docs), len(distinct) + 1)
+    assert fingerprint("repeated") in lsh.features
+
+
+def test_deduplicator_reuses_features_between_collection_and_index():
+    """Test that deduplicate_collection and build_index minhash each document once."""
+    deduplicator = DocumentDeduplicator(lsh_params=(5, 4, 20))
+    lsh = deduplicator.lsh
+    with mock.patch.object(lsh, "minhash", wraps=lsh.minhash) as minhash:
+        deduplicator.deduplicate_collection(sample_docs)
+        deduplicator.build_index(sample_docs)
+    assert minhash.call_count == len(sample_docs)
+
+
+def test_cluster_writers_stream_text_npy_and_csv(tmp_path):
+    """Test the text, memory-mappable array and CSV cluster output formats."""
+    clusters = [[4, 2], [0, 5, 1]]
+    similarity = lambda doc_id, cluster_id: 1 / (1 + doc_id - cluster_id)  # noqa: E731
+    for output_format in ("text", "npy", "csv"):
+        path = str(tmp_path / f"clusters.{output_format}")
+        with open_writer(output_format, path, 7, similarity) as writer:
+            writer.write_all(iter(clusters))
+        assert writer.clusters == 2
+
+    assert (tmp_path / "clusters.text").read_text() == "2 4\n0 1 5\n"
+    array = np.load(tmp_path / "clusters.npy", mmap_mode="r")
+    assert array.tolist() == [0, 0, 2, -1, 2, 0, -1]
+    with open(tmp_path / "clusters.csv") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ["doc_id", "cluster_id", "similarity"]
+    assert rows[1:3] == [["2", "2", "1.0"], ["4", "2", "0.3333"]]
+    with pytest.raises(ValueError):
+        open_writer("npy", str(tmp_path / "missing.npy"))
+
+    class IncompleteWriter(ClusterWriter):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteWriter(str(tmp_path / "incomplete.txt"))
+
+
+def test_indexes_keep_signatures_for_similarity_output(tmp_path):
+    """Test that every indexing path fills the signature store, so output signs nothing."""
+    indexes = [
+        LSH(5, 4, 20, minhash_method="oph"),
+        LSH(
+            5, 4, 20, minhash_method="oph", memory_budget=1 << 16, spill_dir=str(tmp_path)
+        ),
+        LSHImproved(5, 4, 20, minhash_method="oph"),
+        LSHForest(num_trees=5, max_depth=4, minhash_method="oph"),
+    ]
+    for lsh in indexes:
+        store = SignatureStore(lsh.num_hashes)
+        lsh.set_signature_store(store)
+        for idx, doc in enumerate(sample_docs):
+            lsh.add_document(idx, doc)
+        with mock.patch.object(lsh, "minhash") as minhash:
+            assert store.similarity(0, 1) > store.similarity(0, 2)
+        assert minhash.call_count == 0 and len(store) == len(sample_docs)
+
+    two_pass = LSH(5, 4, 20, minhash_method="oph")
+    two_pass.set_signature_store(SignatureStore(20))
+    two_pass.add_documents_two_pass(list(range(len(sample_docs))), sample_docs)
+    assert len(two_pass.signature_store) == len(sample_docs)
+
+
+def test_pair_precision_recall_matches_brute_force():
+    """Test contingency-table pair counting against explicit pair enumeration."""
+    rng = np.random.default_rng(3)
+    true_labels = rng.integers(0, 8, size=40)
+    predicted_labels = rng.integers(0, 6, size=40)
+    pairs = [(i, j) for i in range(40) for j in range(i + 1, 40)]
+    true_pairs = {p for p in pairs if true_labels[p[0]] == true_labels[p[1]]}
+    predicted_pairs = {
+        p for p in pairs if predicted_labels[p[0]] == predicted_labels[p[1]]
+    }
+    both = len(true_pairs & predicted_pairs)
+
+    precision, recall = pair_precision_recall(true_labels, predicted_labels)
+    assert precision == pytest.approx(both / len(predicted_pairs))
+    assert recall == pytest.approx(both / len(true_pairs))
+    assert cluster_labels([[3, 1], [4]], 5).tolist() == [0, 1, 2, 1, 4]
+
+
+def test_parameter_sweep_reuses_signatures_across_configs():
+    """Test that a sweep signs once and matches a fresh index for every configuration."""
+    sweep = ParameterSweep(sample_docs * 2, num_hashes=20)
+    with mock.patch.object(sweep.signer, "minhash_with_runner_up") as minhash:
+        reports = sweep.run(
+            [(5, 4, 0), (10, 2, 1), (30, 1, 0)], baseline_clusters=[[0, 6]]
+        )
+    minhash.assert_not_called()
+    assert [(r["num_bands"], r["rows_per_band"]) for r in reports] == [(5, 4), (10, 2)]
+    assert reports[0]["recall"] == 1.0
+    assert reports[0]["peak_bytes"] > 0
+
+    fresh = LSHImproved(10, 2, 20, probes=1)
+    for idx, doc in enumerate(sample_docs * 2):
+        fresh.add_document(idx, doc)
+    assert sweep.run_config(10, 2, 1)["clusters"] == fresh.cluster_candidates()
+
+    tracemalloc.start()
+    try:
+        assert sweep.run_config(5, 4, 0)["peak_bytes"] > 0
+        assert tracemalloc.is_tracing()  # The caller's tracing is left running
+    finally:
+        tracemalloc.stop()
+
+
+def test_ingest_pipeline_matches_sequential_indexing():
+    """Test that the staged pipeline indexes documents in order and reports stage metrics."""
+    docs = sample_docs * 5
+    sequential = LSHImproved(5, 4, 20, probes=1)
+    for idx, doc in enumerate(docs):
+        sequential.add_document(idx, doc)
+
+    pipeline = IngestPipeline(
+        LSHImproved(5, 4, 20, probes=1), workers=2, batch_size=4, queue_size=2
+    )
+    lsh = pipeline.run(iter(docs))
+    assert lsh.cluster_candidates() == sequential.cluster_candidates()
+    metrics = pipeline.metrics()
+    assert [metrics[stage]["documents"] for stage in ("read", "hash", "index")] == [
+        len(docs)
+    ] * 3
+
+
+def test_ingest_pipeline_propagates_reader_errors():
+    """Test that a failing reader shuts the pipeline down and surfaces the error."""
+
+    def failing_documents():
+        yield from sample_docs
+        raise OSError("disk went away")
+
+    pipeline = IngestPipeline(LSH(5, 4, 20), workers=1, batch_size=2)
+    with pytest.raises(OSError, match="disk went away"):
+        pipeline.run(failing_documents())
+    assert pipeline.stop_event.is_set()
+
+
+def query_shared_index(handle, doc):
+    """Attach to a published index in a worker process and query it."""
+    index = SharedIndex.attach(handle)
+    try:
+        doc_ids, similarities = index.search(doc, threshold=0.5)
+        return doc_ids.tolist(), similarities.tolist()
+    finally:
+        index.close()
+
+
+def test_shared_index_serves_queries_from_other_processes(tmp_path):
+    """Test publishing the index through shared memory and a memory-mapped directory."""
+    deduplicator = DocumentDeduplicator(lsh_params=(5, 4, 20))
+    deduplicator.build_index(sample_docs)
+    index = deduplicator.shared_index()
+    query = deduplicator.clean_document(sample_docs[0])
+    expected = index.search(query, threshold=0.5)
+    assert expected[0][0] == 0 and expected[1][0] == 1.0
+    index.save(str(tmp_path / "index"))
+
+    handle = index.publish()
+    try:
+        assert not index.arrays["signatures"].flags.writeable
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(2) as pool:
+            results = pool.starmap(query_shared_index, [(handle, query)] * 2)
+    finally:
+        index.close()
+        index.unlink()
+    assert results == [(expected[0].tolist(), expected[1].tolist())] * 2
+
+    loaded = SharedIndex.load(str(tmp_path / "index"))
+    assert isinstance(loaded.arrays["band_keys"], np.memmap)
+    assert loaded.search(query, threshold=0.5)[0].tolist() == expected[0].tolist()
+
+
+def test_shared_index_survives_an_independent_process_attaching():
+    """Test that a process with its own resource tracker does not unlink the block on exit."""
+    deduplicator = DocumentDeduplicator(lsh_params=(5, 4, 20))
+    deduplicator.build_index(sample_docs)
+    index = deduplicator.shared_index()
+    handle = index.publish()
+    register, original_init = resource_tracker.register, shared_memory.SharedMemory.__init__
+    registers = []
+
+    def recording_init(shm, *args, **kwargs):
+        registers.append(resource_tracker.register)
+        original_init(shm, *args, **kwargs)
+
+    code = (
+        "import pickle, sys; from near_dedup.signatures.shared import SharedIndex; "
+        "SharedIndex.attach(pickle.loads(bytes.fromhex(sys.argv[1]))).close()"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        subprocess.run(
+            [sys.executable, "-c", code, pickle.dumps(handle).hex()],
+            check=True,
+            env=dict(os.environ, PYTHONPATH=root),
+        )
+        time.sleep(0.5)  # The child's resource tracker cleans up just after it exits
+        with mock.patch.object(shared_memory.SharedMemory, "__init__", recording_init):
+            attached = SharedIndex.attach(handle)
+        assert registers == [register]  # Other threads keep registering meanwhile
+        assert len(attached.arrays["doc_ids"]) == len(sample_docs)
+        attached.close()
+    finally:
+        index.close()
+        index.unlink()
+
+
+def test_compute_band_keys_depends_on_band_contents_and_position():
+    """Test that vectorized band keys match equal bands and separate bands by position."""
+    signatures = np.array([[1, 2, 3, 4], [1, 2, 9, 9], [3, 4, 1, 2]], dtype=np.uint32)
+    keys = compute_band_keys(signatures, num_bands=2, rows_per_band=2)
+    assert keys.dtype == np.uint64 and keys.shape == (3, 2)
+    assert keys[0, 0] == keys[1, 0] and keys[0, 1] != keys[1, 1]
+    assert keys[0, 0] != keys[2, 1]  # Same values in a different band
+    with pytest.raises(ValueError):
+        compute_band_keys(signatures, num_bands=3, rows_per_band=2)
+
+
+@pytest.mark.parametrize("lsh_class", [LSH, LSHImproved])
+def test_removal_and_compaction_match_rebuilt_index(lsh_class):
+    """Test that removing documents and compacting gives the clusters of an index built without them."""
+    docs = near_duplicate_docs(3, families=15, length=30, variants=4, vocabulary=500)
+    removed = set(range(1, len(docs), 4))
+
+    def make_index():
+        if lsh_class is LSHImproved:
+            return LSHImproved(
+                num_bands=10, rows_per_band=3, num_hashes=30, probes=2, removable=True
+            )
+        return LSH(num_bands=10, rows_per_band=3, num_hashes=30, removable=True)
+
+    lsh = make_index()
+    lsh.compaction_ratio = 1.0  # Keep tombstones until clustering
+    for idx, doc in enumerate(docs):
+        lsh.add_document(idx, doc)
+    lsh.cluster_candidates()
+    untouched = {key: bucket for key, bucket in lsh.buckets.items() if not removed & set(bucket)}
+    for doc_id in removed:
+        lsh.remove_document(doc_id)
+    assert not removed & set(lsh.query(docs[1]))
+    clusters = lsh.cluster_candidates()
+
+    rebuilt = make_index()
+    for idx, doc in enumerate(docs):
+        if idx not in removed:
+            rebuilt.add_document(idx, doc)
+    assert cluster_sets(clusters) == cluster_sets(rebuilt.cluster_candidates())
+    assert not lsh.tombstones and not removed & set(lsh.doc_bands)
+    assert all(lsh.buckets[key] is bucket for key, bucket in untouched.items())
+    with pytest.raises(KeyError):
+        lsh.remove_document(1)
+
+
+def test_update_document_moves_it_between_clusters():
+    """Test that updating a document's text re-clusters it with its new near-duplicates."""
+    for memory_budget in (None, 1 << 16):
+        lsh = LSH(
+            num_bands=10,
+            rows_per_band=5,
+            num_hashes=50,
+            memory_budget=memory_budget,
+            removable=True,
+        )
+        for idx, doc in enumerate(sample_docs):
+            lsh.add_document(idx, doc)
+        assert any({0, 1} <= set(c) for c in lsh.cluster_candidates().values())
+
+        lsh.update_document(1, "A totally different sentence here")
+        lsh.update_document(1, "A totally different sentence here")
+        clusters = lsh.cluster_candidates()
+        assert any({1, 3} <= set(c) for c in clusters.values())
+        assert not any({0, 1} <= set(c) for c in clusters.values())
+        if memory_budget is None:
+            assert 1 in lsh.query("A totally different sentence here")
+        else:
+            lsh.external.close()
+
+    with pytest.raises(ValueError):
+        LSH(num_bands=10, rows_per_band=5, num_hashes=50).remove_document(0)
+
+
+def test_lsh_forest_removes_and_updates_documents():
+    """Test that forest tombstones match a forest built without the removed documents."""
+    forest, rebuilt = (LSHForest(num_trees=5, max_depth=4) for _ in range(2))
+    for idx, doc in enumerate(sample_docs):
+        forest.add_document(idx, doc)
+    forest.build()
+    forest.add_document(len(sample_docs), sample_docs[0])
+    forest.remove_document(len(sample_docs))  # Still pending
+    forest.remove_document(0)
+    forest.update_document(1, sample_docs[3])
+    for idx, doc in enumerate([sample_docs[3]] + sample_docs[2:], start=1):
+        rebuilt.add_document(idx, doc)
+
+    assert forest.query(sample_docs[0]) == rebuilt.query(sample_docs[0])
+    assert sorted(forest.find_candidates()) == sorted(rebuilt.find_candidates())
+    assert {1, 3} <= set(forest.query(sample_docs[3]))
+    assert sorted(forest.doc_ids.tolist()) == sorted(rebuilt.doc_ids.tolist())
+    with pytest.raises(KeyError):
+        forest.remove_document(0)
+
+
+def test_segmented_index_matches_lsh_across_compactions(tmp_path):
+    """Test that segment fan-out and size-tiered merges keep queries and cluster ids stable."""
+    docs = near_duplicate_docs(11, families=30, length=30, variants=3, vocabulary=1000)
+    lsh = LSH(num_bands=10, rows_per_band=3, num_hashes=30)
+    for idx, doc in enumerate(docs):
+        lsh.add_document(idx, doc)
+    expected = {min(c): sorted(c) for c in lsh.cluster_candidates().values()}
+
+    index = SegmentedIndex(str(tmp_path), 10, 3, 30, min_merge=2, block_records=7)
+    for start in range(0, len(docs), 15):  # Batches interleave the families
+        batch = list(range(start, min(start + 15, len(docs))))
+        index.add_batch(batch, [docs[idx] for idx in batch])
+        if start == 45:
+            index.compact()
+    assert len(index.segments) > 1
+    assert index.cluster_candidates() == expected
+    assert index.query(docs[4]) == lsh.query(docs[4])
+
+    index.compact()
+    assert len(index.segments) < 4 and len(index) == len(docs)
+    assert index.cluster_candidates() == expected
+    assert index.query(docs[4]) == lsh.query(docs[4])
+    reopened = SegmentedIndex(str(tmp_path), 10, 3, 30)
+    assert reopened.cluster_candidates() == expected
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["manifest.json"] + [segment["file"] for segment in index.segments]
+    )
+    with pytest.raises(ValueError):
+        SegmentedIndex(str(tmp_path), 5, 6, 30)
+
+
+def test_segmented_index_compacts_in_background(tmp_path):
+    """Test that background compaction merges full tiers while ingest continues."""
+    index = SegmentedIndex(
+        str(tmp_path), 10, 5, 50, min_merge=2, background_compaction=True
+    )
+    for idx, doc in enumerate(sample_docs):
+        index.add_batch([idx], [doc])
+    index.wait()
+    index.compact()
+    assert len(index) == len(sample_docs)
+    assert len(index.segments) <= 2
+    assert len(index.signer.features) == 0 and not index.merging
+
+    for idx, doc in enumerate(sample_docs):
+        index.add_batch([len(sample_docs) + idx], [doc])
+    errors = []
+
+    def compact():
+        try:
+            index.compact()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=compact) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    index.wait()
+    assert not errors and not index.merging
+    assert len(index) == 2 * len(sample_docs)
+    assert any({0, 1} <= set(c) for c in index.cluster_candidates().values())
+
+
+def test_memory_plan_adapts_in_order_and_fails_fast():
+    """Test that the memory plan narrows and spills only as far as the budget requires."""
+    sizes = dict(num_documents=100000, text_bytes=50 * 10**6, num_hashes=100, num_bands=10)
+    full = sum(estimate_footprint(**sizes).values())
+    assert plan_memory(full, **sizes)["adaptations"] == []
+
+    plan = plan_memory(full // 2, **sizes)
+    assert plan["adaptations"] == ["no feature cache", "32-bit signatures"]
+    assert plan["settings"]["signature_bits"] == 32 and plan["expected"] <= full // 2
+
+    plan = plan_memory(full // 6, **sizes)
+    assert "spilled band tables" in plan["adaptations"]
+    assert plan["expected"] <= full // 6
+    with pytest.raises(MemoryError):
+        plan_memory(sizes["text_bytes"], **sizes)  # Less than the documents themselves
+    with pytest.raises(ValueError):
+        plan_memory(0, **sizes)
+
+
+def test_deduplicator_memory_budget_spills_and_reports_peak():
+    """Test that a tight budget spills band tables without changing clusters and reports the peak."""
+    docs = near_duplicate_docs(5, families=200, length=20, vocabulary=2000)
+    sizes = dict(
+        num_documents=len(docs),
+        text_bytes=sum(len(doc) for doc in docs),
+        num_hashes=50,
+        num_bands=10,
+    )
+    narrowed = dict(sizes, signature_bits=32, feature_entries=0)
+    in_memory = sum(estimate_footprint(**narrowed).values())
+    spilled = sum(estimate_footprint(**narrowed, spill_bytes=64 * 1024).values())
+    budget = (in_memory + spilled) // 2
+    lsh_params = (10, 5, 50, 5, "oph")
+
+    budgeted = DocumentDeduplicator(lsh_params=lsh_params, max_memory=budget)
+    _, clusters = budgeted.deduplicate_collection(docs)
+    report = budgeted.memory_report
+    assert "spilled band tables" in report["adaptations"]
+    assert report["expected"] <= budget and 0 < report["actual_peak"] <= budget
+
+    reference = DocumentDeduplicator(
+        bloom_filter_params=(len(docs), 0.01), lsh_params=lsh_params, signature_bits=32
+    )
+    _, expected = reference.deduplicate_collection(docs)
+    assert sorted(map(sorted, clusters)) == sorted(map(sorted, expected))
+
+
+def test_blocked_bloom_filter_batches_match_items_and_rate_is_corrected():
+    """Test the blocked Bloom filter's batch/scalar agreement and its corrected false positive rate."""
+    bf = BlockedBloomFilter(num_elements=5000, false_positive_rate=0.01)
+    members = [f"element_{i}" for i in range(5000)]
+    bf.add_batch(members[:2500])
+    for item in members[2500:]:
+        bf.add(item)
+    assert bf.contains_batch(members).all()
+    assert all(bf.contains(item) for item in members[:100])
+
+    queries = [f"other_{i}" for i in range(20000)]
+    hits = bf.contains_batch(queries)
+    assert hits.tolist() == [bf.contains(item) for item in queries]
+    expected = bf.expected_false_positive_rate(bf.num_blocks, 5000, bf.num_hashes)
+    assert expected <= 0.01
+    assert abs(hits.mean() - expected) < 0.004
+    # Uneven block loads make a blocked filter of standard size miss the target
+    standard_blocks = BloomFilter(5000, 0.01).size // BlockedBloomFilter.BLOCK_BITS
+    assert bf.num_blocks > standard_blocks
+    assert bf.expected_false_positive_rate(standard_blocks, 5000, bf.num_hashes) > 0.01
+
+    assert bf.add_batch(["new", "newer", "new", "element_1"]).tolist() == [
+        False,
+        False,
+        True,
+        True,
+    ]
+
+
+def test_deduplicator_blocked_bloom_filter_finds_exact_duplicates():
+    """Test that the blocked Bloom filter finds the same exact duplicates, including repeats within a batch."""
+    documents = sample_docs + sample_docs[:2] + [sample_docs[0]]
+    standard = DocumentDeduplicator(lsh_params=(10, 5, 50))
+    blocked = DocumentDeduplicator(lsh_params=(10, 5, 50), bloom_filter_type="blocked")
+    assert blocked.remove_exact_duplicates(documents) == standard.remove_exact_duplicates(
+        documents
+    )
+    with pytest.raises(ValueError):
+        DocumentDeduplicator(bloom_filter_type="cuckoo")
+
+
+def test_cuckoo_filter_adds_removes_and_reports_load():
+    """Test cuckoo filter membership, deletion, bulk operations and load factor."""
+    cf = CuckooFilter(num_elements=2000, false_positive_rate=0.01, seed=0)
+    members = [f"element_{i}" for i in range(2000)]
+    assert cf.add_batch(members[:1000]).all()
+    for item in members[1000:]:
+        assert cf.add(item)
+    assert len(cf) == 2000 and cf.load_factor == 2000 / cf.capacity
+    assert cf.contains_batch(members).all()
+
+    queries = [f"other_{i}" for i in range(20000)]
+    hits = cf.contains_batch(queries)
+    assert hits.tolist() == [cf.contains(item) for item in queries]
+    assert hits.mean() < 0.01
+
+    assert cf.remove_batch(members[:1000]).all() and len(cf) == 1000
+    assert cf.contains_batch(members[1000:]).all()
+    assert cf.contains_batch(members[:1000]).mean() < 0.01
+    assert cf.remove("element_1500") and not cf.contains("element_1500")
+    assert cf.nbytes < len(CountingBloomFilter(2000, 0.01).bit_array) // 8
+
+
+def test_cuckoo_filter_bounded_evictions_keep_every_stored_item():
+    """Test that a full cuckoo filter stops accepting items without losing stored ones."""
+    cf = CuckooFilter(num_elements=100, bucket_size=2, max_kicks=20, seed=1)
+    items = [f"item_{i}" for i in range(cf.capacity + 50)]
+    added = cf.add_batch(items)
+    assert not added.all() and cf.victim is not None
+    assert cf.load_factor > 0.5
+    assert cf.contains_batch([item for item, ok in zip(items, added) if ok]).all()
+    stored = [item for item, ok in zip(items, added) if ok]
+    for item in stored[:10]:
+        assert cf.remove(item)
+    assert cf.victim is None and cf.add("one more")
+
+
+def test_sliding_window_expires_old_generations_by_count():
+    """Test that duplicates are found only within the window and expiry is bounded."""
+    window = SlidingWindowDeduplicator(
+        lsh_params=(16, 4, 64, 3, "oph"), num_generations=2, generation_size=5
+    )
+    base = "the quick brown fox jumps over the lazy dog near the river bank"
+    assert not window.add(base)["duplicate"]
+    repeat = window.add(base)
+    assert repeat["exact"] and [m["id"] for m in repeat["matches"]] == [0]
+    fillers = [f"filler document number {i} with unrelated words {i * 7}" for i in range(20)]
+    for doc in fillers:
+        window.add(doc)
+        assert len(window) <= 2 * 5
+    assert window.expired == 22 - len(window)
+    assert window.window_ids().tolist() == list(range(window.expired, 22))
+    late = window.add(base)
+    assert not late["duplicate"] and late["matches"] == []
+
+
+def test_sliding_window_rotates_by_age():
+    """Test time-based rotation, including a gap longer than the whole window."""
+    window = SlidingWindowDeduplicator(
+        lsh_params=(16, 4, 64, 3, "oph"),
+        num_generations=3,
+        generation_seconds=10,
+        generation_size=100,
+    )
+    doc = "streams of documents arrive over time and age out of the window"
+    window.add(doc, timestamp=0)
+    assert window.add(doc, timestamp=25)["duplicate"]
+    assert [g.number for g in window.generations] == [0, 1, 2]
+    assert not window.add(doc, timestamp=1000)["duplicate"]
+    assert len(window.generations) == 3 and window.expired == 2
+    assert window.generations[-1].started == 1000
+    assert window.add(doc, timestamp=1005)["duplicate"]
+
+
+def test_hyperloglog_estimates_merges_and_serializes():
+    """Test HyperLogLog accuracy, batch/item agreement, merging and round trips."""
+    items = [f"doc_{i % 30000}" for i in range(50000)]
+    sketch = HyperLogLog(precision=12)
+    sketch.add_batch(items)
+    assert abs(sketch.count() - 30000) <= 3 * sketch.relative_error * 30000
+
+    single = HyperLogLog(precision=12)
+    for item in items[:2000]:
+        single.add(item)
+    batch = HyperLogLog(precision=12)
+    batch.add_batch(items[:2000])
+    assert np.array_equal(single.registers, batch.registers)
+    assert HyperLogLog().count() == 0 and single.count() in range(1950, 2050)
+
+    left, right = HyperLogLog(precision=12), HyperLogLog(precision=12)
+    left.add_batch(items[:25000])
+    right.add_batch(items[25000:])
+    left.merge(right)
+    assert np.array_equal(left.registers, sketch.registers)
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.count() == sketch.count()
+    with pytest.raises(ValueError):
+        left.merge(HyperLogLog(precision=10))
+
+    estimate, _ = estimate_distinct(items, sample_size=10000, seed=0)
+    assert 30000 * 0.9 <= estimate <= len(items)
+    repeated = [f"doc_{i % 1000}" for i in range(50000)]
+    estimate, error = estimate_distinct(repeated, sample_size=5000, seed=0)
+    assert 1000 <= estimate <= 1100 and error < 0.1
+
+
+def test_deduplicator_estimate_capacity_sizes_bloom_filter():
+    """Test that the HyperLogLog pre-pass sizes the filter for the distinct documents."""
+    distinct = near_duplicate_docs(3, families=3000, length=12, variants=1)
+    docs = distinct * 2
+    sized = DocumentDeduplicator(
+        lsh_params=(10, 5, 50, 5, "oph"), estimate_capacity=True
+    )
+    exact, _ = sized.deduplicate_collection(docs)
+    assert 3000 <= sized.capacity <= 3300
+    assert sized.bloom_filter.size == BloomFilter(sized.capacity, 0.01).size
+    # Every repeat is caught; first copies are misflagged only at the filter's rate
+    assert set(distinct) <= set(exact)
+    assert len(exact) - 3000 <= 0.02 * 3000
+
+
+@pytest.mark.parametrize("memory_budget", [None, 1 << 16])
+def test_two_pass_indexing_drops_singleton_buckets(memory_budget):
+    """Test that two-pass indexing stores fewer band records and gives the same clusters."""
+    docs = near_duplicate_docs(11, families=90, length=25) + near_duplicate_docs(
+        12, families=210, length=25, variants=1
+    )
+    lsh_params = (10, 3, 30, 5, "oph")
+
+    single = LSH(*lsh_params)
+    for idx, doc in enumerate(docs):
+        single.add_document(idx, doc)
+    two_pass = LSH(*lsh_params, memory_budget=memory_budget)
+    stats = two_pass.add_documents_two_pass(
+        list(range(len(docs))), docs, batch_size=64
+    )
+    assert len(two_pass.features) == 0
+    assert stats["band_records"] == 10 * len(docs)
+    assert stats["stored_records"] < stats["band_records"] / 2
+    if memory_budget is None:
+        assert len(two_pass.buckets) < len(single.buckets) / 2
+        singletons = sum(len(bucket) == 1 for bucket in two_pass.buckets.values())
+        assert singletons <= 0.05 * len(two_pass.buckets)  # Only filter false positives
+    assert cluster_sets(two_pass.cluster_candidates()) == cluster_sets(
+        single.cluster_candidates()
+    )
+    if two_pass.external is not None:
+        two_pass.external.close()
+
+    shifted = LSH(*lsh_params)
+    shifted.add_documents_two_pass([idx + 1000 for idx in range(len(docs))], docs)
+    assert cluster_sets(shifted.cluster_candidates()) == [
+        [doc_id + 1000 for doc_id in cluster]
+        for cluster in cluster_sets(single.cluster_candidates())
+    ]
+
+
 if __name__ == "__main__":
     pytest.main()